@@ -0,0 +1,75 @@
+"""
+Compares the old root finding level maths with `joku.core.levels`.
+
+Every XP amount from 0 to N is checked against the old implementation first. The only differences allowed are at
+exact level thresholds, where the old floating point root can land just below the integer and give the level
+before.
+
+Usage (from the repository root): python -m benchmarks.levels [max xp] [batch size]
+"""
+import sys
+import time
+from math import floor
+
+import numpy as np
+from numpy.polynomial import Polynomial as P
+
+from joku.core.levels import INCREASING_FACTOR, get_exp_for_level, get_level_from_exp, get_levels_from_exp
+
+
+def roots_level_from_exp(xp: int, a: int = INCREASING_FACTOR) -> int:
+    """
+    The old implementation, which solves (a/2)n**2 + (a/2)n - xp = 0 with numpy.
+    """
+    if xp < a:
+        return 1
+
+    ab = a / 2
+    root = P([-xp, ab, ab]).roots()[1] + 1
+    return int(floor(root))
+
+
+def check(max_xp: int):
+    xps = np.arange(max_xp + 1)
+    batch = get_levels_from_exp(xps)
+
+    differences = 0
+    for xp in range(max_xp + 1):
+        old, new = roots_level_from_exp(xp), get_level_from_exp(xp)
+        assert new == batch[xp], "batch level of {} is {}, not {}".format(xp, batch[xp], new)
+        assert get_exp_for_level(new) <= xp < get_exp_for_level(new + 1), "{} XP is not level {}".format(xp, new)
+
+        if old != new:
+            # only allowed at a threshold, where the old root is a hair too small
+            assert xp == get_exp_for_level(new) and old == new - 1, "{} XP: old {}, new {}".format(xp, old, new)
+            differences += 1
+
+    print("checked 0..{}: {} thresholds the old implementation got wrong".format(max_xp, differences))
+
+
+def _time(fn, calls: int) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main(max_xp: int, batch_size: int):
+    check(max_xp)
+
+    xps = np.random.randint(0, 10000000, size=batch_size)
+    values = xps.tolist()
+
+    print("{:>8}: {:>8.2f} us/level".format("roots", _time(lambda: [roots_level_from_exp(x) for x in values],
+                                                           batch_size)))
+    print("{:>8}: {:>8.2f} us/level".format("exact", _time(lambda: [get_level_from_exp(x) for x in values],
+                                                           batch_size)))
+    print("{:>8}: {:>8.3f} us/level ({} levels)".format("batch", _time(lambda: get_levels_from_exp(xps),
+                                                                       batch_size), batch_size))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    max_xp = int(args[0]) if len(args) > 0 else 200000
+    batch_size = int(args[1]) if len(args) > 1 else 100000
+
+    main(max_xp, batch_size)
@@ -0,0 +1,79 @@
+"""
+Checks the instruction limit of the Lua sandbox, and times the instruction hook.
+
+Every script in `ESCAPES` must be stopped by the limits, including scripts catching the limit error with `pcall`
+and carrying on. The hook is then timed on the same loop at a stride of 1 and at the sandbox's default stride.
+
+Usage (from the repository root): python -m benchmarks.lua_sandbox [instruction limit]
+"""
+import sys
+import time
+
+from joku.cogs.lua import SandboxedRuntime, tag_getter
+
+#: Scripts that must not run to completion.
+ESCAPES = [
+    "while true do end",
+    "while true do pcall(function() while true do end end) end",
+    "while true do pcall(function() while true do pcall(function() while true do end end) end end) end",
+    "local t = {} for i = 1, 1e8 do t[i] = {i, i, i, i} end return #t",
+    "while true do pcall(function() local t = {} for i = 1, 1e8 do t[i] = {i, i, i, i} end end) end",
+    "xpcall(function() while true do end end, function(m) while true do end end)",
+    "while true do xpcall(function() while true do end end, function(m) return m end) end",
+    "xpcall(function() error('x') end, function(m) while true do end end)",
+]
+
+#: A script that stays within the limits, for timing.
+LOOP = "local s = 0 for i = 1, 200000 do s = s + i end return s"
+
+
+def _run(runtime: SandboxedRuntime, key, code: str):
+    from lupa import LuaError
+
+    try:
+        return runtime.run_cached(key, code, {})
+    except LuaError as e:
+        return False, str(e).splitlines()[0]
+
+
+def check(instruction_limit: int):
+    runtime = SandboxedRuntime(tag_getter, instruction_limit=instruction_limit)
+
+    for i, code in enumerate(ESCAPES):
+        if runtime.spent:
+            runtime = SandboxedRuntime(tag_getter, instruction_limit=instruction_limit)
+
+        start = time.perf_counter()
+        result = _run(runtime, ("escape", i), code)
+        taken = time.perf_counter() - start
+
+        assert result[0] is False, "escaped the limits: {}".format(code)
+        print("{:>8.3f}s: {} ({})".format(taken, code, result[1]))
+
+    # the runtime is still usable after being stopped
+    runtime = SandboxedRuntime(tag_getter, instruction_limit=instruction_limit)
+    _run(runtime, ("escape", 0), ESCAPES[0])
+    assert runtime.run_cached(("ok",), "return 1 + 1", {}) == (True, 2), "runtime broken after hitting the limit"
+
+
+def _time(runtime: SandboxedRuntime, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        runtime.run_cached(("loop",), LOOP, {})
+
+    return (time.perf_counter() - start) / calls * 1e3
+
+
+def main(instruction_limit: int):
+    check(instruction_limit)
+
+    runtime = SandboxedRuntime(tag_getter, instruction_limit=instruction_limit)
+    default_stride = runtime.sandbox.hook_stride
+    for stride in (1, default_stride):
+        runtime.sandbox.hook_stride = stride
+        print("stride {:>5}: {:>8.2f} ms/run".format(stride, _time(runtime, 20)))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 2000000)
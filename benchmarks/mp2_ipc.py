@@ -0,0 +1,89 @@
+"""
+Compares the per-call overhead of the dill, named task and batched task paths of
+`joku.core.mp2.ProcessPoolExecutor`.
+
+Each call sends a typical tag render context and returns a short string. The task itself does no work, so the
+times are almost entirely serialization and IPC. The dill path submits a `functools.partial`, as the tag engine
+used to. The batched path submits every call at once with `submit_tasks`.
+
+Usage (from the repository root): python -m benchmarks.mp2_ipc [calls] [workers]
+"""
+import datetime
+import functools
+import pickle
+import sys
+import time
+
+import dill
+
+from joku.core.mp2 import ProcessPoolExecutor, encode_plain, register_task
+
+
+@register_task("benchmarks.echo")
+def echo(tag_id: int, version: str, content: str, kwargs: dict) -> str:
+    return content
+
+
+def _context() -> dict:
+    now = datetime.datetime.utcnow()
+    guild = {"name": "A guild", "icon_url": "https://cdn.discordapp.com/icons/1/a.png", "id": 1,
+             "member_count": 1234, "created_at": now}
+    author = {"name": "someone", "nick": None, "discriminator": "1234", "id": 2, "colour": "#ff00ff",
+              "mention": "<@2>", "permissions": {"administrator": False, "send_messages": True},
+              "joined_at": now, "created_at": now, "guild": guild}
+    return {"args": ["a", "b c"], "clean_args": ["a", "b c"], "author": author, "server": guild,
+            "message": {"id": 3, "content": "!tag a 'b c'", "author": author, "guild": guild}}
+
+
+def _run(calls: int, submit) -> float:
+    start = time.perf_counter()
+    futures = [submit() for _ in range(calls)]
+    for future in futures:
+        future.result()
+
+    return time.perf_counter() - start
+
+
+def main(calls: int, workers: int):
+    args = (1, "2017-01-01T00:00:00", "{{ author.name }} says hello", _context())
+
+    payload_dill = dill.dumps(functools.partial(echo, *args))
+    payload_plain = encode_plain((args, {}))
+    print("payload: dill {} bytes, plain {} bytes".format(len(payload_dill), len(payload_plain)))
+
+    for name, dumps in (("dill", lambda: dill.dumps(functools.partial(echo, *args))),
+                        ("plain", lambda: pickle.dumps((args, {}), pickle.HIGHEST_PROTOCOL))):
+        start = time.perf_counter()
+        for _ in range(calls):
+            dumps()
+        print("{:>6} encode: {:>8.1f} us/call".format(name, (time.perf_counter() - start) / calls * 1e6))
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    executor.prewarm()
+    try:
+        # warm both paths up before timing them
+        _run(workers * 4, lambda: executor.submit(functools.partial(echo, *args)))
+        _run(workers * 4, lambda: executor.submit_task("benchmarks.echo", *args))
+
+        for name, submit in (("dill", lambda: executor.submit(functools.partial(echo, *args))),
+                             ("task", lambda: executor.submit_task("benchmarks.echo", *args))):
+            taken = _run(calls, submit)
+            print("{:>6} round trip: {:>8.1f} us/call ({} calls, {} workers)"
+                  .format(name, taken / calls * 1e6, calls, workers))
+
+        start = time.perf_counter()
+        for future in executor.submit_tasks("benchmarks.echo", [args] * calls):
+            future.result()
+        taken = time.perf_counter() - start
+        print("{:>6} round trip: {:>8.1f} us/call ({} calls, {} workers)"
+              .format("batch", taken / calls * 1e6, calls, workers))
+    finally:
+        executor.shutdown()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    calls = int(args[0]) if len(args) > 0 else 5000
+    workers = int(args[1]) if len(args) > 1 else 4
+
+    main(calls, workers)
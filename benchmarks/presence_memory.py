@@ -0,0 +1,73 @@
+"""
+Compares the Redis memory usage of the legacy and compact presence layouts.
+
+This writes fake presence data for N users into a scratch Redis database and reports `used_memory`
+for each layout. The database is flushed before and after each run, so do NOT point this at the
+bot's database.
+
+Usage (from the repository root): python -m benchmarks.presence_memory [users] [host] [port] [db]
+"""
+import asyncio
+import random
+import sys
+import time
+
+import aioredis
+
+from joku.core.redis import PRESENCE_STRUCT, get_presence_bucket
+
+
+async def _used_memory(redis: aioredis.Redis) -> int:
+    info = await redis.info("memory")
+    return int(info["memory"]["used_memory"])
+
+
+async def fill_legacy(redis: aioredis.Redis, ids: list):
+    now = time.time()
+    for user_id in ids:
+        await redis.hmset_dict("presence:{}".format(user_id), last_seen=now, last_message=now)
+        await redis.incr("presence:{}:msgs".format(user_id))
+
+
+async def fill_compact(redis: aioredis.Redis, ids: list):
+    now = int(time.time())
+    for user_id in ids:
+        bucket, field = get_presence_bucket(user_id)
+        await redis.hset(bucket, field, PRESENCE_STRUCT.pack(now, now, 1))
+
+
+async def main(users: int, host: str, port: int, db: int):
+    redis = await aioredis.create_redis((host, port), db=db)
+
+    # snowflakes for accounts made over the last ~2 years
+    epoch = 1420070400000
+    now_ms = int(time.time() * 1000)
+    ids = [((random.randint(now_ms - 63072000000, now_ms) - epoch) << 22) | random.getrandbits(22)
+           for _ in range(users)]
+
+    results = {}
+    for name, fill in (("legacy", fill_legacy), ("compact", fill_compact)):
+        await redis.flushdb()
+        before = await _used_memory(redis)
+        start = time.perf_counter()
+        await fill(redis, ids)
+        taken = time.perf_counter() - start
+        results[name] = (await _used_memory(redis) - before, taken)
+
+    await redis.flushdb()
+    redis.close()
+
+    print("{} users".format(users))
+    for name, (used, taken) in results.items():
+        print("{:>8}: {:>10.2f} MiB ({:.1f} bytes/user), filled in {:.2f}s"
+              .format(name, used / 1024 ** 2, used / users, taken))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    users = int(args[0]) if len(args) > 0 else 100000
+    host = args[1] if len(args) > 1 else "127.0.0.1"
+    port = int(args[2]) if len(args) > 2 else 6379
+    db = int(args[3]) if len(args) > 3 else 15
+
+    asyncio.get_event_loop().run_until_complete(main(users, host, port, db))
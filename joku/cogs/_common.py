@@ -13,6 +13,9 @@ class _CogMeta(type):
 
 
 class Cog(metaclass=_CogMeta):
+    #: The services that must be connected before this cog's `ready()` is ran.
+    requires = ("database", "redis")
+
     def __init__(self, bot: Jokusoramame):
         self._bot = bot
 
@@ -10,9 +10,6 @@ import platform
 
 import aiohttp
 import discord
-import git
-import psutil
-import tabulate
 from discord.ext import commands
 from discord.ext.commands import CheckFailure, Command
 from discord.ext.commands.bot import _default_help_command
@@ -29,11 +26,6 @@ class Core(Cog):
     Core command class.
     """
 
-    def __init__(self, bot: Jokusoramame):
-        super().__init__(bot)
-
-        self._is_loaded = False
-
     async def on_channel_create(self, channel: discord.TextChannel):
         if channel.guild is None:
             return
@@ -45,32 +37,43 @@ class Core(Cog):
         await channel.send("first")
 
     async def ready(self):
-        if self.bot.shard_id != 0:
-            return
+        await self.bot.jobs.run_as_leader("dbots_stats", self._upload_stats)
 
-        if self._is_loaded:
-            return
+    async def _get_server_count(self) -> int:
+        """
+        Gets the number of guilds the bot is in, across every cluster.
+        """
+        if self.bot.cluster_id is None:
+            return len(self.bot.guilds)
+
+        # every cluster only holds some of the guilds, so add up the counts from their heartbeats
+        statuses = await self.bot.redis.get_cluster_statuses()
+        return sum(int(status.get("guilds", 0)) for status in statuses.values())
 
-        self._is_loaded = True
+    async def _upload_stats(self, token: int):
+        """
+        Uploads the server count to bots.discord.pw every 15 seconds.
 
+        This only runs on the node that owns the `dbots_stats` job.
+        """
         # Start the Discord Bots stats uploader.
         with aiohttp.ClientSession() as sess:
             while True:
                 try:
-                    token = self.bot.config.get("dbots_token", None)
-                    if not token:
+                    api_token = self.bot.config.get("dbots_token", None)
+                    if not api_token:
                         self.bot.logger.error("Cannot get token.")
                         return
 
                     # Make a POST request.
                     headers = {
-                        "Authorization": token,
+                        "Authorization": api_token,
                         "User-Agent": "Jokusoramame - Powered by Python 3",
                         "X-Fuck-Meew0": "true",
                         "Content-Type": "application/json"
                     }
                     body = {
-                        "server_count": str(sum(1 for server in self.bot.guilds))
+                        "server_count": str(await self._get_server_count())
                     }
 
                     url = "https://bots.discord.pw/api/bots/{}/stats".format(self.bot.user.id)
@@ -135,6 +138,10 @@ class Core(Cog):
         """
         Shows botto info.
         """
+        # these are slow to import, and only needed here
+        import git
+        import psutil
+
         repo = git.Repo()
         curr_branch = repo.active_branch
         commits = list(repo.iter_commits(curr_branch, max_count=3))
@@ -168,8 +175,8 @@ class Core(Cog):
         embed.add_field(name="Version", value=VERSION)
 
         embed.add_field(name="Servers", value=str(sum(1 for x in ctx.bot.guilds)))
-        embed.add_field(name="Users", value=str(sum(1 for x in ctx.bot.get_all_members())))
-        embed.add_field(name="Unique users", value=str(len(set(m.id for m in ctx.bot.get_all_members()))))
+        embed.add_field(name="Users", value=str(sum(g.member_count for g in ctx.bot.guilds)))
+        embed.add_field(name="Unique users", value=str(ctx.bot.indexes.user_count))
 
         embed.add_field(name="Python version", value=platform.python_version())
         embed.add_field(name="Hostname", value=platform.node())
@@ -3,7 +3,9 @@ Debug cog.
 """
 import asyncio
 import inspect
+import io
 import sys
+import time
 import traceback
 
 import discord
@@ -16,10 +18,16 @@ from sqlalchemy.exc import ProgrammingError, DatabaseError
 from joku.cogs._common import Cog
 from joku.core.bot import Context
 from joku.core.checks import is_owner
-from joku.core.utils import paginate_table
+from joku.core.profiler import MAX_PROFILE_SECONDS, SamplingProfiler
+from joku.core.utils import paginate_table, paginate_large_message
 
 
 class Debug(Cog):
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        self.profiler = SamplingProfiler()
+
     @commands.command(pass_context=True)
     @commands.check(is_owner)
     async def load(self, ctx, *, cog):
@@ -107,6 +115,176 @@ class Debug(Cog):
         stuck = await ctx.bot.redis.clean_stuck_antispam()
         await ctx.send(":heavy_check_mark: Cleaned `{}` stuck anti-spam keys.".format(stuck))
 
+    @debug.command(pass_context=True)
+    async def migratepresence(self, ctx: Context):
+        """
+        Migrates presence data into the compact Redis layout.
+
+        Set `presence_storage: compact` in the config before running this.
+        """
+        if not ctx.bot.redis.compact_presence:
+            await ctx.send(":x: Presence data is still read from the legacy keys, which this would delete. "
+                           "Set `presence_storage: compact` in the config and reload it first.")
+            return
+
+        async with ctx.channel.typing():
+            migrated = await ctx.bot.redis.migrate_presence_data()
+
+        await ctx.send(":heavy_check_mark: Migrated presence data for `{}` users.".format(migrated))
+
+    @debug.command(pass_context=True)
+    async def clusters(self, ctx: Context):
+        """
+        Shows the status of every cluster.
+        """
+        statuses = await ctx.bot.redis.get_cluster_statuses()
+        if not statuses:
+            await ctx.send(":x: Not running in cluster mode.")
+            return
+
+        headers = ["Cluster", "Shards", "Guilds", "Latency (ms)", "PID", "Last update (s)"]
+        rows = []
+        for cluster_id, status in sorted(statuses.items()):
+            rows.append([cluster_id, status["shards"], status["guilds"], status["latency"], status["pid"],
+                         round(time.time() - float(status["updated"]), 1)])
+
+        for page in paginate_table(rows, headers):
+            await ctx.send(page)
+
+    @debug.command(pass_context=True)
+    async def jobs(self, ctx: Context):
+        """
+        Shows which node owns each periodic job.
+        """
+        owners = await ctx.bot.jobs.get_owners()
+        if not owners:
+            await ctx.send(":x: No jobs are currently owned.")
+            return
+
+        rows = [[name, owner, "yes" if owner == ctx.bot.jobs.node_id else ""]
+                for (name, owner) in sorted(owners.items())]
+        for page in paginate_table(rows, ["Job", "Owner", "This node"]):
+            await ctx.send(page)
+
+    @debug.command(pass_context=True)
+    async def listeners(self, ctx: Context):
+        """
+        Shows how long each message listener takes per message.
+        """
+        stats = ctx.bot.listener_stats
+        if not stats.messages:
+            await ctx.send(":x: No messages have been processed yet.")
+            return
+
+        await ctx.send("**{} messages, {:.2f}ms per message in total.**"
+                       .format(stats.messages, stats.total_time / stats.messages * 1000))
+
+        headers = ["Listener", "Calls", "Mean (ms)", "Max (ms)", "Per message (ms)", "Errors"]
+        for page in paginate_table(stats.get_rows(), headers):
+            await ctx.send(page)
+
+    @debug.command(pass_context=True)
+    async def logstats(self, ctx: Context):
+        """
+        Shows logging pipeline statistics.
+        """
+        handler = ctx.bot.log_handler
+        stats = handler.stats
+
+        rows = []
+        for reason, categories in sorted(stats.dropped.items()):
+            for category, count in categories.most_common():
+                rows.append([reason, category, count])
+
+        await ctx.send("**Written:** `{}` **Dropped:** `{}` **Queued:** `{}`"
+                       .format(stats.written, stats.total_dropped, handler.queue.qsize()))
+        if rows:
+            for page in paginate_table(rows, ["Reason", "Category", "Count"]):
+                await ctx.send(page)
+
+    @debug.command(pass_context=True)
+    async def tasks(self, ctx: Context, prune: bool = False):
+        """
+        Shows every background task, grouped by owner.
+
+        Pass `yes` to forget about crashed and cancelled tasks afterwards.
+        """
+        supervisor = ctx.bot.tasks
+        counts = supervisor.get_counts()
+        if not counts:
+            await ctx.send(":x: No background tasks.")
+            return
+
+        summary = ", ".join("**{}**: {}".format(owner, " ".join("`{}` {}".format(count, state)
+                                                                  for (state, count) in sorted(states.items())))
+                            for (owner, states) in sorted(counts.items()))
+        await ctx.send(summary)
+
+        headers = ["Owner", "Task", "State", "CPU (ms)", "Steps", "Restarts", "Age (s)"]
+        for page in paginate_table(supervisor.get_rows(), headers):
+            await ctx.send(page)
+
+        if prune:
+            supervisor.prune()
+
+    @debug.command(pass_context=True)
+    async def lag(self, ctx: Context, reset: bool = False):
+        """
+        Shows the event loop lag, and the code that blocked the loop most often.
+
+        Pass `yes` to clear the collected stacks afterwards.
+        """
+        report = ctx.bot.watchdog.format_report()
+        for page in paginate_large_message(report):
+            await ctx.send(page)
+
+        if reset:
+            ctx.bot.watchdog.reset()
+
+    @debug.command(pass_context=True, name="commands")
+    async def command_timings(self, ctx: Context):
+        """
+        Shows where each command spends its time, on average.
+        """
+        rows = ctx.bot.command_timer.get_rows()
+        if not rows:
+            await ctx.send(":x: No commands have been timed yet.")
+            return
+
+        headers = ["Command", "Calls", "Wall", "Max", "DB", "Redis", "Executor", "HTTP", "Other"]
+        for page in paginate_table(rows, headers):
+            await ctx.send(page)
+
+    @debug.command(pass_context=True)
+    async def profile(self, ctx: Context, seconds: float = 10):
+        """
+        Runs a sampling profiler over the whole process, and uploads the collapsed stacks.
+
+        Feed the file to `flamegraph.pl` or speedscope to get a flamegraph.
+        """
+        if seconds <= 0 or seconds > MAX_PROFILE_SECONDS:
+            await ctx.send(":x: Profiles must be between 0 and {} seconds.".format(MAX_PROFILE_SECONDS))
+            return
+
+        await ctx.send(":stopwatch: Profiling for {} seconds...".format(seconds))
+        try:
+            data = await ctx.bot.loop.run_in_executor(None, self.profiler.run, seconds)
+        except RuntimeError as e:
+            await ctx.send(":x: {}.".format(e))
+            return
+
+        await ctx.send(":heavy_check_mark: Collected `{}` samples.".format(self.profiler.samples),
+                       file=io.BytesIO(data), filename="profile-{}.folded".format(int(time.time())))
+
+    @debug.command(pass_context=True)
+    async def startup(self, ctx: Context):
+        """
+        Shows the startup time breakdown.
+        """
+        report = "\n".join(ctx.bot.profiler.get_report())
+        for page in paginate_large_message(report):
+            await ctx.send(page)
+
     @debug.command(pass_context=True)
     async def update(self, ctx: Context):
         """
@@ -7,6 +7,7 @@ from discord.ext import commands
 from joku.cogs._common import Cog
 from joku.core.bot import Context
 from joku.core.checks import has_permissions, mod_command
+from joku.core.events import MessageContext
 
 
 class InvisCop(Cog):
@@ -38,17 +39,18 @@ class InvisCop(Cog):
             else:
                 await ctx.channel.send(":x: No.")
 
-    async def on_message(self, message: discord.Message):
+    async def on_message_context(self, ctx: MessageContext):
         """
         Checks for people on invisible, and deletes their message.
         """
+        message = ctx.message
         if message.guild is None:
             return
 
         if message.author.bot:
             return
 
-        enabled = await self.bot.database.get_setting(message.guild, "dndcop", {})
+        enabled = await ctx.get_setting("dndcop")
 
         if enabled == "true":
             # Check the author's status for being not ONLINE or AWAY.
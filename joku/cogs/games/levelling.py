@@ -1,89 +1,40 @@
 """
 cancer
 """
-import textwrap
+import hashlib
 from io import BytesIO
-from math import ceil, floor
 
-import asyncio
 import discord
-import matplotlib as mpl
-from asyncio_extras import threadpool
+import numpy as np
 from discord.ext import commands
 
 from joku.core import checks
 from joku.core.checks import mod_command
-
-mpl.use('Agg')
-
-import matplotlib.pyplot as plt
-import numpy as np
-from numpy.polynomial import Polynomial as P
-import seaborn as sns
-
 from joku.core.bot import Jokusoramame, Context
+from joku.core.chartcache import ChartCache
+from joku.core.events import MessageContext
+from joku.core.levels import get_exp_for_level, get_level_from_exp, get_levels_from_exp, get_next_exp_required
 from joku.db.tables import User
 from joku.cogs._common import Cog
-from joku.core.utils import paginate_table, reject_outliers
-
-INCREASING_FACTOR = 50
-
-
-def get_level_from_exp(xp: int, a: int = INCREASING_FACTOR) -> int:
-    """
-    Gets the level from the experience number.
-
-    U(n) = a* (n*(n+1)  / 2), a ∈ ℝ, a > 0
-    :param a: The levelling up constant.
-    :param xp: The XP this user currently has.
-    """
-    # Make sure XP is below INCREASING_FACTOR.
-    if xp < a:
-        # Level 1
-        return 1
-
-    # The equation that we need to solve is (a/2)n**2 + (a/2)n - xp = 0.
-    # So we get numpy to find our roots.
-    ab = a / 2
-    # C, B, A
-    to_solve = [-xp, ab, ab]
-    poly = P(to_solve)
-
-    # Positive root + 1
-    root = poly.roots()[1] + 1
-    return int(floor(root))
-
-
-def get_next_exp_required(xp: int, a: int = INCREASING_FACTOR):
-    """
-    Gets the EXP required for the next level, based on the current EXP.
-
-    :param a: The levelling up constant.
-    :param xp: The XP this user currently has.
-    :return: The amount of XP required for the next level, and the current level.
-    """
-    # No complxes
-    if xp < a:
-        return 1, a - xp
-
-    # Solve the current level.
-    current_level = get_level_from_exp(xp, a)
-
-    # Substitute in (n+1) to a* (n*(n+1)  / 2), where n == current_level
-    # or not idk
-    exp_required = int(a * (current_level * (current_level + 1) / 2))
-
-    return current_level, exp_required - xp
+from joku.core.utils import paginate_table
 
 
 class Levelling(Cog):
-    plot_lock = asyncio.Lock()
+    def __init__(self, bot: Jokusoramame):
+        super().__init__(bot)
+
+        # Rendered level plots, by guild and level distribution.
+        self.charts = ChartCache(bot)
 
-    async def on_message(self, message: discord.Message):
+    async def on_message_context(self, ctx: MessageContext):
         # Add XP, and show if they levelled up.
+        message = ctx.message
         if message.author.bot:
             return
 
+        if message.guild is None:
+            return
+
         # No discord bots, thanks.
         if message.guild.id == 110373943822540800:
             return
@@ -92,7 +43,7 @@ class Levelling(Cog):
             return
 
         # Check the spam quotient.
-        if not await self.bot.redis.prevent_spam(message.author):
+        if not await ctx.antispam_ok():
             # The user said more than 15 messages in the last 60 seconds, so don't add XP.
             return
 
@@ -100,7 +51,7 @@ class Levelling(Cog):
         #if await self.bot.database.is_channel_ignored(message.channel, type_="levels"):
         #    return
 
-        user = await self.bot.database.update_user_xp(message.author)
+        user = await self.bot.database.update_user_xp(message.author, user=await ctx.user_row())
         # Get the level.
         new_level = get_level_from_exp(user.xp)
 
@@ -205,7 +156,9 @@ class Levelling(Cog):
         headers = ["POS", "User", "XP", "Level"]
         table = []
 
-        for n, u in enumerate(users[:num]):
+        # the levels that match the XP shown
+        levels = get_levels_from_exp(np.array([u.xp for u in users[:num]]))
+        for n, (u, level) in enumerate(zip(users[:num], levels.tolist())):
             try:
                 member = ctx.message.guild.get_member(u.id).name
                 # Unicode and tables suck
@@ -214,7 +167,7 @@ class Levelling(Cog):
                 # Prevent race condition - member leaving between command invocation and here
                 continue
             # position, name, xp, level
-            table.append([n + 1, member, u.xp, u.level])
+            table.append([n + 1, member, u.xp, level])
 
         # Format the table.
         pages = paginate_table(table, headers)
@@ -234,55 +187,18 @@ class Levelling(Cog):
 
         users = await ctx.bot.database.get_multiple_users(*ctx.message.guild.members, order_by=User.xp.desc())
 
-        async with ctx.channel.typing():
-            async with self.plot_lock:
-                async with threadpool():
-                    _lvls = np.array([user.level for user in users if user.level >= 0])
-
-                    # 12 is reasonable for rejecting the super outliers
-                    lvls = reject_outliers(_lvls, m=12)
-
-                    # This changes the line/shade colour apparently.
-                    sns.set_palette(['#DFA5A4'])
-                    sns.set_style('white')
-
-                    # The bw argument makes it slightly less "rounded"
-                    ax = sns.kdeplot(lvls, shade=True, bw=0.3)
+        levels = get_levels_from_exp(np.array([user.xp for user in users if user.level >= 0]))
 
-                    plt.xlabel('Level', fontsize=14)
-                    title = textwrap.wrap('Level distribution curve for {}'.format(ctx.message.guild.name), 30)
-                    plt.title('\n'.join(title), fontsize=23)
+        # the plot only changes when somebody levels up, joins or leaves
+        version = hashlib.sha1(levels.tobytes() + ctx.guild.name.encode()).hexdigest()
 
-                    # Remove text from left
-                    plt.yticks([])
+        async def render() -> bytes:
+            return await ctx.bot.compute.run_task("charts", "charts.levels", levels, ctx.guild.name)
 
-                    # "Hacky" way of limiting the x-axis but I couldnt
-                    # come up with anything better
-                    max_level = ceil(max(lvls) / 10) * 10
-                    plt.xticks(np.arange(0, max_level, 10))
-
-                    # Set the limits of the axis so it doesnt
-                    # expand too much in any direction
-                    ax.set_xbound(0, max_level + 1)
-
-                    # Removes the spines
-                    sns.despine()
-                    ax.spines['bottom'].set_visible(False)
-                    ax.spines['left'].set_visible(False)
-
-                    # Force a tighter ( ;) ) layout.
-                    plt.tight_layout()
-
-                    buf = BytesIO()
-                    plt.savefig(buf, format="png")
-
-                    # Don't send 0-byte files
-                    buf.seek(0)
-
-                    # Cleanup.
-                    plt.clf()
-                    plt.cla()
+        async with ctx.channel.typing():
+            data = await self.charts.get_or_render(ctx.guild.id, ("levels",), version, render)
 
+        buf = BytesIO(data)
         await ctx.channel.send(file=buf, filename="plot.png")
 
     @level.command(pass_context=True)
@@ -302,7 +218,7 @@ class Levelling(Cog):
         level, exp_required = get_next_exp_required(u.xp)
         if level < u.level:
             # for cheaters like me
-            exp_required = int(INCREASING_FACTOR * (u.level * (u.level + 1) / 2))
+            exp_required = get_exp_for_level(u.level + 1)
             level = u.level
 
         await ctx.channel.send("**{}** needs `{}` XP to advance to level `{}`.".format(user.name, exp_required,
@@ -57,52 +57,53 @@ def get_next_decay(currency: int, factor: float=-0.05) -> int:
 
 
 class Currency(Cog):
-    running = False
-
     async def ready(self):
-        if self.running is True:
-            return
+        await self.bot.jobs.run_as_leader("currency_decay", self._decay)
 
-        self.running = True
+    async def _decay(self, token: int):
+        """
+        Applies monetary decay every hour.
 
+        This only runs on the node that owns the `currency_decay` job.
+        """
         # Wait until the hour is up.
-        try:
-            now = datetime.datetime.now()
-            if now.hour == 23:
-                # clamp
-                hour = 0
-                day = now.day + 1
-            else:
-                hour = now.hour + 1
-                day = now.day
-
-            next = datetime.datetime(year=now.year, month=now.month, day=day,
-                                     hour=hour, minute=0, second=0)
-            to_wait = (next - now).total_seconds()
-
-            while True:
-                self.logger.info("Waiting {} seconds before applying next decay.".format(to_wait))
-                await asyncio.sleep(to_wait)
-
-                # decay
-                total = 0
-                async with threadpool():
-                    with self.bot.database.get_session() as sess:
-                        assert isinstance(sess, Session)
-
-                        users = list(sess.query(User).filter((User.money < 0) | (User.money > 1343)).all())
-                        for user in users:
-                            decay = get_next_decay(user.money)
-                            user.money -= decay
-                            total += decay
-
-                            # update the user
-                            sess.merge(user)
-
-                self.logger.info("Decayed §{}.".format(total))
-                to_wait = 60 * 60  # 1 hr
-        finally:
-            self.running = False
+        now = datetime.datetime.now()
+        if now.hour == 23:
+            # clamp
+            hour = 0
+            day = now.day + 1
+        else:
+            hour = now.hour + 1
+            day = now.day
+
+        next = datetime.datetime(year=now.year, month=now.month, day=day,
+                                 hour=hour, minute=0, second=0)
+        to_wait = (next - now).total_seconds()
+
+        while True:
+            self.logger.info("Waiting {} seconds before applying next decay.".format(to_wait))
+            await asyncio.sleep(to_wait)
+
+            if not await self.bot.jobs.check_fence("currency_decay", token):
+                return
+
+            # decay
+            total = 0
+            async with threadpool():
+                with self.bot.database.get_session() as sess:
+                    assert isinstance(sess, Session)
+
+                    users = list(sess.query(User).filter((User.money < 0) | (User.money > 1343)).all())
+                    for user in users:
+                        decay = get_next_decay(user.money)
+                        user.money -= decay
+                        total += decay
+
+                        # update the user
+                        sess.merge(user)
+
+            self.logger.info("Decayed §{}.".format(total))
+            to_wait = 60 * 60  # 1 hr
 
     @commands.command(pass_context=True)
     @with_redis_cooldown(bucket="daily_currency")
@@ -17,8 +17,6 @@ logger = logging.getLogger("Jokusoramame.Reminders")
 
 
 class Reminders(Cog):
-    _is_running_reminders = asyncio.Lock()
-
     _currently_running = {}
 
     async def _fire_reminder(self, reminder: Reminder):
@@ -34,6 +32,10 @@ class Reminders(Cog):
             # check to see if the reminder is valid or not
             channel = self.bot.get_channel(reminder.channel_id)
             if channel is None:
+                if self.bot.cluster_id is not None:
+                    # the channel is probably in a guild another cluster holds, which fires it instead
+                    return
+
                 # cancel it
                 self.logger.warning("Reminder channel was empty - not reminding...")
                 await self.bot.database.cancel_reminder(reminder.id)
@@ -43,7 +45,14 @@ class Reminders(Cog):
             member = guild.get_member(reminder.user_id)
             if not member:
                 self.logger.warning("Reminder member was dead - not reminding...")
-                await self.bot.database.cancel_reminder(reminder.user_id)
+                await self.bot.database.cancel_reminder(reminder.id)
+                return
+
+            # make sure no other node (or the scan loop) is already firing this reminder
+            if reminder.id in self._currently_running:
+                return
+
+            if not await self.bot.jobs.claim("reminder:{}".format(reminder.id), ttl=600):
                 return
 
             self._currently_running[reminder.id] = True
@@ -71,18 +80,23 @@ class Reminders(Cog):
             self._currently_running.pop(reminder.id, None)
 
     async def ready(self):
-        if self._is_running_reminders.locked():
-            return
+        # each cluster fires the reminders in its own guilds
+        await self.bot.jobs.run_as_leader(self.bot.jobs.get_shard_job_name("reminders"), self._scan_reminders)
 
-        async with self._is_running_reminders:
-            while True:
-                # Scan the reminders firing in the next 300 seconds.
-                reminders = await self.bot.database.scan_reminders(within=300)
-                for reminder in reminders:
-                    self.bot.loop.create_task(self._fire_reminder(reminder))
+    async def _scan_reminders(self, token: int):
+        """
+        Scans for reminders to fire every 300 seconds.
+
+        This only runs on the node that owns the `reminders` job for this process's shards.
+        """
+        while True:
+            # Scan the reminders firing in the next 300 seconds.
+            reminders = await self.bot.database.scan_reminders(within=300)
+            for reminder in reminders:
+                self.bot.tasks.spawn(self._fire_reminder(reminder), name="reminder:{}".format(reminder.id))
 
-                # Sleep for 300 seconds afterwards.
-                await asyncio.sleep(300)
+            # Sleep for 300 seconds afterwards.
+            await asyncio.sleep(300)
 
     @commands.command()
     async def remind(self, ctx: Context, tstr: str, *, content: str):
@@ -102,7 +116,8 @@ class Reminders(Cog):
                                                           remind_at=dt)
         if seconds < 300:
             # make the reminder immediately.
-            t = self.bot.loop.create_task(self._fire_reminder(reminder))
+            t = self.bot.tasks.spawn(self._fire_reminder(reminder), name="reminder:{}".format(reminder.id),
+                                     owner=self.__class__.__name__)
         else:
             t = asyncio.sleep(0)
 
@@ -3,6 +3,8 @@ Fake stock market system.
 """
 import datetime
 import asyncio
+import functools
+import hashlib
 from io import BytesIO
 
 import pytz
@@ -15,28 +17,27 @@ import numpy as np
 import tabulate
 from asyncio_extras import threadpool
 from discord.ext import commands
-import matplotlib as mpl
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from joku.db.tables import Stock, UserStock
-
-mpl.use('Agg')
-
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-
 from joku.cogs._common import Cog
-from joku.core.bot import Context
+from joku.core.bot import Context, Jokusoramame
+from joku.core.chartcache import ChartCache
 from joku.core.checks import has_permissions
+from joku.core.events import MessageContext
 
 
 class Stocks(Cog):
     """
     A fake stocks system.
     """
-    _running = False
-    _plot_lock = asyncio.Lock()
+
+    def __init__(self, bot: Jokusoramame):
+        super().__init__(bot)
+
+        # Rendered graphs, by guild and stock tick.
+        self.charts = ChartCache(bot)
 
     @staticmethod
     def get_hist_mult(x: int) -> float:
@@ -125,85 +126,96 @@ class Stocks(Cog):
         """
         Begins fluctuating stock prices.
         """
-        if self._running:
-            return
+        # each cluster ticks the stocks of its own guilds
+        job = self.bot.jobs.get_shard_job_name("stocks")
+        await self.bot.jobs.run_as_leader(job, functools.partial(self._fluctuate_stocks, job))
 
-        self._running = True
+    async def _fluctuate_stocks(self, job: str, token: int):
+        """
+        Fluctuates stock prices every minute.
 
-        try:
-            while True:
-                # collect all the guilds that have stocks enabled
-                guilds = await self.bot.database.get_multiple_guilds(*self.bot.guilds)
-                collected = [g for g in guilds if g.stocks_enabled]
-
-                # sleep until the minute
-                t = datetime.datetime.utcnow()
-                sleeptime = 60 - (t.second + t.microsecond / 1000000.0)
-                self.logger.info("Sleeping for {} seconds before changing stocks".format(sleeptime))
-                await asyncio.sleep(sleeptime)
-
-                # void warranty
-
-                stock_mappings = []
-                us_mappings = []
-                coros = []
-                for guild in collected:
-                    try:
-                        guild = self.bot.connection._get_guild(guild.id)  # type: discord.Guild
-                    except:
-                        guild = self.bot._connection._get_guild(guild.id)
-                    if not guild:
+        This only runs on the node that owns the `stocks` job for this process's shards.
+        """
+        while True:
+            # collect all the guilds that have stocks enabled
+            guilds = await self.bot.database.get_multiple_guilds(*self.bot.guilds)
+            collected = [g for g in guilds if g.stocks_enabled]
+
+            # sleep until the minute
+            t = datetime.datetime.utcnow()
+            sleeptime = 60 - (t.second + t.microsecond / 1000000.0)
+            self.logger.info("Sleeping for {} seconds before changing stocks".format(sleeptime))
+            await asyncio.sleep(sleeptime)
+
+            # make sure we haven't been replaced by another node while asleep
+            if not await self.bot.jobs.check_fence(job, token):
+                return
+
+            # void warranty
+
+            stock_mappings = []
+            us_mappings = []
+            coros = []
+            for guild in collected:
+                try:
+                    guild = self.bot.connection._get_guild(guild.id)  # type: discord.Guild
+                except:
+                    guild = self.bot._connection._get_guild(guild.id)
+                if not guild:
+                    continue
+
+                stocks = await self.bot.database.get_stocks_for(guild)
+                remaining = await self.bot.database.bulk_get_remaining_stocks(*stocks)
+                for stock in stocks:
+                    # update the price
+                    channel = guild.get_channel(stock.channel_id)
+                    if channel is None:
                         continue
 
-                    stocks = await self.bot.database.get_stocks_for(guild)
-                    remaining = await self.bot.database.bulk_get_remaining_stocks(*stocks)
-                    for stock in stocks:
-                        # update the price
-                        channel = guild.get_channel(stock.channel_id)
-                        if channel is None:
-                            continue
-
-                        final_price, \
-                        new_amount, \
-                        crashed = await self.flucutate_stock(stock, remaining.get(stock.channel_id, stock.amount))
-
-                        if crashed:
-                            # should work :fingers_crossed:
-                            for us in stock.users:
-                                us_mappings.append({
-                                    "id": us.id,
-                                    "crashed": True,
-                                    "crashed_at": stock.price
-                                })
-
-                        # edit the stock price
-                        stock_mappings.append({
-                            "channel_id": stock.channel_id,
-                            "price": final_price,
-                            "amount": new_amount
-                        })
-                        await self.bot.redis.update_stock_prices(channel, final_price)
-
-                        self.logger.info("Stock {} gone from value {} -> {}, "
-                                         "amount {} -> {}, crashed: {}".format(stock.channel_id, stock.price,
-                                                                               final_price,
-                                                                               stock.amount, new_amount, crashed))
-
-                async with threadpool():
-                    with self.bot.database.get_session() as sess:
-                        assert isinstance(sess, Session)
-                        sess.bulk_update_mappings(Stock, stock_mappings)
-                        sess.bulk_update_mappings(UserStock, us_mappings)
-
-        finally:
-            self._running = False
-
-    async def on_message(self, message: discord.Message):
+                    final_price, \
+                    new_amount, \
+                    crashed = await self.flucutate_stock(stock, remaining.get(stock.channel_id, stock.amount))
+
+                    if crashed:
+                        # should work :fingers_crossed:
+                        for us in stock.users:
+                            us_mappings.append({
+                                "id": us.id,
+                                "crashed": True,
+                                "crashed_at": stock.price
+                            })
+
+                    # edit the stock price
+                    stock_mappings.append({
+                        "channel_id": stock.channel_id,
+                        "price": final_price,
+                        "amount": new_amount
+                    })
+                    await self.bot.redis.update_stock_prices(channel, final_price)
+
+                    self.logger.info("Stock {} gone from value {} -> {}, "
+                                     "amount {} -> {}, crashed: {}".format(stock.channel_id, stock.price,
+                                                                           final_price,
+                                                                           stock.amount, new_amount, crashed))
+
+                # cached graphs of this guild are now out of date
+                await self.bot.redis.increase_stock_tick(guild)
+
+            if not await self.bot.jobs.check_fence(job, token):
+                return
+
+            async with threadpool():
+                with self.bot.database.get_session() as sess:
+                    assert isinstance(sess, Session)
+                    sess.bulk_update_mappings(Stock, stock_mappings)
+                    sess.bulk_update_mappings(UserStock, us_mappings)
+
+    async def on_message_context(self, ctx: MessageContext):
         # increment history for this channel
-        if message.channel.guild is None:
+        if ctx.guild is None:
             return
 
-        await self.bot.redis.increase_history_count(message.channel)
+        await self.bot.redis.increase_history_count(ctx.message.channel)
 
     @commands.group(pass_context=True, invoke_without_command=True, aliases=["shares", "share", "asset"])
     async def assets(self, ctx: Context, *, target: discord.Member = None):
@@ -595,93 +607,58 @@ class Stocks(Cog):
             await ctx.send(":x: I need Attach Files permissions.")
             return
 
-        stocks = await ctx.bot.database.get_stocks_for(ctx.guild)
-        user_stocks = await ctx.bot.database.get_user_stocks(ctx.author, guild=ctx.guild)
-
-        tds = []
-        for c in stocks:
-            channel = ctx.guild.get_channel(c.channel_id)
-            if not channel:
-                continue
-
-            name = self._get_name(channel)
-            tds.append((name, await ctx.bot.redis.get_historical_prices(channel)))
-
-        # collect user stocks
-        uds = []
-        for u_s in user_stocks:
-            # if amount <= 0 dont add it as owned
-            if u_s.amount <= 0:
-                continue
-
-            channel = ctx.guild.get_channel(u_s.stock.channel_id)
-            if not channel:
-                continue
-
-            name = self._get_name(channel)
-            uds.append(name)
-
-        async with ctx.channel.typing():
-            async with self._plot_lock:
-                async with threadpool():
-                    # calculate the dates
-                    dates = [arrow.now(pytz.UTC).replace(minutes=-i) for i in range(0, len(tds[0][1]))]
-                    dates = list(reversed([dt.strftime("%H:%M") for dt in dates]))
-
-                    # axis labels
-                    plt.xlabel("Time UTC (HH:MM)")
-                    plt.ylabel("Price (§)")
-
-                    # hacky to get the right bottom
-                    x = np.arange(0, len(tds[0][1]))
-
-                    # current line colour legend
-                    legend = []
+        # prices only change once a tick, so the graph is only rendered once a tick
+        tick = await ctx.bot.redis.get_stock_tick(ctx.guild)
 
-                    # if plotting portfolio, only plot the ones the user owns
-                    if what == "portfolio":
-                        n = []
+        if what == "portfolio":
+            # collect user stocks
+            user_stocks = await ctx.bot.database.get_user_stocks(ctx.author, guild=ctx.guild)
+            uds = []
+            for u_s in user_stocks:
+                # if amount <= 0 dont add it as owned
+                if u_s.amount <= 0:
+                    continue
 
-                        for q in tds:
-                            # check if name in user stock names
-                            if q[0] in uds:
-                                # mark for plotting
-                                n.append(q)
+                channel = ctx.guild.get_channel(u_s.stock.channel_id)
+                if not channel:
+                    continue
 
-                        # overwrite tds
-                        tds = n
+                name = self._get_name(channel)
+                uds.append(name)
 
-                    # rainbowify the lines
-                    colours = cm.rainbow(np.linspace(0, 1, len(tds)))
-                    for history, colour in zip(tds, colours):
-                        # extract the name and add it to the legend
-                        name, values = history
-                        legend.append(name)
-                        # plot against dates
-                        plt.plot(x, values, color=colour)
+            # everybody owning the same stocks gets the same graph
+            key = ("stocks", "portfolio", hashlib.sha1("\n".join(sorted(uds)).encode()).hexdigest())
+        else:
+            uds = None
+            key = ("stocks", "all")
 
-                    # xticks the data
-                    plt.xticks(x, dates, rotation=270)
+        async def render() -> bytes:
+            stocks = await ctx.bot.database.get_stocks_for(ctx.guild)
 
-                    plt.title("1st Stock Market of Joku")
+            tds = []
+            for c in stocks:
+                channel = ctx.guild.get_channel(c.channel_id)
+                if not channel:
+                    continue
 
-                    # only show every 2nd tick
-                    ax = plt.gca()
-                    plt.setp(ax.get_xticklabels()[::2], visible=False)
+                name = self._get_name(channel)
+                tds.append((name, await ctx.bot.redis.get_historical_prices(channel)))
 
-                    plt.legend(legend, loc="best")
-                    plt.tight_layout()
+            # calculate the dates
+            dates = [arrow.now(pytz.UTC).replace(minutes=-i) for i in range(0, len(tds[0][1]))]
+            dates = list(reversed([dt.strftime("%H:%M") for dt in dates]))
 
-                    buf = BytesIO()
-                    plt.savefig(buf, format="png")
+            # if plotting portfolio, only plot the ones the user owns
+            if uds is not None:
+                tds = [q for q in tds if q[0] in uds]
 
-                    # Don't send 0-byte files
-                    buf.seek(0)
+            return await ctx.bot.compute.run_task("charts", "charts.stocks", [name for (name, _) in tds],
+                                                  [np.array(prices) for (_, prices) in tds], dates)
 
-                    # Cleanup.
-                    plt.clf()
-                    plt.cla()
+        async with ctx.channel.typing():
+            data = await self.charts.get_or_render(ctx.guild.id, key, tick, render)
 
+        buf = BytesIO(data)
         await ctx.channel.send(file=buf, filename="plot.png")
 
     @stocks.command(name="setup")
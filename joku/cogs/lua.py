@@ -4,21 +4,30 @@ A lua interpreter cog.
 import asyncio
 import functools
 import pickle
+import typing
 
-import lupa
-# this will error on pycharm, until it generates the right skeleton. Ignroe it.
 import os
-from lupa import LuaRuntime
 
 from discord.ext import commands
 
 from joku.cogs._common import Cog
 from joku.core.bot import Context
 from joku.core.checks import is_owner
-from joku.core.mp2 import ProcessPoolExecutor
+from joku.core.compilecache import CompiledCache
+from joku.core.mp2 import DeadlineExceeded
 
 NO_RESULT = type("NO_RESULT", (object,), {})
 
+#: The default number of Lua instructions a single run may execute.
+DEFAULT_INSTRUCTION_LIMIT = 1000000
+
+#: The default memory cap of each runtime, in bytes.
+DEFAULT_MEMORY_LIMIT = 50 * 1024 * 1024
+
+#: The default number of seconds a Lua call may run before its worker is killed and replaced.
+#: This catches what the instruction limit can't, such as a single slow C function like `string.gsub`.
+DEFAULT_DEADLINE = 6
+
 with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "luasandbox.lua")) as f:
     sandbox_preamble = f.read()
 
@@ -36,11 +45,11 @@ def dictify_table_recursively(t):
     """
     Turns a table into a dict.
     """
+    import lupa
+
     d = {}
 
     for (k, v) in t.items():
-        typ = lupa.lua_type(v)
-        print(k, v, typ)
         if lupa.lua_type(v) == "table":
             d[k] = dictify_table_recursively(v)
         else:
@@ -49,18 +58,155 @@ def dictify_table_recursively(t):
     return d
 
 
-def exec_lua(code: str):
-    # the attribute_handlers are probably enough to prevent access eval otherwise
-    lua = LuaRuntime(register_eval=False,
-                     unpack_returned_tuples=True,
-                     attribute_handlers=(getter, setter))
+def tag_getter(obj, attr_name):
+    if attr_name.startswith("_"):
+        raise AttributeError("Not allowed to access attribute `{}` of `{}`"
+                             .format(attr_name, type(obj).__name__))
+
+    return attr_name
+
+
+class SandboxedRuntime(object):
+    """
+    A Lua runtime with the sandbox preamble already loaded.
+
+    Each worker process keeps one of these per set of attribute handlers, so that runs only pay for creating a
+    fresh environment table rather than a whole runtime.
+    """
+
+    def __init__(self, attr_getter, cache_bytes: int = None, instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT,
+                 memory_limit: int = DEFAULT_MEMORY_LIMIT):
+        # this will error on pycharm, until it generates the right skeleton. Ignroe it.
+        from lupa import LuaRuntime, LuaMemoryError
+
+        # the attribute_handlers are probably enough to prevent access eval otherwise
+        # max_memory caps every allocation the runtime makes, so a script can't get past it between GC cycles
+        self.lua = LuaRuntime(register_eval=False,
+                              unpack_returned_tuples=True,
+                              attribute_handlers=(attr_getter, setter),
+                              max_memory=memory_limit)
+        self._memory_error = LuaMemoryError
+        self._out_of_memory = False
+
+        # execute the sandbox preamble
+        self.sandbox = self.lua.execute(sandbox_preamble)
+        self.sandbox.set_limits(instruction_limit, memory_limit // 1024 if memory_limit else None)
+
+        # called from Python, this runs no Lua instructions, so it isn't caught by the instruction hook itself
+        self._clear_hook = self.lua.eval("debug.sethook")
+
+        # Compiled chunks, which belong to this runtime.
+        self.chunks = CompiledCache(cache_bytes) if cache_bytes else CompiledCache()
+
+    def _to_table(self, local_vars: dict):
+        new = {}
+        for key, val in (local_vars or {}).items():
+            new[key] = self.lua.table_from(val) if isinstance(val, (dict, list, tuple)) else val
+
+        return self.lua.table_from(new)
+
+    def run(self, code: str, local_vars: dict = None):
+        """
+        Runs some code in a fresh sandbox environment.
+
+        :param local_vars: The variables to put in the environment. Dicts and lists are converted to tables.
+        """
+        try:
+            return self.sandbox.run(code, self._to_table(local_vars))
+        except self._memory_error:
+            self._out_of_memory = True
+            raise
+        finally:
+            self._clear_hook()
+
+    def run_cached(self, key: typing.Hashable, code: str, local_vars: dict = None):
+        """
+        Runs some code, reusing the chunk compiled the last time it was ran under the same key.
+        """
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            compiled = self.sandbox.compile(code)
+            if isinstance(compiled, tuple):
+                # (nil, error message), same as `sandbox.run`
+                return compiled
+
+            chunk = compiled
+            self.chunks.put(key, chunk, code)
+
+        try:
+            return self.sandbox.run_compiled(chunk, self._to_table(local_vars))
+        except self._memory_error:
+            self._out_of_memory = True
+            raise
+        finally:
+            self._clear_hook()
+
+    @property
+    def spent(self) -> bool:
+        """
+        :return: If this runtime hit the memory limit, and should be thrown away.
+        """
+        return self._out_of_memory or bool(self.sandbox.mem_limit_reached)
+
 
-    # execute the sandbox preamble
-    sandbox = lua.execute(sandbox_preamble)
+#: Attribute getter -> the runtime using it, for this process.
+_runtimes = {}
+
+
+#: The byte budget of each runtime's chunk cache, for this process.
+_cache_bytes = None
+
+#: The instruction and memory limits of each runtime, for this process.
+_limits = {}
+
+
+def get_runtime(attr_getter=getter) -> SandboxedRuntime:
+    """
+    Gets this process' sandboxed runtime for a set of attribute handlers, creating it if needed.
+    """
+    runtime = _runtimes.get(attr_getter)
+    if runtime is None or runtime.spent:
+        runtime = _runtimes[attr_getter] = SandboxedRuntime(attr_getter, cache_bytes=_cache_bytes, **_limits)
+
+    return runtime
+
+
+def warm_runtimes(*attr_getters, cache_bytes: int = None, limits: dict = None):
+    """
+    Creates the runtimes for each attribute getter. Used as a process pool initializer.
+
+    :param cache_bytes: The byte budget of each runtime's chunk cache.
+    :param limits: The `instruction_limit` and `memory_limit` of each runtime.
+    """
+    global _cache_bytes, _limits
+    _cache_bytes = cache_bytes
+    _limits = limits or {}
+
+    for attr_getter in attr_getters or (getter,):
+        get_runtime(attr_getter)
+
+
+def get_lua_limits(config: dict) -> typing.Tuple[dict, float]:
+    """
+    Gets the runtime limits and the worker deadline from the `lua` section of the config.
+
+    :return: The keyword arguments for each runtime's limits, and the deadline in seconds.
+    """
+    section = config.get("lua", {})
+    limits = {
+        "instruction_limit": section.get("instruction_limit", DEFAULT_INSTRUCTION_LIMIT),
+        "memory_limit": section.get("memory_limit", DEFAULT_MEMORY_LIMIT),
+    }
+    return limits, section.get("deadline", DEFAULT_DEADLINE)
+
+
+def exec_lua(code: str):
+    # lupa is only imported inside the worker processes
+    import lupa
 
     # call sandbox.run with `glob.sandbox, code`
     # and unpack the variables
-    _ = sandbox.run(code, lua.table_from({}))
+    _ = get_runtime(getter).run(code)
     if isinstance(_, bool):
         # idk
         return NO_RESULT
@@ -84,13 +230,6 @@ class Lua(Cog):
     Commands to interpret Lua.
     """
 
-    def __init__(self, bot):
-        super().__init__(bot)
-
-        self.lua = LuaRuntime(unpack_returned_tuples=True)
-
-        self.mp_pool = ProcessPoolExecutor(max_workers=4)
-
     @commands.group(name="lua")
     async def _lua(self, ctx: Context):
         """
@@ -105,6 +244,7 @@ class Lua(Cog):
         
         This does not go through the sandbox, and is owner only.
         """
+        from lupa import LuaRuntime
         lua = LuaRuntime(unpack_returned_tuples=True)
 
         if code.startswith("```"):
@@ -130,11 +270,13 @@ class Lua(Cog):
         if code.endswith("```"):
             code = code[:-3]
 
+        import lupa
+
         async with ctx.channel.typing():
             try:
-                fut = self.bot.loop.run_in_executor(self.mp_pool, exec_lua, code)
-                result = await asyncio.wait_for(fut, timeout=5.0, loop=self.bot.loop)
-            except asyncio.CancelledError:
+                coro = self.bot.compute.run("eval", exec_lua, code)
+                result = await asyncio.wait_for(coro, timeout=5.0, loop=self.bot.loop)
+            except (asyncio.CancelledError, asyncio.TimeoutError, DeadlineExceeded):
                 final = "Timed out waiting for result."
             except (lupa.LuaSyntaxError, lupa.LuaError) as e:
                 final = str(e)
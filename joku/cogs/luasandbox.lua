@@ -40,7 +40,8 @@ sandbox.env = {
   tonumber = tonumber,
   tostring = tostring,  -- Mike Pall says it is unsafe; why? See http://lua-users.org/lists/lua-l/2011-02/msg01595.html
   type = type,
-  xpcall = xpcall,
+  -- replaced below, once the limits are defined
+  -- xpcall = xpcall,
 
   --
   -- 6.2 Coroutine Manipulation
@@ -206,21 +207,61 @@ end
 
 
 -- Maximum number of instructions that can be executed.
--- XXX: the slowdown only becomes percievable at ~5m instructions.
 sandbox.instruction_limit = 1e6
 sandbox.instruction_count = 0
 
+-- The hook runs every `hook_stride` instructions rather than on every
+-- one, which made scripts several times slower. The limit is only
+-- enforced to the nearest stride.
+--
+-- Once a limit is reached the hook runs on every instruction instead.
+-- Otherwise a script catching the error with `pcall` in a loop would
+-- spend almost all of each stride inside the `pcall`, and never be
+-- stopped outside of it.
+sandbox.hook_stride = 1000
+
+-- If a limit has been reached, and the script must stop.
+function sandbox.limit_reached()
+  return sandbox.instruction_count > sandbox.instruction_limit or sandbox.mem_limit_reached
+end
+
+
+-- The message handler of `xpcall` runs where the error was raised,
+-- which for a limit error is inside the hook, where hooks are off.
+-- A handler that loops would never be stopped, so it isn't called
+-- at all once a limit is reached.
+sandbox.env.xpcall = function(f, msgh, ...)
+  return xpcall(f, function(m)
+    if sandbox.limit_reached() then
+      error(m, 0)
+    end
+    return msgh(m)
+  end, ...)
+end
+
 function sandbox.enable_per_instruction_limits()
+  local stride = sandbox.hook_stride
   local function _debug_step(event, line)
-    sandbox.instruction_count = sandbox.instruction_count + 1
+    sandbox.instruction_count = sandbox.instruction_count + stride
     if sandbox.instruction_count > sandbox.instruction_limit then
+      stride = 1
+      debug.sethook(_debug_step, '', 1)
       error("script uses too much CPU", 2)
     end
     if sandbox.mem_limit_reached then
+      stride = 1
+      debug.sethook(_debug_step, '', 1)
       error("script uses too much memory")
     end
   end
-  debug.sethook(_debug_step, '', 1)
+  debug.sethook(_debug_step, '', stride)
+end
+
+
+-- Sets the per-run budgets: instructions, and memory in KB.
+function sandbox.set_limits(instructions, mem_kb)
+  if instructions then sandbox.instruction_limit = instructions end
+  if mem_kb then sandbox.mem_limit = mem_kb end
 end
 
 
@@ -235,6 +276,41 @@ function sandbox.create_coroutine(f, ...)
 end
 
 
+-------------------------------------------------------------
+--
+-- Runtimes are reused between runs, so every run gets its own copy
+-- of the environment. The library tables are copied too, so that a
+-- run replacing `math.floor` can't affect the next one.
+--
+function sandbox.new_env(l)
+  local env = {}
+  for k, v in pairs(sandbox.env) do
+    if type(v) == "table" then
+      local copy = {}
+      for k2, v2 in pairs(v) do copy[k2] = v2 end
+      env[k] = copy
+    else
+      env[k] = v
+    end
+  end
+
+  -- copy locals into the env
+  for k, v in pairs(l) do env[k] = v end
+  return env
+end
+
+
+-- Resets the per-run limits.
+function sandbox.reset_limits()
+  sandbox.instruction_count = 0
+  if sandbox.mem_limit_reached then
+    -- the GC sentinel stops re-arming itself once the limit is hit
+    sandbox.mem_limit_reached = false
+    sandbox._memory_tracking_enabled = false
+  end
+end
+
+
 -------------------------------------------------------------
 --
 -- Lua 5.2 sandbox.
@@ -244,17 +320,35 @@ end
 -- "string":methods() like "foo":upper() stop working.
 --
 function sandbox.run(untrusted_code, l)
+  local untrusted_function, message = sandbox.compile(untrusted_code)
+  if not untrusted_function then return nil, message end
+  return sandbox.run_compiled(untrusted_function, l)
+end
+
+
+-- Compiles some code once, so that it can be ran many times with
+-- `sandbox.run_compiled`.
+-- Returns the chunk, or nil and an error message.
+function sandbox.compile(untrusted_code)
+  return load(untrusted_code, nil, 't', {})
+end
+
+
+-- Runs a chunk from `sandbox.compile` in a fresh environment.
+function sandbox.run_compiled(untrusted_function, l)
+  sandbox.reset_limits()
   sandbox.fix_metatables()
   sandbox.enable_memory_limit()
-  sandbox.enable_per_instruction_limits()
 
-  -- copy locals into sandbox env
-  for k,v in pairs(l) do sandbox.env[k] = v end
+  -- the environment of a main chunk is always its first upvalue
+  debug.setupvalue(untrusted_function, 1, sandbox.new_env(l))
+  sandbox.enable_per_instruction_limits()
 
-  local untrusted_function, message = load(untrusted_code, nil, 't',
-                                          sandbox.env)
-  if not untrusted_function then return nil, message end
+  -- this must stay a tail call; anything ran after it would still be
+  -- charged against the instruction limit. Callers reusing the runtime
+  -- remove the hook with `debug.sethook()` afterwards.
   return pcall(untrusted_function)
 end
 
+
 return sandbox
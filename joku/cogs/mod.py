@@ -12,7 +12,7 @@ from joku.cogs._common import Cog
 from joku.core import checks
 from joku.core.bot import Context
 from joku.core.checks import mod_command, bot_has_permissions
-from joku.core.utils import get_role
+from joku.core.events import MessageContext
 
 
 class Moderation(Cog):
@@ -32,15 +32,15 @@ class Moderation(Cog):
             if rolestate is None:
                 return
 
-            roles = [discord.utils.get(member.guild.roles, id=r_id) for r_id in rolestate.roles]
-            roles = [r for r in roles if r is not None]
+            roles = self.bot.get_roles(member.guild, rolestate.roles)
 
             await member.edit(roles=roles)
             if rolestate.nick:
                 await member.edit(nick=rolestate.nick)
 
-    async def on_message(self, message: discord.Message):
+    async def on_message_context(self, ctx: MessageContext):
         # Anti mention spam
+        message = ctx.message
 
         # Use a set here as we only want to ban unique mentions
         mentions = len(set(message.mentions) & set(message.role_mentions))
@@ -56,9 +56,8 @@ class Moderation(Cog):
             # can't ban anyway
             return
 
-        enabled = await self.bot.database.get_setting(message.guild, "mention_spam_enabled")
-        threshold = await self.bot.database.get_setting(message.guild, "mention_spam_threshold",
-                                                        default=5)
+        enabled = await ctx.get_setting("mention_spam_enabled")
+        threshold = await ctx.get_setting("mention_spam_threshold", default=5)
 
         if self.str_to_bool(enabled):
             if mentions == int(threshold):
@@ -188,7 +187,8 @@ class Moderation(Cog):
             em.add_field(name="Username", value=user.name)
 
             em.add_field(name="Nick", value=rolestate.nick, inline=False)
-            roles = ", ".join([get_role(ctx.guild, r_id).mention for r_id in rolestate.roles if r_id != ctx.guild.id])
+            roles = ", ".join([role.mention for role in ctx.bot.get_roles(ctx.guild, rolestate.roles)
+                               if role.id != ctx.guild.id])
             em.add_field(name="Roles", value=roles, inline=False)
 
             em.colour = discord.Colour.light_grey()
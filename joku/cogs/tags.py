@@ -3,7 +3,6 @@ Generic tag bot, yay.
 """
 import asyncio
 import copy
-import shlex
 import traceback
 
 import discord
@@ -14,6 +13,15 @@ from joku.cogs._common import Cog
 from joku.core.bot import Context, Jokusoramame
 from joku.core.tagengine import TagEngine
 
+#: The number of tag names shown on each page of `tag all`.
+TAGS_PER_PAGE = 50
+
+#: Longer tag names are cut short in listings, so that a full page always fits in one message.
+MAX_LISTED_NAME = 32
+
+#: The number of tags suggested when a tag doesn't exist.
+SUGGESTIONS = 3
+
 
 class Tags(Cog):
     def __init__(self, bot: Jokusoramame):
@@ -24,6 +32,15 @@ class Tags(Cog):
     def _sanitize_name(self, name: str) -> str:
         return name.replace("@everyone", "@\u200beveryone").replace("@here", "@\u200bhere")
 
+    def _list_names(self, names) -> str:
+        listed = []
+        for name in names:
+            if len(name) > MAX_LISTED_NAME:
+                name = name[:MAX_LISTED_NAME - 1] + "\u2026"
+            listed.append("`{}`".format(self._sanitize_name(name.replace("`", "'"))))
+
+        return ", ".join(listed)
+
     @commands.group(pass_context=True, invoke_without_command=True,
                     aliases=["tags"])
     async def tag(self, ctx: Context, *, name: str):
@@ -118,16 +135,37 @@ class Tags(Cog):
         await ctx.send(":heavy_check_mark: Removed tag alias.")
 
     @tag.command(pass_context=True, aliases=["list"])
-    async def all(self, ctx: Context):
+    async def all(self, ctx: Context, page: int = 1):
         """
-        Shows all the tags for the current server
+        Shows the tags for the current server, a page at a time.
         """
-        server_tags = await ctx.bot.database.get_all_tags_for_guild(ctx.message.guild)
-        if not server_tags:
+        names, total = await ctx.bot.database.get_tag_names_page(ctx.message.guild, max(page, 1) - 1,
+                                                                 per_page=TAGS_PER_PAGE)
+        if not total:
             await ctx.channel.send(":x: This server has no tags.")
             return
 
-        await ctx.channel.send("Tags: " + ", ".join([self._sanitize_name(x.name) for x in server_tags]))
+        pages = (total + TAGS_PER_PAGE - 1) // TAGS_PER_PAGE
+        if not names:
+            await ctx.channel.send(":x: There are only {} pages of tags.".format(pages))
+            return
+
+        await ctx.channel.send("Tags (page {}/{}, {} total): {}".format(max(page, 1), pages, total,
+                                                                       self._list_names(names)))
+
+    @tag.command(pass_context=True)
+    async def search(self, ctx: Context, *, query: str):
+        """
+        Searches for tags by name.
+
+        Tags starting with the query are shown first, then tags with similar names.
+        """
+        names = await ctx.bot.database.search_tags(ctx.message.guild, query, limit=TAGS_PER_PAGE)
+        if not names:
+            await ctx.channel.send(":x: No tags found.")
+            return
+
+        await ctx.channel.send("Tags matching your search: {}".format(self._list_names(names)))
 
     @tag.command(pass_context=True, aliases=["edit"])
     async def create(self, ctx: Context, name: str, *, content: str):
@@ -184,6 +222,20 @@ class Tags(Cog):
         await ctx.bot.database.delete_tag(ctx.message.guild, name)
         await ctx.channel.send(":put_litter_in_its_place: Tag **{}** deleted.".format(self._sanitize_name(name)))
 
+    async def on_tag_changed(self, guild_id: int, tag_id: int):
+        # Edited and deleted tags shouldn't keep their old outputs around.
+        await self.engine.invalidate(guild_id, tag_id)
+
+    async def _suggest(self, ctx: Context, name: str):
+        # Only suggest tags with a very similar name, so that other bots' commands don't get a reply.
+        # These come from the names already in the index, as every unknown command ends up here.
+        if not name:
+            return
+
+        names = ctx.bot.database.tag_names.get_similar(ctx.message.guild.id, name, limit=SUGGESTIONS)
+        if names:
+            await ctx.channel.send("Did you mean: {}?".format(self._list_names(names)))
+
     # Unlike other bots, tags are registered like full commands.
     # So, they're entirely handled inside on_command_error.
     # This will catch the CommandNotFound, and try and find the tag.
@@ -192,42 +244,23 @@ class Tags(Cog):
             # We don't want to catch any non-command not found errors.
             return
 
+        if ctx.message.guild is None:
+            # tags only exist in guilds
+            return
+
         # Extract the tag from the message content.
         cmd = ctx.message.content[len(ctx.prefix):]
         cmd = cmd.split(" ")[0]
 
-        # Create the arguments for the template.
-
-        guild = {"name": ctx.message.guild.name, "icon_url": ctx.message.guild.icon_url,
-                 "id": ctx.message.guild.id, "member_count": ctx.message.guild.member_count,
-                 "created_at": ctx.message.guild.created_at}
-
-        author = {"name": ctx.message.author.name, "nick": ctx.message.author.nick,
-                  "discriminator": ctx.message.author.discriminator, "id": ctx.message.author.id,
-                  "colour": ctx.message.author.colour, "mention": ctx.message.author.mention,
-                  "permissions": ctx.message.channel.permissions_for(ctx.message.author),
-                  "guild_permissions": ctx.message.author.guild_permissions,
-                  "joined_at": ctx.message.author.joined_at, "created_at": ctx.message.author.created_at,
-                  "guild": guild}
-
-        channel = {"name": ctx.message.channel.name, "id": ctx.message.channel.id,
-                   "mention": ctx.message.channel.mention, "guild": guild}
-
-        message = {"id": ctx.message.id, "content": ctx.message.content, "clean_content": ctx.message.clean_content,
-                   "channel": channel, "guild": guild, "author": author}
-
-        args = {
-            "args": shlex.split(ctx.message.content[len(ctx.prefix):])[1:],
-            "clean_args": shlex.split(ctx.message.clean_content[len(ctx.prefix):])[1:],
-            "message": message,
-            "channel": channel,
-            "author": author,
-            "server": guild
-        }
+        # Typos and other bots' commands stop here, without fetching a tag.
+        if not await ctx.bot.database.tag_names.might_exist(ctx.message.guild.id, cmd):
+            await self._suggest(ctx, cmd)
+            return
 
-        # Render the template, using the args.
+        # Render the template. The engine builds the variables it needs from the context.
         try:
-            coro = self.engine.render_template(cmd, ctx=ctx, **args)
+            # the index has just been checked above
+            coro = self.engine.render_template(cmd, ctx=ctx, check_index=False)
             rendered = await coro
         except (asyncio.CancelledError, asyncio.TimeoutError) as e:
             rendered = "**Timed out waiting for template to render.**"
@@ -10,11 +10,12 @@ from discord.ext import commands
 
 from joku.cogs._common import Cog
 from joku.core.bot import Context
+from joku.core.events import MessageContext
 
 
 class Tracking(Cog):
-    async def on_message(self, message: discord.Message):
-        author = message.author  # type: discord.Member
+    async def on_message_context(self, ctx: MessageContext):
+        author = ctx.author  # type: discord.Member
 
         # update their last message in redis
         await self.bot.redis.update_last_message(author)
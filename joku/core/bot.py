@@ -2,12 +2,16 @@
 Main bot class.
 """
 import asyncio
+import importlib
 import itertools
 import logging
+import os
 import sys
 import time
 import traceback
+import typing
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import discord
 import itsdangerous
@@ -22,7 +26,17 @@ from logbook import StreamHandler
 from logbook.compat import redirect_logging
 
 from joku.core.commands import DoNotRun
+from joku.core.compute import ComputeService
+from joku.core.events import ListenerStats, MessageContext, timed
+from joku.core.indexes import LookupIndex
+from joku.core.logs import setup_logging
+from joku.core.metrics import setup_bot_metrics
+from joku.core.profiler import StartupProfiler
+from joku.core.jobs import JobCoordinator
 from joku.core.redis import RedisAdapter
+from joku.core.tasks import TaskSupervisor
+from joku.core.timings import CommandTimer
+from joku.core.watchdog import LoopWatchdog, from_config as watchdog_from_config
 from joku.db.interface import DatabaseInterface
 
 try:
@@ -32,23 +46,37 @@ except ImportError:
 
 redirect_logging()
 
+#: The timeout for each startup phase, in seconds.
+PHASE_TIMEOUTS = {
+    "application_info": 30,
+    "postgres": 30,
+    "redis": 15,
+    "webserver": 15,
+}
+
 StreamHandler(sys.stderr).push_application()
 
 
 class Jokusoramame(AutoShardedBot):
-    def __init__(self, config_file: str, *args, **kwargs):
+    def __init__(self, config_file: str, *args, cluster_id: int = None, log_handler: logbook.Handler = None,
+                 **kwargs):
         """
         Creates a new instance of the bot.
 
         :param config: The config to create this with.
+        :param cluster_id: The ID of the cluster this bot is running in, if running in cluster mode.
+        :param log_handler: The handler log records are finally written with. Defaults to stderr.
         """
         self.config_file = config_file
+        self.cluster_id = cluster_id
         self.config = {}
 
         with open(self.config_file) as f:
             self.config = yaml.load(f, Loader=yaml.Loader)
 
         # Logging stuff
+        # Records are written on a background thread, so that a slow stderr can't block the loop.
+        self.log_handler = setup_logging(self.config, target=log_handler)
         self.logger = logbook.Logger("Jokusoramame")
         self.logger.level = logbook.INFO
 
@@ -67,6 +95,7 @@ class Jokusoramame(AutoShardedBot):
         # Create our connections.
         self.database = DatabaseInterface(self)
         self.redis = RedisAdapter(self)
+        self.jobs = JobCoordinator(self)
 
         # Re-assign commands and extensions.
         self.all_commands = OrderedDict()
@@ -97,12 +126,107 @@ class Jokusoramame(AutoShardedBot):
         # Is the bot fully loaded yet?
         self.loaded = False
 
+        # Timings for the on_message_context listeners.
+        self.listener_stats = ListenerStats()
+
+        # Member and role lookups, kept up to date from gateway events.
+        self.indexes = LookupIndex()
+
+        # Startup timings.
+        self.profiler = StartupProfiler()
+
+        # Every background task, grouped by the cog that owns it.
+        self.tasks = TaskSupervisor(self)
+
+        # Event loop lag, and what is blocking the loop.
+        self.watchdog = watchdog_from_config(self.loop, self.config)  # type: LoopWatchdog
+
+        # Prometheus metrics, served on /metrics.
+        self.metrics = setup_bot_metrics(self)
+
+        # Where each command spends its time.
+        self.command_timer = CommandTimer(self.loop)
+        self.command_timer.instrument(self.database, "db", exclude=("connect",))
+        self.http.request = self.command_timer.wrap("http", self.http.request)
+
+        # Our own default executor, so that its queue can be watched.
+        # This is what `threadpool()` runs everything on.
+        default_executor = ThreadPoolExecutor(max_workers=self.config.get("threadpool_size"))
+        self.loop.set_default_executor(default_executor)
+        self.register_executor("default", default_executor)
+
+        # The process pool tags, Lua and charts all run on.
+        # This belongs to the bot rather than any cog, so reloading cogs doesn't start new workers.
+        self.compute = ComputeService.from_config(self, self.config)
+
+        # Set when each service is connected.
+        # Cogs declare which of these their `ready()` needs with a `requires` attribute.
+        self.services = {
+            "database": asyncio.Event(loop=self.loop),
+            "redis": asyncio.Event(loop=self.loop),
+        }
+
     # Utility functions.
-    def get_member(self, id: int):
+    def register_executor(self, name: str, executor):
+        """
+        Registers an executor, so that it shows up in the metrics and in command timings.
+        """
+        self.metrics.register_executor(name, executor)
+        self.command_timer.instrument_executor(executor)
+
+    def get_member(self, id: int) -> discord.Member:
         """
         Gets a member from all members.
         """
-        return discord.utils.get(self.get_all_members(), id=id)
+        return self.indexes.get_member(id)
+
+    def get_role(self, guild: discord.Guild, role_id: int) -> discord.Role:
+        """
+        Gets a role in a guild by ID.
+        """
+        return self.indexes.get_role(guild.id, role_id)
+
+    def get_roles(self, guild: discord.Guild, role_ids: typing.Iterable[int]) -> typing.List[discord.Role]:
+        """
+        Gets the roles in a guild for each ID, skipping any that no longer exist.
+        """
+        return self.indexes.get_roles(guild.id, role_ids)
+
+    def rebuild_indexes(self):
+        """
+        Rebuilds the member and role indexes from scratch.
+        """
+        self.indexes.clear()
+        for guild in self.guilds:
+            self.indexes.add_guild(guild)
+
+    # Index maintenance.
+    async def on_guild_join(self, guild: discord.Guild):
+        self.indexes.add_guild(guild)
+
+    async def on_guild_available(self, guild: discord.Guild):
+        self.indexes.add_guild(guild)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.indexes.remove_guild(guild)
+
+    async def on_guild_unavailable(self, guild: discord.Guild):
+        self.indexes.remove_guild(guild)
+
+    async def on_member_join(self, member: discord.Member):
+        self.indexes.add_member(member)
+
+    async def on_member_remove(self, member: discord.Member):
+        self.indexes.remove_member(member)
+
+    async def on_guild_role_create(self, role: discord.Role):
+        self.indexes.add_role(role)
+
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        self.indexes.add_role(after)
+
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.indexes.remove_role(role)
 
     @staticmethod
     async def get_command_prefix(self: 'Jokusoramame', message: discord.Message):
@@ -112,6 +236,24 @@ class Jokusoramame(AutoShardedBot):
 
         return ["j" + s for s in ["!", "?", "::", "->"]] + ["J" + s for s in ["!", "?", "::", "->"]]
 
+    async def cluster_heartbeat(self):
+        """
+        Periodically publishes the status of this cluster to Redis.
+        """
+        while True:
+            try:
+                await self.redis.update_cluster_status(self.cluster_id, {
+                    "shards": "{}-{}".format(min(self.shard_ids), max(self.shard_ids)),
+                    "guilds": len(self.guilds),
+                    "latency": round(self.latency * 1000, 2),
+                    "pid": os.getpid(),
+                    "updated": time.time()
+                })
+            except Exception:
+                self.logger.exception("Failed to update cluster status!")
+
+            await asyncio.sleep(10)
+
     async def rotate_game_text(self):
         for i in itertools.cycle(self.config.get("game_rotation", [])):
             await self.change_presence(
@@ -174,6 +316,50 @@ class Jokusoramame(AutoShardedBot):
         elif isinstance(exception, DoNotRun):
             await context.channel.send(" ".join(exception.args))
 
+    def load_extension(self, name: str):
+        """
+        Loads an extension, recording how long the import and the setup took.
+
+        Once the bot has loaded, the `ready()` of every cog the extension adds is started too, so that reloading an
+        extension restarts the tasks that unloading it cancelled.
+        """
+        if name in self.extensions:
+            return
+
+        before = set(self.cogs)
+
+        with self.profiler.measure("import", name):
+            lib = importlib.import_module(name)
+
+        if not hasattr(lib, 'setup'):
+            del lib
+            del sys.modules[name]
+            raise discord.ClientException('extension does not have a setup function')
+
+        with self.profiler.measure("setup", name):
+            lib.setup(self)
+
+        self.extensions[name] = lib
+
+        if self.loaded is True:
+            for cog_name, cog in self.cogs.items():
+                if cog_name not in before:
+                    self._spawn_ready(cog_name, cog)
+
+    def unload_extension(self, name: str):
+        """
+        Unloads an extension, cancelling every task owned by its cogs first.
+        """
+        lib = self.extensions.get(name)
+        if lib is None:
+            return
+
+        for cog_name, cog in self.cogs.items():
+            if cog.__module__ == lib.__name__ or cog.__module__.startswith(lib.__name__ + "."):
+                self.tasks.cancel_owner(cog_name)
+
+        super().unload_extension(name)
+
     def reload_config_file(self):
         """
         Reloads the current config file.
@@ -183,6 +369,9 @@ class Jokusoramame(AutoShardedBot):
 
     def _global_check(self, ctx: 'Context'):
         from joku.core.checks import md_check
+        if not self.services["database"].is_set():
+            raise DoNotRun(":hourglass: The bot is still starting up. Try again in a moment.")
+
         if ctx.prefix.endswith("::") and ctx.command.name != "help":
             if md_check not in ctx.command.checks:
                 raise DoNotRun(":x: This command requires the normal prefix (`j!`).")
@@ -193,21 +382,25 @@ class Jokusoramame(AutoShardedBot):
         if not self.config.get("developer_mode", False):
             await self.change_presence(game=discord.Game(name="Type j!help or j::help for help!"))
         else:
-            await self.rotate_game_text()
-
-    async def on_ready(self):
-        # Only ever load once.
-        if self.loaded is True:
-            return
+            self.tasks.spawn_loop(self.rotate_game_text, name="rotate_game_text")
 
-        self.loaded = False
+    async def _run_phase(self, name: str, coro: typing.Awaitable):
+        """
+        Runs a startup phase with a timeout, recording how long it took.
+        """
+        with self.profiler.measure("on_ready", name):
+            return await asyncio.wait_for(coro, timeout=PHASE_TIMEOUTS.get(name, 30), loop=self.loop)
 
-        self.logger.info("Loaded Jokusoramame, logged in as {}#{}.".format(self.user.name,
-                                                                           self.user.discriminator))
-        self.logger.info("Guilds: {}".format(len(self.guilds)))
-        self.logger.info("Users: {}".format(len(set(self.get_all_members()))))
+    async def _load_application_info(self):
+        try:
+            app_info = await self._run_phase("application_info", self.application_info())
+        except Exception:
+            # the owner ID is needed for the owner checks, so carrying on without it isn't an option
+            self.logger.error("Unable to load the application info!")
+            traceback.print_exc()
+            await self.logout()
+            raise
 
-        app_info = await self.application_info()
         self.app_id = app_info.id
         self.owner_id = app_info.owner.id
 
@@ -219,74 +412,209 @@ class Jokusoramame(AutoShardedBot):
 
         self.logger.info("Invite link: {}".format(discord.utils.oauth_url(self.invite_url)))
 
+    async def _connect_database(self):
         try:
-            await self.database.connect(self.config.get("dsn", None))
+            await self._run_phase("postgres", self.database.connect(self.config.get("dsn", None)))
         except Exception:
             self.logger.error("Unable to connect to PostgreSQL!")
             traceback.print_exc()
             await self.logout()
-            return
+            raise
+
+        self.services["database"].set()
 
+    async def _connect_redis(self):
         try:
-            await self.redis.connect(**self.config.get("redis", {}))
-        except ConnectionRefusedError:
+            await self._run_phase("redis", self.redis.connect(**self.config.get("redis", {})))
+        except Exception:
             self.logger.error("Unable to connect to Redis!")
             traceback.print_exc()
             await self.logout()
-            return
+            raise
 
-        autoload = self.config.get("autoload", [])
-        if "joku.cogs.core" not in autoload:
-            autoload.append("joku.cogs.core")
+        self.services["redis"].set()
+
+    async def _import_cogs(self, autoload: typing.List[str]):
+        """
+        Imports the cog modules on the default executor, so that the imports overlap the network phases.
 
-        for cog in autoload:
+        Errors are ignored here, as they will be raised again by `load_extension`.
+        """
+        def _import(name: str):
             try:
-                self.load_extension(cog)
-            except Exception as e:
-                self.logger.exception("Failed to load cog {}!".format(cog))
-            else:
-                self.logger.info("Loaded cog {}.".format(cog))
+                importlib.import_module(name)
+            except Exception:
+                pass
 
-        self.logger.info("Loaded {} cogs.".format(len(self.cogs)))
-        self.logger.info("Running with {} commands.".format(len(self.commands)))
+        with self.profiler.measure("on_ready", "import_cogs"):
+            await asyncio.gather(*[self.loop.run_in_executor(None, _import, name) for name in autoload],
+                                 loop=self.loop)
 
-        for name, cog in self.cogs.items():
-            if hasattr(cog, "ready"):
-                self.loop.create_task(cog.ready())
+    def _spawn_ready(self, name: str, cog):
+        """
+        Starts a cog's `ready()`, if it has one.
+        """
+        if hasattr(cog, "ready"):
+            self.tasks.spawn_loop(lambda: self._run_ready(name, cog), name="{}.ready".format(name), owner=name)
+
+    async def _run_ready(self, name: str, cog):
+        """
+        Runs a cog's `ready()` once the services it requires are up.
+        """
+        requires = getattr(cog, "requires", ("database", "redis"))
+        await asyncio.gather(*[self.services[service].wait() for service in requires], loop=self.loop)
+        await self.profiler.measure_ready(name, cog.ready())
 
+    async def _start_webserver(self):
         self.logger.info("Booting up Kyoukai internal webserver...")
         # always add oauth2 bp
         from joku.web.oauth import bp as oauth2_bp
         self.webserver.register_blueprint(oauth2_bp)
         from joku.web.root import root as root_bp
         self.webserver.register_blueprint(root_bp)
+        from joku.web.debug import debug as debug_bp
+        self.webserver.register_blueprint(debug_bp)
+        from joku.web.metrics import metrics as metrics_bp
+        self.webserver.register_blueprint(metrics_bp)
 
         self.webserver.finalize()
         ws_cfg = self.config.get("webserver", {})
+        port = ws_cfg.get("port", 4444)
+        if self.cluster_id is not None:
+            # every cluster runs its own webserver, on the port after the previous cluster's
+            port += self.cluster_id
+
         try:
-            await self.webserver.start(ip=ws_cfg.get("ip", "127.0.0.1"),
-                                       port=ws_cfg.get("port", 4444))
+            await self._run_phase("webserver", self.webserver.start(ip=ws_cfg.get("ip", "127.0.0.1"), port=port))
         except Exception as e:
             self.logger.exception("Failed to load Kyoukai!")
 
+    async def on_ready(self):
+        # Always rebuild, as a reconnect may have missed events.
+        self.rebuild_indexes()
+
+        # Only ever load once.
+        # Reconnects fire on_ready again, but everything below survives them.
+        if self.loaded is True:
+            self.logger.info("Reconnected.")
+            return
+
+        self.loaded = True
+        self.tasks.spawn_loop(self.watchdog.heartbeat, name="watchdog")
+
+        self.logger.info("Loaded Jokusoramame, logged in as {}#{}.".format(self.user.name,
+                                                                           self.user.discriminator))
+        self.logger.info("Guilds: {}".format(len(self.guilds)))
+        self.logger.info("Users: {}".format(self.indexes.user_count))
+
+        autoload = self.config.get("autoload", [])
+        if "joku.cogs.core" not in autoload:
+            autoload.append("joku.cogs.core")
+
+        # None of these depend on each other, so they all run at once.
+        # Commands are refused by the global check until the database is up.
+        services = asyncio.gather(self._load_application_info(), self._connect_database(), self._connect_redis(),
+                                  loop=self.loop)
+        await self._import_cogs(autoload)
+
+        # Each ready() is started by load_extension, and waits for the services it needs on its own.
+        with self.profiler.measure("on_ready", "cogs"):
+            for cog in autoload:
+                try:
+                    self.load_extension(cog)
+                except Exception as e:
+                    self.logger.exception("Failed to load cog {}!".format(cog))
+                else:
+                    self.logger.info("Loaded cog {}.".format(cog))
+
+        self.logger.info("Loaded {} cogs.".format(len(self.cogs)))
+
+        # the workers are forked after the cogs are imported, so they start with everything already imported
+        with self.profiler.measure("on_ready", "compute"):
+            self.compute.start()
+        self.logger.info("Running with {} commands.".format(len(self.commands)))
+
+        webserver = self.loop.create_task(self._start_webserver())
+
+        try:
+            await services
+        except Exception:
+            # whichever phase failed has already logged out
+            self.logger.exception("Startup failed!")
+            webserver.cancel()
+            return
+
+        if self.cluster_id is not None:
+            self.tasks.spawn_loop(self.cluster_heartbeat, name="cluster_heartbeat")
+
+        await webserver
+
         new_time = time.time() - self.startup_time
 
         self.logger.info("Bot ready in {} seconds.".format(new_time))
+        for line in self.profiler.get_report():
+            self.logger.info(line)
 
-    async def on_message(self, message: Message):
-        self.logger.info("Recieved message: {message.content} "
-                         "from {message.author.display_name} ({message.author.name}){bot}"
-                         .format(message=message, bot=" [BOT]" if message.author.bot else ""))
-        self.logger.info(" On channel: #{message.channel.name}".format(message=message))
+    def dispatch(self, event_name: str, *args, **kwargs):
+        if event_name == "socket_response":
+            # every gateway payload comes through here, but only dispatches have a type
+            event_type = args[0].get("t")
+            if event_type is not None:
+                self.metrics.gateway_events.inc(event_type)
+
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def invoke(self, ctx: 'Context'):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+
+        self.command_timer.begin()
+        try:
+            await super().invoke(ctx)
+        finally:
+            name = ctx.command.qualified_name
+            breakdown = self.command_timer.end(name)
+            if breakdown is not None:
+                self.metrics.command_latency.observe(breakdown.wall, name)
+            self.metrics.commands.inc(name, "error" if getattr(ctx, "command_failed", False) else "ok")
 
-        if message.guild is not None:
-            self.logger.info(" On server: {} ({})".format(message.guild.name, message.guild.id))
+    async def on_message(self, message: Message):
+        # This is formatted lazily on the log thread, and only if it isn't sampled out.
+        self.logger.info("Recieved message: {} from {} ({}){} on #{} in {} ({})",
+                         message.content, message.author.display_name, message.author.name,
+                         " [BOT]" if message.author.bot else "", getattr(message.channel, "name", "DM"),
+                         getattr(message.guild, "name", "DMs"), getattr(message.guild, "id", 0),
+                         extra={"category": "message_received"})
 
         # if await self.database.is_channel_ignored(message.channel, type_="commands"):
         #    return
 
+        self.loop.create_task(self.dispatch_message_context(MessageContext(self, message)))
+
         await super().on_message(message)
 
+    async def dispatch_message_context(self, ctx: MessageContext):
+        """
+        Hands a message context to every cog with an `on_message_context` listener.
+
+        The listeners run concurrently and share the lookups on the context.
+        """
+        start = time.perf_counter()
+
+        listeners = []
+        for name, cog in self.cogs.items():
+            listener = getattr(cog, "on_message_context", None)
+            if listener is not None:
+                listeners.append(timed(self.listener_stats, name, listener(ctx)))
+
+        results = await asyncio.gather(*listeners, loop=self.loop, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                lines = traceback.format_exception(type(result), result, result.__traceback__)
+                self.logger.error(''.join(lines))
+
+        self.listener_stats.record_message(time.perf_counter() - start)
+
     def run(self):
         token = self.config["bot_token"]
         super().run(token)
@@ -295,6 +623,10 @@ class Jokusoramame(AutoShardedBot):
         token = self.config["bot_token"]
         return await super().login(token)
 
+    async def close(self):
+        self.compute.shutdown()
+        await super().close()
+
 
 class Context(commands.Context):
     def __init__(self, *args, **kwargs):
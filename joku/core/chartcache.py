@@ -0,0 +1,94 @@
+"""
+A cache of rendered charts.
+
+Charts are cached per guild, under a key naming the chart (such as `("stocks", "all")`) and a version of the data it
+was rendered from (such as the stock tick). A chart is only rendered again once its data changes, and requests for a
+chart that is already being rendered wait for that render instead of starting another one.
+"""
+import asyncio
+import collections
+import typing
+
+#: The number of charts kept per guild.
+DEFAULT_MAX_ENTRIES = 16
+
+#: The number of guilds charts are kept for.
+DEFAULT_MAX_GUILDS = 256
+
+
+class ChartCache(object):
+    """
+    Rendered charts, in an LRU per guild.
+    """
+
+    def __init__(self, bot, max_entries: int = DEFAULT_MAX_ENTRIES, max_guilds: int = DEFAULT_MAX_GUILDS):
+        self.bot = bot
+        self.max_entries = max_entries
+        self.max_guilds = max_guilds
+
+        #: Guild ID -> chart key -> (version, PNG bytes)
+        self._guilds = collections.OrderedDict()  # type: typing.Dict[int, typing.Dict[tuple, tuple]]
+
+        #: (guild ID, chart key, version) -> the task rendering it
+        self._rendering = {}  # type: typing.Dict[tuple, asyncio.Task]
+
+    def _get(self, guild_id: int, key: tuple, version) -> typing.Union[bytes, None]:
+        charts = self._guilds.get(guild_id)
+        if charts is None:
+            return None
+
+        cached = charts.get(key)
+        if cached is None or cached[0] != version:
+            return None
+
+        charts.move_to_end(key)
+        self._guilds.move_to_end(guild_id)
+        return cached[1]
+
+    def _put(self, guild_id: int, key: tuple, version, data: bytes):
+        charts = self._guilds.get(guild_id)
+        if charts is None:
+            charts = self._guilds[guild_id] = collections.OrderedDict()
+            if len(self._guilds) > self.max_guilds:
+                self._guilds.popitem(last=False)
+        else:
+            self._guilds.move_to_end(guild_id)
+
+        # the old version of this chart is replaced
+        charts[key] = (version, data)
+        charts.move_to_end(key)
+        if len(charts) > self.max_entries:
+            charts.popitem(last=False)
+
+    async def _render(self, guild_id: int, key: tuple, version,
+                      render: typing.Callable[[], typing.Awaitable[bytes]]) -> bytes:
+        try:
+            data = await render()
+            self._put(guild_id, key, version, data)
+            return data
+        finally:
+            self._rendering.pop((guild_id, key, version), None)
+
+    async def get_or_render(self, guild_id: int, key: tuple, version,
+                            render: typing.Callable[[], typing.Awaitable[bytes]]) -> bytes:
+        """
+        Gets a chart, rendering it if this version isn't cached.
+
+        :param key: The chart's key. This should include anything that changes what is plotted, apart from the
+            version.
+        :param version: The version of the data the chart is plotted from.
+        :param render: A coroutine function that renders the chart, returning PNG bytes.
+        """
+        data = self._get(guild_id, key, version)
+        if data is not None:
+            self.bot.metrics.cache("chart", True)
+            return data
+
+        task = self._rendering.get((guild_id, key, version))
+        self.bot.metrics.cache("chart", task is not None)
+        if task is None:
+            task = self._rendering[(guild_id, key, version)] = self.bot.loop.create_task(
+                self._render(guild_id, key, version, render))
+
+        # one caller giving up doesn't cancel the render for everyone else waiting on it
+        return await asyncio.shield(task, loop=self.bot.loop)
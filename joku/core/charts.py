@@ -0,0 +1,129 @@
+"""
+Chart rendering tasks.
+
+These run on the compute service's chart queue. Each takes plain data and NumPy arrays and returns the chart as PNG
+bytes, so that nothing but numbers and strings goes to the workers and only the image comes back.
+
+Charts are drawn on their own :class:`matplotlib.figure.Figure`, rendered with the Agg canvas, rather than through
+pyplot. No figure state is shared between renders, so a render that fails can't affect the next one, and every
+worker on the queue can render a chart at the same time.
+"""
+import textwrap
+import typing
+from io import BytesIO
+from math import ceil
+
+import numpy as np
+
+from joku.core.mp2 import register_task
+
+
+def _new_figure() -> 'matplotlib.figure.Figure':
+    # matplotlib is only imported the first time a worker plots something
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _render(fig) -> bytes:
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+@register_task("charts.stocks")
+def plot_stocks(names: list, prices: typing.List[np.ndarray], dates: list) -> bytes:
+    """
+    Plots stock prices over time.
+
+    :param names: The name of each stock.
+    :param prices: The prices of each stock, as an array per stock.
+    :param dates: The label of each price.
+    """
+    import matplotlib.cm as cm
+
+    fig = _new_figure()
+    ax = fig.add_subplot(1, 1, 1)
+
+    # axis labels
+    ax.set_xlabel("Time UTC (HH:MM)")
+    ax.set_ylabel("Price (§)")
+
+    # hacky to get the right bottom
+    x = np.arange(0, len(dates))
+
+    # rainbowify the lines
+    colours = cm.rainbow(np.linspace(0, 1, len(prices)))
+    for values, colour in zip(prices, colours):
+        # plot against dates
+        ax.plot(x, values, color=colour)
+
+    # xticks the data
+    ax.set_xticks(x)
+    ax.set_xticklabels(dates, rotation=270)
+
+    ax.set_title("1st Stock Market of Joku")
+
+    # only show every 2nd tick
+    for label in ax.get_xticklabels()[::2]:
+        label.set_visible(False)
+
+    ax.legend(names, loc="best")
+    fig.tight_layout()
+
+    return _render(fig)
+
+
+@register_task("charts.levels")
+def plot_levels(levels: np.ndarray, guild_name: str) -> bytes:
+    """
+    Plots the level distribution of a guild.
+
+    :param levels: An array of the level of every member with XP.
+    :param guild_name: The name of the guild, for the title.
+    """
+    from joku.core.utils import reject_outliers
+
+    # seaborn imports pyplot, which must not pick an interactive backend
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import seaborn as sns
+
+    # 12 is reasonable for rejecting the super outliers
+    lvls = reject_outliers(np.asarray(levels), m=12)
+
+    fig = _new_figure()
+    with sns.axes_style('white'):
+        ax = fig.add_subplot(1, 1, 1)
+
+    # The bw argument makes it slightly less "rounded"
+    sns.kdeplot(lvls, shade=True, bw=0.3, color='#DFA5A4', ax=ax)
+
+    ax.set_xlabel('Level', fontsize=14)
+    title = textwrap.wrap('Level distribution curve for {}'.format(guild_name), 30)
+    ax.set_title('\n'.join(title), fontsize=23)
+
+    # Remove text from left
+    ax.set_yticks([])
+
+    # "Hacky" way of limiting the x-axis but I couldnt
+    # come up with anything better
+    max_level = ceil(max(lvls) / 10) * 10
+    ax.set_xticks(np.arange(0, max_level, 10))
+
+    # Set the limits of the axis so it doesnt
+    # expand too much in any direction
+    ax.set_xbound(0, max_level + 1)
+
+    # Removes the spines
+    sns.despine(ax=ax)
+    ax.spines['bottom'].set_visible(False)
+    ax.spines['left'].set_visible(False)
+
+    # Force a tighter ( ;) ) layout.
+    fig.tight_layout()
+
+    return _render(fig)
@@ -0,0 +1,214 @@
+"""
+Multi-process cluster launcher.
+
+Each cluster is a separate process running its own :class:`joku.core.bot.Jokusoramame`, owning a contiguous
+range of shard IDs. The launcher supervises the clusters, restarting any that die, and collects the logs of
+every cluster into its own stderr.
+"""
+import multiprocessing
+import sys
+import time
+import typing
+
+import logbook
+from logbook.queues import MultiProcessingHandler, MultiProcessingSubscriber
+
+try:
+    import yaml
+except ImportError:
+    import ruamel.yaml as yaml
+
+#: The format used for aggregated log lines.
+LOG_FORMAT = "[{record.time:%Y-%m-%d %H:%M:%S}] {record.level_name}: " \
+             "[cluster {record.extra[cluster]}] {record.channel}: {record.message}"
+
+#: The longest a crashed cluster will wait before being restarted.
+MAX_BACKOFF = 300
+
+#: How long a cluster has to stay alive for its backoff to be reset.
+STABLE_AFTER = 60
+
+
+def load_config(config_file: str) -> dict:
+    """
+    Loads a config file.
+    """
+    with open(config_file) as f:
+        return yaml.load(f, Loader=yaml.Loader)
+
+
+def get_shard_ranges(cluster_count: int, shard_count: int) -> typing.List[typing.List[int]]:
+    """
+    Splits ``shard_count`` shards into ``cluster_count`` contiguous ranges.
+
+    Earlier clusters get one extra shard each if the shards do not split evenly.
+    """
+    if cluster_count > shard_count:
+        raise ValueError("Cannot have more clusters ({}) than shards ({})".format(cluster_count, shard_count))
+
+    per_cluster, extra = divmod(shard_count, cluster_count)
+    ranges = []
+    start = 0
+    for cluster_id in range(cluster_count):
+        size = per_cluster + (1 if cluster_id < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+
+    return ranges
+
+
+def _run_cluster(config_file: str, cluster_id: int, shard_ids: typing.List[int], shard_count: int,
+                 log_queue: multiprocessing.Queue):
+    """
+    The entry point of a cluster process.
+    """
+    import gyukutai
+    gyukutai.apply()
+
+    from joku.core.bot import Jokusoramame
+
+    # Tag every record with our cluster, and send them to the launcher instead of our own stderr.
+    def inject(record):
+        record.extra["cluster"] = cluster_id
+
+    logbook.Processor(inject).push_application()
+
+    bot = Jokusoramame(config_file=config_file, shard_ids=shard_ids, shard_count=shard_count,
+                       cluster_id=cluster_id, log_handler=MultiProcessingHandler(log_queue))
+    bot.logger.info("Launching cluster {} with shards {}-{} of {}...".format(cluster_id, shard_ids[0],
+                                                                              shard_ids[-1], shard_count))
+    try:
+        bot.run()
+    except (KeyboardInterrupt, EOFError):
+        pass
+
+
+class _Cluster(object):
+    """
+    Book-keeping for a single cluster process.
+    """
+
+    def __init__(self, cluster_id: int, shard_ids: typing.List[int]):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+
+        self.process = None  # type: multiprocessing.Process
+        self.started_at = 0.0
+        self.restarts = 0
+        self.backoff = 1
+        self.restart_at = None
+
+    @property
+    def status(self) -> dict:
+        alive = self.process is not None and self.process.is_alive()
+        return {
+            "cluster": self.cluster_id,
+            "shards": "{}-{}".format(self.shard_ids[0], self.shard_ids[-1]),
+            "pid": self.process.pid if alive else None,
+            "alive": alive,
+            "uptime": int(time.time() - self.started_at) if alive else 0,
+            "restarts": self.restarts,
+        }
+
+
+class ClusterLauncher(object):
+    """
+    Spawns and supervises the cluster processes.
+    """
+
+    def __init__(self, config_file: str, cluster_count: int, shard_count: int):
+        self.config_file = config_file
+        self.shard_count = shard_count
+
+        self.logger = logbook.Logger("Jokusoramame.Launcher")
+        self.logger.level = logbook.INFO
+
+        # spawn, not fork, so that each cluster gets a clean interpreter without our threads
+        self._mp = multiprocessing.get_context("spawn")
+        self.log_queue = self._mp.Queue(-1)
+
+        self.clusters = [_Cluster(cluster_id, shard_ids) for cluster_id, shard_ids in
+                         enumerate(get_shard_ranges(cluster_count, shard_count))]
+
+        self._stopping = False
+
+    def _start_cluster(self, cluster: _Cluster):
+        cluster.process = self._mp.Process(target=_run_cluster,
+                                           args=(self.config_file, cluster.cluster_id, cluster.shard_ids,
+                                                 self.shard_count, self.log_queue),
+                                           name="joku-cluster-{}".format(cluster.cluster_id))
+        cluster.process.start()
+        cluster.started_at = time.time()
+        cluster.restart_at = None
+        self.logger.info("Started cluster {} (pid {}).".format(cluster.cluster_id, cluster.process.pid))
+
+    def _supervise(self):
+        """
+        Checks each cluster, and schedules or performs restarts.
+        """
+        now = time.time()
+        for cluster in self.clusters:
+            if cluster.process.is_alive():
+                if now - cluster.started_at > STABLE_AFTER:
+                    cluster.backoff = 1
+                continue
+
+            if cluster.restart_at is None:
+                self.logger.error("Cluster {} died with exit code {}, restarting in {} seconds."
+                                  .format(cluster.cluster_id, cluster.process.exitcode, cluster.backoff))
+                cluster.restart_at = now + cluster.backoff
+                cluster.backoff = min(cluster.backoff * 2, MAX_BACKOFF)
+            elif now >= cluster.restart_at:
+                cluster.restarts += 1
+                self._start_cluster(cluster)
+
+    def get_status(self) -> typing.List[dict]:
+        """
+        :return: The status of every cluster.
+        """
+        return [cluster.status for cluster in self.clusters]
+
+    def log_status(self):
+        for status in self.get_status():
+            self.logger.info("Cluster {cluster} (shards {shards}): alive={alive} pid={pid} "
+                             "uptime={uptime}s restarts={restarts}".format(**status))
+
+    def stop(self):
+        self._stopping = True
+        for cluster in self.clusters:
+            if cluster.process is not None and cluster.process.is_alive():
+                cluster.process.terminate()
+
+        for cluster in self.clusters:
+            if cluster.process is not None:
+                cluster.process.join(timeout=10)
+
+    def run(self, status_interval: int = 300):
+        """
+        Runs the launcher until interrupted.
+        """
+        # Log lines from the clusters are formatted here.
+        handler = logbook.StreamHandler(sys.stderr, format_string=LOG_FORMAT, bubble=False)
+        handler.push_application()
+        logbook.Processor(lambda record: record.extra.setdefault("cluster", "L")).push_application()
+
+        subscriber = MultiProcessingSubscriber(self.log_queue)
+        controller = subscriber.dispatch_in_background()
+
+        self.logger.info("Launching {} clusters over {} shards.".format(len(self.clusters), self.shard_count))
+        for cluster in self.clusters:
+            self._start_cluster(cluster)
+
+        last_status = time.time()
+        try:
+            while not self._stopping:
+                self._supervise()
+                if time.time() - last_status > status_interval:
+                    self.log_status()
+                    last_status = time.time()
+                time.sleep(1)
+        except (KeyboardInterrupt, EOFError):
+            pass
+        finally:
+            self.stop()
+            controller.stop()
@@ -0,0 +1,106 @@
+"""
+A size-bounded LRU cache for compiled tag code.
+
+This lives inside each tag worker process. Entries are keyed by the tag's ID and version, so an edited tag simply
+stops being looked up under its old key and ages out.
+"""
+import collections
+import hashlib
+import typing
+
+#: The default byte budget of a cache.
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+#: The default maximum number of entries in a cache.
+DEFAULT_MAX_ENTRIES = 2048
+
+#: A rough guess at how much bigger compiled code is than its source.
+COMPILED_SIZE_FACTOR = 8
+
+
+def get_tag_version(last_modified, content: str) -> str:
+    """
+    Gets the version of a tag, used as part of its cache key.
+
+    This is the last modified time, or a hash of the content for tags that have never been modified.
+    """
+    if last_modified is not None:
+        return last_modified.isoformat()
+
+    return hashlib.sha1((content or "").encode("utf-8")).hexdigest()
+
+
+class CompiledCache(object):
+    """
+    An LRU cache with a byte budget.
+
+    The size of an entry is estimated from the length of its source, as compiled objects can't be measured.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        #: Key -> (value, size)
+        self._entries = collections.OrderedDict()  # type: typing.Dict[typing.Hashable, typing.Tuple[typing.Any, int]]
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: typing.Hashable) -> typing.Any:
+        """
+        :return: The cached value, or None.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: typing.Hashable, value: typing.Any, source: str):
+        """
+        Caches a value compiled from some source.
+        """
+        size = len(source) * COMPILED_SIZE_FACTOR
+        if size > self.max_bytes:
+            # never evict everything for one huge tag
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+
+        self._entries[key] = (value, size)
+        self.size += size
+
+        while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def get_or_compile(self, key: typing.Hashable, source: str, compile_: typing.Callable[[str], typing.Any]):
+        """
+        Gets a cached value, or compiles and caches it.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compile_(source)
+            self.put(key, value, source)
+
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def get_stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self.size, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
@@ -0,0 +1,256 @@
+"""
+The bot's compute service.
+
+All CPU heavy work - tag rendering, Lua evaluation and chart rendering - runs on one process pool owned by the bot,
+rather than a pool per cog. Work is submitted to a named queue; each queue has a priority, so that an interactive
+tag render never waits behind a batch of charts, and a deadline, past which the worker running it is killed and
+replaced.
+
+As the pool belongs to the bot, reloading a cog no longer starts a new set of worker processes.
+
+Bulk work, such as rendering many charts, is submitted as a stream: every call is submitted at once, small calls are
+sent to the workers in batches, and results are delivered as they finish.
+"""
+import asyncio
+import functools
+import os
+import time
+import typing
+
+import logbook
+
+from joku.core.mp2 import DEFAULT_BATCH_SIZE, EXTRA_QUEUED_CALLS, ProcessPoolExecutor
+
+
+class ComputeQueue(object):
+    """
+    A named queue of work on the compute service.
+    """
+
+    def __init__(self, name: str, priority: int, deadline: float = None):
+        self.name = name
+
+        #: Lower priorities are started first.
+        self.priority = priority
+
+        #: How long a single call may run for, in seconds.
+        self.deadline = deadline
+
+        #: The calls submitted to this queue and not yet finished.
+        self.in_flight = 0
+
+        self.submitted = 0
+        self.failed = 0
+
+
+#: The default queues. The tag and eval deadlines default to the Lua deadline.
+DEFAULT_QUEUES = {
+    # interactive tag renders
+    "tags": {"priority": 0},
+    # `lua exec` and other owner/user code evaluation
+    "eval": {"priority": 1},
+    # chart rendering
+    "charts": {"priority": 2, "deadline": 30},
+}
+
+
+def _init_worker(cache_bytes: int = None, lua_limits: dict = None):
+    """
+    Warms up a compute worker for every kind of work it can be given.
+    """
+    # only import these in the workers, as the parent may not have loaded the tag or Lua cogs yet
+    from joku.cogs.lua import getter, warm_runtimes
+    from joku.core import tagengine
+
+    tagengine._init_worker(cache_bytes, lua_limits)
+    warm_runtimes(getter, cache_bytes=cache_bytes, limits=lua_limits)
+
+
+class TaskStream(object):
+    """
+    The results of many calls of a task, in the order they finish.
+
+    Iterating over this gives (index, result) pairs, where index is the position of the call's arguments. A call
+    that raised raises from the iteration, unless `return_exceptions` is set, in which case the exception is given as
+    its result. Cancelled calls are skipped.
+
+    Used as an async context manager, every call still waiting for a worker is cancelled on exit.
+    """
+
+    def __init__(self, service: 'ComputeService', queue: ComputeQueue, futures: list,
+                 return_exceptions: bool = False):
+        self.service = service
+        self.queue = queue
+        self.futures = futures
+        self.return_exceptions = return_exceptions
+
+        self._start = time.perf_counter()
+        self._remaining = len(futures)
+        self._done = asyncio.Queue(loop=service.bot.loop)
+
+        queue.submitted += len(futures)
+        queue.in_flight += len(futures)
+        for index, future in enumerate(futures):
+            future.add_done_callback(functools.partial(self._on_done, index))
+
+    def _on_done(self, index: int, future):
+        # this is called from the executor's thread, or from cancel()
+        self.service.bot.loop.call_soon_threadsafe(self._finish, index, future)
+
+    def _finish(self, index: int, future):
+        self.queue.in_flight -= 1
+        self.service.latency.observe(time.perf_counter() - self._start, self.queue.name)
+        if not future.cancelled() and future.exception() is not None:
+            self.queue.failed += 1
+
+        self._done.put_nowait((index, future))
+
+    def cancel(self, index: int = None) -> int:
+        """
+        Cancels a call, or every call, that is still waiting for a worker.
+
+        :param index: The index of the call to cancel, or None to cancel all of them.
+        :return: The number of calls cancelled.
+        """
+        futures = self.futures if index is None else [self.futures[index]]
+        return sum(future.cancel() for future in futures)
+
+    def __len__(self):
+        return len(self.futures)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> typing.Tuple[int, typing.Any]:
+        while self._remaining:
+            index, future = await self._done.get()
+            self._remaining -= 1
+
+            if future.cancelled():
+                continue
+
+            exc = future.exception()
+            if exc is None:
+                return index, future.result()
+
+            if self.return_exceptions:
+                return index, exc
+
+            raise exc
+
+        raise StopAsyncIteration
+
+    async def __aenter__(self) -> 'TaskStream':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.cancel()
+
+
+class ComputeService(object):
+    """
+    Runs work on the bot's process pool, through named queues.
+    """
+
+    def __init__(self, bot, workers: int = None, queues: typing.Dict[str, dict] = None,
+                 cache_bytes: int = None, lua_limits: dict = None, deadline: float = None,
+                 queue_depth: int = EXTRA_QUEUED_CALLS, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.bot = bot
+        self.logger = logbook.Logger("Jokusoramame.Compute")
+
+        self.queues = {}  # type: typing.Dict[str, ComputeQueue]
+        for name, options in (queues or DEFAULT_QUEUES).items():
+            self.queues[name] = ComputeQueue(name, options.get("priority", 0), options.get("deadline", deadline))
+
+        self.executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                            initializer=_init_worker, initargs=(cache_bytes, lua_limits),
+                                            queue_depth=queue_depth, batch_size=batch_size)
+        self.bot.register_executor("compute", self.executor)
+
+        self.latency = bot.metrics.histogram("joku_compute_seconds", "Time from submitting work to it finishing.",
+                                             ["queue"])
+        bot.metrics.gauge("joku_compute_in_flight", "Work submitted to each compute queue and not yet finished.",
+                          lambda: {q.name: q.in_flight for q in self.queues.values()}, labels=["queue"])
+        bot.metrics.callback_counter("joku_compute_failures_total", "Compute work that raised or timed out.",
+                                     lambda: {q.name: q.failed for q in self.queues.values()}, labels=["queue"])
+
+    @classmethod
+    def from_config(cls, bot, config: dict) -> 'ComputeService':
+        """
+        Creates the compute service from the `compute`, `tags` and `lua` sections of the config.
+        """
+        from joku.cogs.lua import get_lua_limits
+
+        section = config.get("compute", {})
+        lua_limits, deadline = get_lua_limits(config)
+
+        queues = {name: dict(options) for (name, options) in DEFAULT_QUEUES.items()}
+        for name, options in section.get("queues", {}).items():
+            queues.setdefault(name, {}).update(options)
+
+        return cls(bot, workers=section.get("workers"), queues=queues,
+                   cache_bytes=config.get("tags", {}).get("compiled_cache_bytes"),
+                   lua_limits=lua_limits, deadline=deadline,
+                   queue_depth=section.get("queue_depth", EXTRA_QUEUED_CALLS),
+                   batch_size=section.get("batch_size", DEFAULT_BATCH_SIZE))
+
+    def start(self):
+        """
+        Starts every worker process, so that the first calls don't pay for starting them.
+        """
+        self.executor.prewarm()
+
+    def _get_queue(self, name: str) -> ComputeQueue:
+        try:
+            return self.queues[name]
+        except KeyError:
+            raise LookupError("There is no compute queue named {!r}".format(name)) from None
+
+    async def _wait(self, queue: ComputeQueue, future) -> typing.Any:
+        queue.submitted += 1
+        queue.in_flight += 1
+        start = time.perf_counter()
+        try:
+            # cancelling this cancels the call too, if no worker has picked it up yet
+            return await asyncio.wrap_future(future, loop=self.bot.loop)
+        except BaseException:
+            queue.failed += 1
+            raise
+        finally:
+            queue.in_flight -= 1
+            self.latency.observe(time.perf_counter() - start, queue.name)
+
+    async def run(self, queue: str, fn: typing.Callable, *args, **kwargs) -> typing.Any:
+        """
+        Runs a function on a queue. The function and its arguments are sent with dill.
+        """
+        queue = self._get_queue(queue)
+        future = self.executor.submit_call(fn, args, kwargs, deadline=queue.deadline, priority=queue.priority)
+        return await self._wait(queue, future)
+
+    async def run_task(self, queue: str, name: str, *args, **kwargs) -> typing.Any:
+        """
+        Runs a registered task on a queue. Only the name and the plain data arguments are sent.
+        """
+        queue = self._get_queue(queue)
+        future = self.executor.submit_task(name, *args, deadline=queue.deadline, priority=queue.priority, **kwargs)
+        return await self._wait(queue, future)
+
+    def stream_tasks(self, queue: str, name: str, calls: typing.Iterable[tuple],
+                     return_exceptions: bool = False) -> TaskStream:
+        """
+        Runs many calls of a registered task on a queue, submitting them all at once.
+
+        :param calls: The positional arguments of each call.
+        :return: A :class:`TaskStream` of the results, as they finish.
+        """
+        queue = self._get_queue(queue)
+        futures = self.executor.submit_tasks(name, calls, deadline=queue.deadline, priority=queue.priority)
+        return TaskStream(self, queue, futures, return_exceptions=return_exceptions)
+
+    def shutdown(self):
+        """
+        Shuts the worker processes down. Work already running is allowed to finish.
+        """
+        self.logger.info("Shutting down the compute workers.")
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,135 @@
+"""
+Shared per-message event context.
+
+Every message is handed to several cogs. Instead of each cog looking up the guild settings, the user row and
+the anti-spam state on its own, the bot builds one :class:`MessageContext` per message and passes it to every
+``on_message_context`` listener. Each lookup is only done the first time a listener asks for it.
+"""
+import asyncio
+import collections
+import time
+import typing
+
+import discord
+
+from joku.db.tables import Guild, User
+
+
+class MessageContext(object):
+    """
+    Lazily memoized data about a single message.
+    """
+
+    def __init__(self, bot, message: discord.Message):
+        self.bot = bot
+        self.message = message
+
+        # Each lookup is stored as a task so that concurrent listeners share the same round trip.
+        self._lookups = {}  # type: typing.Dict[str, asyncio.Task]
+
+    @property
+    def guild(self) -> discord.Guild:
+        return self.message.guild
+
+    @property
+    def author(self) -> discord.Member:
+        return self.message.author
+
+    def _memoize(self, name: str, factory: typing.Callable[[], typing.Awaitable]) -> asyncio.Task:
+        task = self._lookups.get(name)
+        self.bot.metrics.cache("message_context", task is not None)
+        if task is None:
+            task = self.bot.loop.create_task(factory())
+            self._lookups[name] = task
+
+        return task
+
+    async def guild_row(self) -> typing.Union[Guild, None]:
+        """
+        :return: The database row for the guild this message was sent in, or None if it was a DM.
+        """
+        if self.guild is None:
+            return None
+
+        return await self._memoize("guild_row", lambda: self.bot.database.get_or_create_guild(self.guild))
+
+    async def guild_settings(self) -> dict:
+        """
+        :return: The settings for the guild this message was sent in.
+        """
+        guild = await self.guild_row()
+        if guild is None:
+            return {}
+
+        return guild.settings
+
+    async def get_setting(self, setting_name: str, default: typing.Any = None) -> typing.Any:
+        """
+        Gets a setting for the guild this message was sent in.
+        """
+        return (await self.guild_settings()).get(setting_name, default)
+
+    async def user_row(self) -> User:
+        """
+        :return: The database row for the author of this message.
+        """
+        return await self._memoize("user_row", lambda: self.bot.database.get_or_create_user(self.author))
+
+    async def antispam_ok(self) -> bool:
+        """
+        :return: If the author is under the anti-spam limit.
+
+        This counts the message towards the limit, so it must only be done once per message.
+        """
+        return await self._memoize("antispam_ok", lambda: self.bot.redis.prevent_spam(self.author))
+
+
+class ListenerStats(object):
+    """
+    Timing statistics for ``on_message_context`` listeners.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.total_time = 0.0
+
+        #: Listener name -> [calls, total time, max time, errors]
+        self.listeners = collections.defaultdict(lambda: [0, 0.0, 0.0, 0])
+
+    def record(self, name: str, taken: float, errored: bool = False):
+        stat = self.listeners[name]
+        stat[0] += 1
+        stat[1] += taken
+        stat[2] = max(stat[2], taken)
+        if errored:
+            stat[3] += 1
+
+    def record_message(self, taken: float):
+        self.messages += 1
+        self.total_time += taken
+
+    def get_rows(self) -> typing.List[list]:
+        """
+        :return: Table rows of (listener, calls, mean ms, max ms, ms per message, errors).
+        """
+        rows = []
+        for name, (calls, total, max_time, errors) in sorted(self.listeners.items(), key=lambda i: -i[1][1]):
+            rows.append([name, calls, round(total / calls * 1000, 2), round(max_time * 1000, 2),
+                         round(total / max(self.messages, 1) * 1000, 2), errors])
+
+        return rows
+
+
+async def timed(stats: ListenerStats, name: str, coro: typing.Awaitable):
+    """
+    Awaits a listener, recording how long it took.
+    """
+    start = time.perf_counter()
+    errored = False
+    try:
+        return await coro
+    except Exception:
+        errored = True
+        raise
+    finally:
+        stats.record(name, time.perf_counter() - start, errored)
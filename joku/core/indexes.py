@@ -0,0 +1,97 @@
+"""
+ID-keyed lookup indexes for members and roles.
+
+discord.py only gives us lists to search through for these, which turns "find this member anywhere" into a scan
+over every member of every guild. The bot keeps these indexes up to date from gateway events instead.
+"""
+import typing
+
+import discord
+
+
+class LookupIndex(object):
+    """
+    Maintains member and role lookups keyed by ID.
+    """
+
+    def __init__(self):
+        #: User ID -> {guild ID: member}
+        self._members = {}  # type: typing.Dict[int, typing.Dict[int, discord.Member]]
+
+        #: Guild ID -> {role ID: role}
+        self._roles = {}  # type: typing.Dict[int, typing.Dict[int, discord.Role]]
+
+    def clear(self):
+        self._members.clear()
+        self._roles.clear()
+
+    # region Members
+    def add_member(self, member: discord.Member):
+        self._members.setdefault(member.id, {})[member.guild.id] = member
+
+    def remove_member(self, member: discord.Member):
+        guilds = self._members.get(member.id)
+        if guilds is None:
+            return
+
+        guilds.pop(member.guild.id, None)
+        if not guilds:
+            del self._members[member.id]
+
+    def get_member(self, user_id: int, guild_id: int = None) -> typing.Union[discord.Member, None]:
+        """
+        Gets a member by ID.
+
+        :param guild_id: The guild to get the member from. If this is None, any guild the user is in is used.
+        """
+        guilds = self._members.get(user_id)
+        if not guilds:
+            return None
+
+        if guild_id is not None:
+            return guilds.get(guild_id)
+
+        return next(iter(guilds.values()))
+
+    @property
+    def user_count(self) -> int:
+        """
+        :return: The number of unique users that can be seen.
+        """
+        return len(self._members)
+
+    # endregion
+
+    # region Roles
+    def add_role(self, role: discord.Role):
+        self._roles.setdefault(role.guild.id, {})[role.id] = role
+
+    def remove_role(self, role: discord.Role):
+        self._roles.get(role.guild.id, {}).pop(role.id, None)
+
+    def get_role(self, guild_id: int, role_id: int) -> typing.Union[discord.Role, None]:
+        return self._roles.get(guild_id, {}).get(role_id)
+
+    def get_roles(self, guild_id: int, role_ids: typing.Iterable[int]) -> typing.List[discord.Role]:
+        """
+        Gets the roles in a guild for each ID, skipping any that no longer exist.
+        """
+        roles = self._roles.get(guild_id, {})
+        return [roles[role_id] for role_id in role_ids if role_id in roles]
+
+    # endregion
+
+    # region Guilds
+    def add_guild(self, guild: discord.Guild):
+        for member in guild.members:
+            self.add_member(member)
+
+        self._roles[guild.id] = {role.id: role for role in guild.roles}
+
+    def remove_guild(self, guild: discord.Guild):
+        for member in guild.members:
+            self.remove_member(member)
+
+        self._roles.pop(guild.id, None)
+
+    # endregion
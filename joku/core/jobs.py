@@ -0,0 +1,236 @@
+"""
+Redis-backed leader election for periodic jobs.
+
+When running more than one bot process, each periodic job (the stock tick, the currency decay, etc) must only
+run on one of them. A node owns a job while it holds the job's lease in Redis; the lease is renewed in the
+background and a node that stops renewing loses the job to another node within a few seconds.
+
+Each time a lease changes hands the job's fencing token is incremented. Jobs are passed their token, and should
+check it with :meth:`JobCoordinator.check_fence` before doing any write that must not happen twice.
+
+Jobs that work on the guilds a process holds (the stock tick, reminders) can't run on a single node in cluster mode,
+as that node only holds some of the guilds. These are elected per shard range instead, with
+:meth:`JobCoordinator.get_shard_job_name`, so that every cluster runs them for its own guilds.
+"""
+import asyncio
+import os
+import platform
+import typing
+
+import aioredis
+import logbook
+
+#: How long a lease lasts without being renewed, in milliseconds.
+LEASE_MS = 6000
+
+#: How often the lease is renewed, or how often a standby node tries to take over.
+RENEW_INTERVAL = 2
+
+# Renews a lease, but only if we still own it.
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Releases a lease, but only if we still own it.
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class JobCoordinator(object):
+    """
+    Coordinates periodic jobs between every bot process.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.logger = logbook.Logger("Jokusoramame.Jobs")
+
+        #: The ID of this node.
+        self.node_id = "{}:{}".format(platform.node(), os.getpid())
+        if bot.cluster_id is not None:
+            self.node_id += ":{}".format(bot.cluster_id)
+
+        #: The jobs this process is running or waiting to run.
+        self._local = {}  # type: typing.Dict[str, asyncio.Task]
+
+    @staticmethod
+    def _lease_key(name: str) -> str:
+        return "jobs:lease:{}".format(name)
+
+    @staticmethod
+    def _fence_key(name: str) -> str:
+        return "jobs:fence:{}".format(name)
+
+    async def _try_acquire(self, name: str) -> typing.Union[int, None]:
+        """
+        Tries to acquire the lease for a job.
+
+        :return: The new fencing token if the lease was acquired, else None.
+        """
+        async with self.bot.redis.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            acquired = await redis.set(self._lease_key(name), self.node_id, pexpire=LEASE_MS,
+                                       exist=redis.SET_IF_NOT_EXIST)
+            if not acquired:
+                return None
+
+            return await redis.incr(self._fence_key(name))
+
+    async def _renew(self, name: str) -> bool:
+        async with self.bot.redis.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            renewed = await redis.eval(_RENEW_SCRIPT, keys=[self._lease_key(name)], args=[self.node_id, LEASE_MS])
+
+        return bool(renewed)
+
+    async def _release(self, name: str):
+        async with self.bot.redis.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            await redis.eval(_RELEASE_SCRIPT, keys=[self._lease_key(name)], args=[self.node_id])
+
+    async def check_fence(self, name: str, token: int) -> bool:
+        """
+        Checks if a fencing token is still the current one for a job.
+
+        If this returns False, another node has taken over the job and the caller should not write anything.
+        """
+        async with self.bot.redis.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            current = await redis.get(self._fence_key(name))
+
+        return current is not None and int(current) == token
+
+    async def claim(self, key: str, ttl: int) -> bool:
+        """
+        Claims a one-off action, such as firing a reminder.
+
+        Only the first node to claim a key within ``ttl`` seconds gets True.
+        """
+        async with self.bot.redis.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            claimed = await redis.set("jobs:claim:{}".format(key), self.node_id, expire=ttl,
+                                      exist=redis.SET_IF_NOT_EXIST)
+
+        return bool(claimed)
+
+    async def _lead(self, name: str, job: typing.Callable[[int], typing.Awaitable], token: int) -> bool:
+        """
+        Runs a job while we hold its lease.
+
+        :return: True if the job should be re-elected, i.e. the lease was lost rather than the job finishing.
+        :raises: Whatever the job crashed with.
+        """
+        self.logger.info("Acquired job `{}` with token {}.".format(name, token))
+        task = self.bot.tasks.spawn(job(token), name="job:{}:{}".format(name, token))
+
+        try:
+            while not task.done():
+                done, _ = await asyncio.wait([task], timeout=RENEW_INTERVAL)
+                if done:
+                    break
+
+                try:
+                    renewed = await self._renew(name)
+                except Exception:
+                    self.logger.exception("Failed to renew lease for job `{}`!".format(name))
+                    renewed = False
+
+                if not renewed:
+                    self.logger.warning("Lost the lease for job `{}`, stopping it.".format(name))
+                    task.cancel()
+                    return True
+
+            if task.cancelled():
+                return False
+
+            if task.exception() is not None:
+                # let the supervisor of whoever started the job restart it
+                raise task.exception()
+
+            # jobs bail out when their fencing token is stale, which means somebody else took over
+            return not await self.check_fence(name, token)
+        finally:
+            if not task.done():
+                task.cancel()
+            await self._release(name)
+
+    async def _elect(self, name: str, job: typing.Callable[[int], typing.Awaitable]):
+        while True:
+            try:
+                token = await self._try_acquire(name)
+            except Exception:
+                self.logger.exception("Failed to try and acquire job `{}`!".format(name))
+                token = None
+
+            if token is None:
+                await asyncio.sleep(RENEW_INTERVAL)
+                continue
+
+            if not await self._lead(name, job, token):
+                return
+
+            # give another node a chance first
+            await asyncio.sleep(RENEW_INTERVAL)
+
+    async def run_as_leader(self, name: str, job: typing.Callable[[int], typing.Awaitable]):
+        """
+        Runs a job on exactly one node.
+
+        This will wait for the job's lease, run ``job(token)`` while holding it, and go back to waiting if the
+        lease is lost. Calling this again for a job this process is already handling does nothing.
+
+        :param name: The name of the job.
+        :param job: A coroutine function taking the fencing token.
+        """
+        existing = self._local.get(name)
+        if existing is not None and not existing.done():
+            return
+
+        task = self.bot.tasks.spawn(self._elect(name, job), name="job:{}".format(name))
+        self._local[name] = task
+        try:
+            await task
+        finally:
+            if self._local.get(name) is task:
+                self._local.pop(name)
+
+    def get_shard_job_name(self, name: str) -> str:
+        """
+        Gets the name of a job that works on this process's guilds.
+
+        Processes holding the same shards share the job, and processes holding different shards each run their own.
+        """
+        shard_ids = getattr(self.bot, "shard_ids", None)
+        if not shard_ids:
+            # this process holds every guild
+            return name
+
+        return "{}:shards:{}-{}".format(name, min(shard_ids), max(shard_ids))
+
+    async def get_owners(self) -> typing.Dict[str, str]:
+        """
+        :return: A mapping of job name to the node that currently owns it.
+        """
+        owners = {}
+
+        async with self.bot.redis.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            async for key in redis.iscan(match="jobs:lease:*"):
+                owner = await redis.get(key)
+                if owner is not None:
+                    owners[key.decode()[len("jobs:lease:"):]] = owner.decode()
+
+        return owners
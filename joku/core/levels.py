@@ -0,0 +1,98 @@
+"""
+Level maths.
+
+The XP needed to reach level n + 1 is U(n) = a * n * (n + 1) / 2, where a is the levelling up constant. Levels are
+found by inverting this exactly with integer arithmetic, rather than solving the quadratic numerically, so that a
+user with exactly enough XP for a level always has it.
+
+The batch functions take NumPy arrays of XP, for computing the levels of a whole guild at once.
+"""
+import math
+
+import numpy as np
+
+#: The levelling up constant.
+INCREASING_FACTOR = 50
+
+
+def _isqrt(n: int) -> int:
+    """
+    The integer square root of n, exact for any size of n.
+    """
+    root = int(math.sqrt(n))
+    # the float square root can be off by one for huge numbers
+    while root * root > n:
+        root -= 1
+    while (root + 1) * (root + 1) <= n:
+        root += 1
+
+    return root
+
+
+def get_exp_for_level(level: int, a: int = INCREASING_FACTOR) -> int:
+    """
+    Gets the total XP needed to reach a level.
+
+    :param level: The level.
+    :param a: The levelling up constant.
+    """
+    return a * (level - 1) * level // 2
+
+
+def get_level_from_exp(xp: int, a: int = INCREASING_FACTOR) -> int:
+    """
+    Gets the level from the experience number.
+
+    U(n) = a* (n*(n+1)  / 2), a ∈ ℝ, a > 0
+    :param a: The levelling up constant.
+    :param xp: The XP this user currently has.
+    """
+    # The level is n + 1, for the largest n with a * n * (n + 1) / 2 <= xp.
+    # n * (n + 1) is an integer, so that is the largest n with n * (n + 1) <= m, where m = floor(2 * xp / a),
+    # which is the largest n with 2n + 1 <= isqrt(4m + 1).
+    m = max(int(2 * xp // a), 0)
+    return (_isqrt(4 * m + 1) - 1) // 2 + 1
+
+
+def get_next_exp_required(xp: int, a: int = INCREASING_FACTOR):
+    """
+    Gets the EXP required for the next level, based on the current EXP.
+
+    :param a: The levelling up constant.
+    :param xp: The XP this user currently has.
+    :return: The current level, and the amount of XP required for the next level.
+    """
+    current_level = get_level_from_exp(xp, a)
+    return current_level, get_exp_for_level(current_level + 1, a) - xp
+
+
+def get_levels_from_exp(xp: np.ndarray, a: int = INCREASING_FACTOR) -> np.ndarray:
+    """
+    Gets the level of every XP amount in an array.
+
+    :param xp: An array of XP amounts.
+    :param a: The levelling up constant.
+    :return: An int64 array of levels, the same shape as `xp`.
+    """
+    xp = np.asarray(xp, dtype=np.int64)
+
+    # estimate with the real root, then correct it against the exact thresholds
+    n = np.floor((np.sqrt(1 + 8 * np.maximum(xp, 0) / a) - 1) / 2).astype(np.int64)
+    n -= a * n * (n + 1) // 2 > xp
+    n += a * (n + 1) * (n + 2) // 2 <= xp
+
+    return np.maximum(n, 0) + 1
+
+
+def get_next_exp_required_batch(xp: np.ndarray, a: int = INCREASING_FACTOR):
+    """
+    Gets the level, and the XP required for the next level, of every XP amount in an array.
+
+    :param xp: An array of XP amounts.
+    :param a: The levelling up constant.
+    :return: Two int64 arrays: the current levels, and the XP required for the next level.
+    """
+    xp = np.asarray(xp, dtype=np.int64)
+    levels = get_levels_from_exp(xp, a)
+
+    return levels, a * levels * (levels + 1) // 2 - xp
@@ -0,0 +1,172 @@
+"""
+Asynchronous, sampled logging.
+
+Log records are handed to a background thread which formats and writes them, so a slow stderr can never stall
+the event loop. Records can be tagged with a category (``extra={"category": "..."}``); each category can be
+sampled down to a fraction of its records and rate limited. Anything dropped is counted in :class:`LogStats`.
+"""
+import collections
+import datetime
+import json
+import queue
+import random
+import sys
+import threading
+import time
+import typing
+
+import logbook
+
+
+class LogStats(object):
+    """
+    Counters for the logging pipeline.
+    """
+
+    def __init__(self):
+        self.written = 0
+
+        #: Reason -> category -> count
+        self.dropped = collections.defaultdict(collections.Counter)
+
+    def drop(self, reason: str, category: str):
+        self.dropped[reason][category or "default"] += 1
+
+    @property
+    def total_dropped(self) -> int:
+        return sum(sum(c.values()) for c in self.dropped.values())
+
+
+class Sampler(object):
+    """
+    Decides which records in each category are kept.
+    """
+
+    def __init__(self, sampling: typing.Dict[str, float] = None, rate_limits: typing.Dict[str, int] = None):
+        #: Category -> the fraction of records to keep.
+        self.sampling = sampling or {}
+
+        #: Category -> the maximum records per second.
+        self.rate_limits = rate_limits or {}
+
+        # Category -> [tokens, last refill]
+        self._buckets = {}
+        self._rng = random.Random()
+
+    def check(self, category: str) -> typing.Union[str, None]:
+        """
+        Checks if a record in this category should be kept.
+
+        :return: None if the record should be kept, otherwise the reason it was dropped.
+        """
+        rate = self.sampling.get(category)
+        if rate is not None and self._rng.random() >= rate:
+            return "sampled"
+
+        limit = self.rate_limits.get(category)
+        if limit is not None:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(category, (limit, now))
+            tokens = min(limit, tokens + (now - last) * limit)
+            if tokens < 1:
+                self._buckets[category] = (tokens, now)
+                return "rate_limited"
+
+            self._buckets[category] = (tokens - 1, now)
+
+        return None
+
+
+def json_formatter(record: logbook.LogRecord, handler: logbook.Handler) -> str:
+    """
+    Formats a record as a single line of JSON.
+    """
+    data = {
+        "time": record.time.replace(tzinfo=datetime.timezone.utc).isoformat(),
+        "level": record.level_name,
+        "channel": record.channel,
+        "message": record.message,
+        "thread": record.thread_name,
+    }
+    if record.extra:
+        data["extra"] = {k: str(v) for (k, v) in record.extra.items()}
+
+    if record.exc_info:
+        data["exception"] = record.formatted_exception
+
+    return json.dumps(data)
+
+
+class QueuedHandler(logbook.Handler):
+    """
+    A handler that passes records to a background thread, which writes them with another handler.
+    """
+
+    def __init__(self, handler: logbook.Handler, sampler: Sampler = None, queue_size: int = 10000,
+                 level=logbook.NOTSET, bubble=False):
+        super().__init__(level=level, bubble=bubble)
+
+        self.handler = handler
+        self.sampler = sampler or Sampler()
+        self.stats = LogStats()
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._writer, name="joku-log-writer", daemon=True)
+        self._thread.start()
+
+    def emit(self, record: logbook.LogRecord):
+        category = record.extra.get("category")
+
+        reason = self.sampler.check(category)
+        if reason is not None:
+            self.stats.drop(reason, category)
+            return
+
+        # The thread, process and calling frame are looked up lazily, and the frame is gone once this returns.
+        # So they must all be captured before crossing threads.
+        record.pull_information()
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.stats.drop("queue_full", category)
+
+    def _writer(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+
+            try:
+                self.handler.handle(record)
+                self.stats.written += 1
+            except Exception:
+                # nowhere else to put it, so at least count it
+                self.stats.drop("write_error", record.extra.get("category"))
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join(timeout=5)
+        super().close()
+
+
+def setup_logging(config: dict, target: logbook.Handler = None) -> QueuedHandler:
+    """
+    Sets up the logging pipeline from the `logging` section of the config.
+
+    :param target: The handler records are finally written with. Defaults to stderr.
+    :return: The pushed handler.
+    """
+    cfg = config.get("logging", {}) or {}
+
+    if target is None:
+        target = logbook.StreamHandler(sys.stderr)
+
+    if cfg.get("format", "text") == "json":
+        target.formatter = json_formatter
+
+    sampler = Sampler(sampling=cfg.get("sampling"), rate_limits=cfg.get("rate_limits"))
+    handler = QueuedHandler(target, sampler=sampler, queue_size=cfg.get("queue_size", 10000))
+    handler.push_application()
+
+    return handler
@@ -0,0 +1,337 @@
+"""
+Prometheus metrics.
+
+This is a small, dependency free implementation of the parts of the Prometheus text format the bot needs.
+Counters and histograms are updated in place as things happen; everything else is a gauge that is only read
+when the metrics are rendered, so rendering never has to walk any large collection.
+"""
+import bisect
+import typing
+import weakref
+
+#: The default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: typing.Sequence[str], values: typing.Sequence, extra: str = None) -> str:
+    pairs = ['{}="{}"'.format(name, _escape(value)) for (name, value) in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels: typing.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def render(self) -> typing.List[str]:
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> typing.List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up.
+    """
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}  # type: typing.Dict[tuple, float]
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def _render_samples(self):
+        return ["{}{} {}".format(self.name, _format_labels(self.labels, labels), _format_value(value))
+                for (labels, value) in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """
+    A distribution of observed values.
+    """
+    type = "histogram"
+
+    def __init__(self, *args, buckets: typing.Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+
+        #: Labels -> [count per bucket (+ one for +Inf), sum]
+        self._values = {}  # type: typing.Dict[tuple, list]
+
+    def observe(self, value: float, *labels):
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+
+    def _render_samples(self):
+        lines = []
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="{}"'.format(_format_value(bound))
+                lines.append("{}_bucket{} {}".format(self.name, _format_labels(self.labels, labels, le),
+                                                     cumulative))
+
+            lines.append("{}_sum{} {}".format(self.name, _format_labels(self.labels, labels), repr(total)))
+            lines.append("{}_count{} {}".format(self.name, _format_labels(self.labels, labels), cumulative))
+
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    A value that is read when the metrics are rendered.
+
+    The callback returns either a single value, or a mapping of label values to values.
+    """
+    type = "gauge"
+
+    def __init__(self, *args, callback: typing.Callable[[], typing.Any], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.callback = callback
+
+    def _render_samples(self):
+        value = self.callback()
+        if not isinstance(value, dict):
+            value = {(): value}
+
+        lines = []
+        for labels, v in sorted(value.items()):
+            if not isinstance(labels, tuple):
+                labels = (labels,)
+            lines.append("{}{} {}".format(self.name, _format_labels(self.labels, labels), _format_value(v)))
+
+        return lines
+
+
+class _CallbackCounter(Gauge):
+    """
+    A counter that is kept by something else, and read when the metrics are rendered.
+    """
+    type = "counter"
+
+
+class _ExternalHistogram(_Metric):
+    """
+    A histogram whose buckets are kept by something else, such as the loop watchdog.
+    """
+    type = "histogram"
+
+    def __init__(self, *args, buckets: typing.Sequence[float], callback: typing.Callable[[], tuple], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self.callback = callback
+
+    def _render_samples(self):
+        counts, total = self.callback()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, _format_value(bound), cumulative))
+
+        lines.append("{}_sum {}".format(self.name, repr(float(total))))
+        lines.append("{}_count {}".format(self.name, cumulative))
+        return lines
+
+
+class Metrics(object):
+    """
+    The bot's metrics registry.
+    """
+
+    def __init__(self):
+        self._metrics = []  # type: typing.List[_Metric]
+
+        #: Name -> executor, for queue depth and utilization gauges.
+        self._executors = weakref.WeakValueDictionary()
+
+        self.gateway_events = self.counter("joku_gateway_events_total", "Gateway events dispatched.", ["event"])
+        self.commands = self.counter("joku_commands_total", "Commands invoked.", ["command", "status"])
+        self.command_latency = self.histogram("joku_command_seconds", "Command latency.", ["command"])
+        self.db_latency = self.histogram("joku_db_session_seconds", "Time spent inside database sessions.")
+        self.db_errors = self.counter("joku_db_errors_total", "Database sessions that were rolled back.")
+        self.redis_latency = self.histogram("joku_redis_seconds", "Time spent holding a Redis connection.")
+        self.cache_requests = self.counter("joku_cache_requests_total", "Cache lookups.", ["cache", "result"])
+
+    # region Registration
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: typing.Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: typing.Sequence[str] = (),
+                  buckets: typing.Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets=buckets))
+
+    def gauge(self, name: str, documentation: str, callback: typing.Callable[[], typing.Any],
+              labels: typing.Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, callback=callback))
+
+    def callback_counter(self, name: str, documentation: str, callback: typing.Callable[[], typing.Any],
+                         labels: typing.Sequence[str] = ()) -> _CallbackCounter:
+        return self.register(_CallbackCounter(name, documentation, labels, callback=callback))
+
+    def external_histogram(self, name: str, documentation: str, buckets: typing.Sequence[float],
+                           callback: typing.Callable[[], tuple]):
+        return self.register(_ExternalHistogram(name, documentation, buckets=buckets, callback=callback))
+
+    def register_executor(self, name: str, executor):
+        """
+        Registers an executor, so that its queue depth and utilization are exported.
+
+        Only a weak reference is kept, so executors that are shut down and dropped disappear on their own.
+        """
+        self._executors[name] = executor
+
+    # endregion
+
+    def cache(self, name: str, hit: bool):
+        """
+        Records a cache lookup.
+        """
+        self.cache_requests.inc(name, "hit" if hit else "miss")
+
+    def get_executor_stats(self) -> typing.Dict[str, typing.Tuple[int, int, int]]:
+        """
+        :return: Executor name -> (queued work items, busy workers, max workers).
+        """
+        stats = {}
+        for name, executor in list(self._executors.items()):
+            # both executors keep these private, but they are the only way to see into them
+            max_workers = getattr(executor, "_max_workers", 0)
+            if hasattr(executor, "get_capacity"):
+                # our process pools know exactly which workers are busy
+                capacity = executor.get_capacity()
+                queued, busy = capacity["queued"], capacity["busy"]
+            elif hasattr(executor, "_pending_work_items"):
+                # process pool: everything submitted and not yet finished
+                pending = len(executor._pending_work_items)
+                busy = min(pending, max_workers)
+                queued = pending - busy
+            else:
+                queued = executor._work_queue.qsize() if hasattr(executor, "_work_queue") else 0
+                idle = getattr(executor, "_idle_semaphore", None)
+                threads = len(getattr(executor, "_threads", ()))
+                busy = threads - idle._value if idle is not None else threads
+
+            stats[name] = (queued, busy, max_workers)
+
+        return stats
+
+    def get_recycled_workers(self) -> typing.Dict[typing.Tuple[str, str], int]:
+        """
+        :return: (executor name, reason) -> process pool workers replaced for that reason.
+        """
+        recycled = {}
+        for name, executor in list(self._executors.items()):
+            if not hasattr(executor, "get_capacity"):
+                continue
+
+            capacity = executor.get_capacity()
+            recycled[(name, "deadline")] = capacity["killed"]
+            recycled[(name, "crash")] = capacity["crashed"]
+
+        return recycled
+
+    def get_live_workers(self) -> typing.Dict[str, int]:
+        """
+        :return: Executor name -> process pool workers currently alive.
+        """
+        return {name: executor.get_capacity()["workers"] for (name, executor) in list(self._executors.items())
+                if hasattr(executor, "get_capacity")}
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+def setup_bot_metrics(bot) -> Metrics:
+    """
+    Creates the metrics registry for a bot, with gauges reading its state.
+
+    Every gauge here is O(1) or O(guilds) at worst; nothing here may iterate members.
+    """
+    from joku.core.watchdog import LAG_BUCKETS
+
+    metrics = Metrics()
+
+    metrics.gauge("joku_guilds", "Guilds this process can see.", lambda: len(bot.guilds))
+    metrics.gauge("joku_users", "Unique users this process can see.", lambda: bot.indexes.user_count)
+    metrics.gauge("joku_gateway_latency_seconds", "Heartbeat latency of each shard.",
+                  lambda: {shard_id: latency for (shard_id, latency) in bot.latencies}, labels=["shard"])
+
+    def _executors(index: int):
+        return lambda: {name: stats[index] for (name, stats) in metrics.get_executor_stats().items()}
+
+    metrics.gauge("joku_executor_queued", "Work items waiting for a worker.", _executors(0), labels=["executor"])
+    metrics.gauge("joku_executor_busy", "Workers currently running a work item.", _executors(1),
+                  labels=["executor"])
+    metrics.gauge("joku_executor_workers", "The maximum number of workers.", _executors(2), labels=["executor"])
+    metrics.gauge("joku_executor_live_workers", "Process pool workers currently alive.", metrics.get_live_workers,
+                  labels=["executor"])
+    metrics.callback_counter("joku_executor_recycled_workers_total",
+                             "Process pool workers killed for passing a deadline, or replaced after crashing.",
+                             metrics.get_recycled_workers, labels=["executor", "reason"])
+
+    metrics.gauge("joku_loop_lag_seconds", "The most recent event loop lag.", lambda: bot.watchdog.lag)
+    metrics.callback_counter("joku_loop_stalls_total", "Event loop stalls over the watchdog threshold.",
+                             lambda: bot.watchdog.stalls)
+    metrics.external_histogram("joku_loop_lag_distribution_seconds", "Event loop lag.", LAG_BUCKETS,
+                               lambda: (bot.watchdog.histogram, bot.watchdog.total_lag))
+
+    metrics.gauge("joku_tasks", "Supervised background tasks.",
+                  lambda: {(owner, state): count for (owner, states) in bot.tasks.get_counts().items()
+                           for (state, count) in states.items()}, labels=["owner", "state"])
+
+    metrics.callback_counter("joku_tag_index_lookups_total", "Unknown commands checked against the tag name index.",
+                             lambda: {"hit": bot.database.tag_names.hits,
+                                      "rejected": bot.database.tag_names.rejections},
+                             labels=["result"])
+
+    def _memory():
+        import psutil
+        info = psutil.Process().memory_info()
+        return {"rss": info.rss, "vms": info.vms}
+
+    metrics.gauge("joku_memory_bytes", "Process memory usage.", _memory, labels=["type"])
+
+    return metrics
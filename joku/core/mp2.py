@@ -37,18 +37,25 @@ Local worker thread:
   _CallItem and put in the "Call Q". New _CallItems are put in the "Call Q"
   until "Call Q" is full. NOTE: the size of the "Call Q" is kept small because
   calls placed in the "Call Q" can no longer be cancelled with Future.cancel().
+  When more work is waiting than the "Call Q" can hold, named task calls are
+  packed into batches, so that a single message carries many calls.
 - reads _ResultItems from "Result Q", updates the future stored in the
   "Work Items" dict and deletes the dict entry
 
 Process #1..n:
 - reads _CallItems from "Call Q", executes the calls, and puts the resulting
-  _ResultItems in "Result Q"
+  _ResultItems in "Result Q". The results of a batch are put as one list.
 """
 
 __author__ = 'Brian Quinlan (brian@sweetapp.com)'
 
 import atexit
+import importlib
+import io
 import os
+import pickle
+import signal
+import time
 from concurrent.futures import _base
 import queue
 from queue import Full
@@ -93,9 +100,90 @@ def _python_exit():
 # Controls how many more calls than processes will be queued in the call queue.
 # A smaller number will mean that processes spend more time idle waiting for
 # work while a larger number will make Future.cancel() succeed less frequently
-# (Futures in the call queue cannot be cancelled).
+# (Futures in the call queue cannot be cancelled). This is the default of the
+# executor's queue_depth.
 EXTRA_QUEUED_CALLS = 1
 
+# The default maximum number of named task calls sent to a worker in one
+# message. Calls are only batched when more are waiting than there are
+# workers, so a lightly loaded pool still spreads calls over every worker.
+DEFAULT_BATCH_SIZE = 16
+
+# How often the queue management thread checks for work items past their
+# deadline, in seconds.
+DEADLINE_POLL_INTERVAL = 0.1
+
+# How long a worker killed for passing its deadline has to exit before it is
+# sent SIGKILL, in seconds.
+KILL_GRACE = 1.0
+
+# The default maximum size of an encoded task result, in bytes.
+DEFAULT_MAX_RESULT_BYTES = 1024 * 1024
+
+# Registered task functions, by name. Tasks are registered at import time, so
+# forked workers usually inherit the same registry; workers started before a
+# task's module was imported import it on first use.
+_tasks = {}
+
+# The only classes plain task data may contain, besides the builtin types.
+_PLAIN_CLASSES = {
+    ("datetime", "datetime"),
+    ("datetime", "date"),
+    ("datetime", "time"),
+    ("datetime", "timedelta"),
+    ("datetime", "timezone"),
+    # NumPy arrays, scalars and their dtypes. These only rebuild numbers from
+    # raw buffers; object arrays still go through this allowlist for their
+    # elements. NumPy 2 moved numpy.core to numpy._core.
+    ("numpy", "ndarray"),
+    ("numpy", "dtype"),
+    ("numpy.core.multiarray", "_reconstruct"),
+    ("numpy.core.multiarray", "scalar"),
+    ("numpy.core.numeric", "_frombuffer"),
+    ("numpy._core.multiarray", "_reconstruct"),
+    ("numpy._core.multiarray", "scalar"),
+    ("numpy._core.numeric", "_frombuffer"),
+}
+
+def register_task(name):
+    """Registers a task function under a name, for ProcessPoolExecutor.submit_task.
+
+    The function must be importable at module level, and take and return
+    plain data: None, bools, numbers, strings, bytes, lists, tuples, dicts,
+    datetimes and NumPy arrays.
+    """
+    def decorator(fn):
+        existing = _tasks.get(name)
+        if existing is not None and existing is not fn:
+            raise ValueError("A task is already registered as {!r}".format(name))
+        _tasks[name] = fn
+        return fn
+    return decorator
+
+class ResultTooLarge(Exception):
+    """
+    Raised when the result of a task is larger than the executor allows.
+    """
+
+class _PlainUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) not in _PLAIN_CLASSES:
+            raise pickle.UnpicklingError(
+                "{}.{} is not plain data".format(module, name))
+        return super().find_class(module, name)
+
+def encode_plain(obj):
+    """Encodes plain task data.
+
+    This uses the C pickler rather than dill, which is much faster for the
+    small, simple payloads tasks use.
+    """
+    return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+def decode_plain(data):
+    """Decodes plain task data, refusing anything that isn't plain data."""
+    return _PlainUnpickler(io.BytesIO(data)).load()
+
 # Hack to embed stringification of remote traceback in local traceback
 
 class _RemoteTraceback(Exception):
@@ -118,11 +206,22 @@ def _rebuild_exc(exc, tb):
     return exc
 
 class _WorkItem(object):
-    def __init__(self, future, fn, args, kwargs):
+    def __init__(self, future, fn, args, kwargs, task=None, deadline=None,
+                 priority=0):
         self.future = future
         self.fn = fn
         self.args = args
         self.kwargs = kwargs
+        # For named tasks: the task name and module, with the arguments
+        # already encoded in args.
+        self.task = task
+        # How long the call may run for, in seconds, before its worker is
+        # killed and replaced.
+        self.deadline = deadline
+        self.priority = priority
+        # The work ids of every call sent to a worker in the same batch as
+        # this one, if it was batched.
+        self.batch = None
 
 class _ResultItem(object):
     def __init__(self, work_id, exception=None, result=None):
@@ -157,77 +256,249 @@ def _process_chunk(fn, chunk):
     """
     return [fn(*args) for args in chunk]
 
-def _process_worker(call_queue, result_queue):
+def _run_task(call_item, max_result_bytes):
+    """Runs a named task from a compact call item.
+
+    Args:
+        call_item: A (work id, task name, task module, encoded (args, kwargs))
+            tuple.
+        max_result_bytes: The maximum size of the encoded result.
+
+    Returns:
+        The encoded result.
+    """
+    _, name, module, payload = call_item
+    fn = _tasks.get(name)
+    if fn is None:
+        importlib.import_module(module)
+        fn = _tasks.get(name)
+    if fn is None:
+        raise LookupError("No task is registered as {!r}".format(name))
+    args, kwargs = decode_plain(payload)
+    result = encode_plain(fn(*args, **kwargs))
+    if len(result) > max_result_bytes:
+        raise ResultTooLarge("The result of {!r} is {} bytes, over the "
+                             "limit of {}".format(name, len(result),
+                                                  max_result_bytes))
+    return result
+
+def _run_call(call_item, max_result_bytes, slots, slot):
+    """Runs a _CallItem or a named task call item.
+
+    Returns:
+        The _ResultItem of the call.
+    """
+    # named tasks are sent as plain tuples, rather than _CallItems
+    work_id = (call_item[0] if isinstance(call_item, tuple)
+               else call_item.work_id)
+    if slots is not None:
+        slots[slot * 2 + 1] = time.monotonic()
+        slots[slot * 2] = work_id
+    try:
+        if isinstance(call_item, tuple):
+            r = _run_task(call_item, max_result_bytes)
+        else:
+            r = call_item.fn(*call_item.args, **call_item.kwargs)
+    except BaseException as e:
+        exc = _ExceptionWithTraceback(e, e.__traceback__)
+        return _ResultItem(work_id, exception=exc)
+    else:
+        return _ResultItem(work_id, result=r)
+
+def _process_worker(call_queue, result_queue, initializer=None, initargs=(),
+                    max_result_bytes=DEFAULT_MAX_RESULT_BYTES, slots=None,
+                    slot=0):
     """Evaluates calls from call_queue and places the results in result_queue.
 
     This worker is run in a separate process.
 
     Args:
         call_queue: A multiprocessing.Queue of _CallItems that will be read and
-            evaluated by the worker.
+            evaluated by the worker. Batches of named task calls arrive as a
+            list, and their _ResultItems are sent back as one list.
         result_queue: A multiprocessing.Queue of _ResultItems that will written
             to by the worker.
-        shutdown: A multiprocessing.Event that will be set as a signal to the
-            worker that it should exit when call_queue is empty.
+        initializer: A callable ran once when the worker starts, before any
+            calls are evaluated.
+        initargs: The arguments passed to the initializer.
+        max_result_bytes: The maximum size of the encoded result of a named
+            task.
+        slots: A shared array of (work id, start time) pairs, one per worker,
+            that the worker records the call it is running in. The work id is
+            -1 while idle.
+        slot: The index of this worker's pair in slots.
     """
+    if initializer is not None:
+        try:
+            initializer(*initargs)
+        except BaseException:
+            # a worker that failed to warm up can still serve calls, it'll just be slower
+            traceback.print_exc()
+
     while True:
         call_item = call_queue.get(block=True)
         if call_item is None:
             # Wake up queue management thread
             result_queue.put(os.getpid())
             return
-        try:
-            r = call_item.fn(*call_item.args, **call_item.kwargs)
-        except BaseException as e:
-            exc = _ExceptionWithTraceback(e, e.__traceback__)
-            result_queue.put(_ResultItem(call_item.work_id, exception=exc))
+        if isinstance(call_item, list):
+            # the worker stays busy between the calls of a batch
+            result = [_run_call(c, max_result_bytes, slots, slot)
+                      for c in call_item]
         else:
-            result_queue.put(_ResultItem(call_item.work_id,
-                                         result=r))
+            result = _run_call(call_item, max_result_bytes, slots, slot)
+        if slots is not None:
+            slots[slot * 2] = -1
+        result_queue.put(result)
 
 def _add_call_item_to_queue(pending_work_items,
                             work_ids,
-                            call_queue):
+                            call_queue,
+                            batch_size=1,
+                            queue_size=1):
     """Fills call_queue with _WorkItems from pending_work_items.
 
-    This function never blocks.
+    This function never blocks. When more work is waiting than call_queue can
+    hold, consecutive named task calls are sent in batches, so that one
+    message carries many small calls. Batches are sized so that most of the
+    waiting work stays here, where it can still be cancelled.
 
     Args:
         pending_work_items: A dict mapping work ids to _WorkItems e.g.
             {5: <_WorkItem...>, 6: <_WorkItem...>, ...}
-        work_ids: A queue.Queue of work ids e.g. Queue([5, 6, ...]). Work ids
+        work_ids: A queue.PriorityQueue of (priority, work id) pairs e.g.
+            PriorityQueue([(0, 6), (1, 5), ...]). Work ids
             are consumed and the corresponding _WorkItems from
             pending_work_items are transformed into _CallItems and put in
             call_queue.
         call_queue: A multiprocessing.Queue that will be filled with _CallItems
             derived from _WorkItems.
+        batch_size: The maximum number of named task calls in one batch.
+        queue_size: The number of messages call_queue can hold.
     """
     while True:
         if call_queue.full():
             return
-        try:
-            work_id = work_ids.get(block=False)
-        except queue.Empty:
-            return
-        else:
+        limit = min(batch_size, max(1, work_ids.qsize() // queue_size))
+        batch = []
+        while len(batch) < limit:
+            try:
+                priority, work_id = work_ids.get(block=False)
+            except queue.Empty:
+                break
             work_item = pending_work_items[work_id]
 
-            if work_item.future.set_running_or_notify_cancel():
+            # calls requeued from a killed batch are already running
+            if not (work_item.future.running()
+                    or work_item.future.set_running_or_notify_cancel()):
+                del pending_work_items[work_id]
+                continue
+
+            if work_item.task is not None:
+                name, module = work_item.task
+                batch.append((work_id, name, module, work_item.args))
+            elif batch:
+                # dill calls are never batched, so send it after this batch
+                work_ids.put((priority, work_id))
+                break
+            else:
                 call_queue.put(_CallItem(work_id,
                                          work_item.fn,
                                          work_item.args,
-                                         work_item.kwargs),
-                               block=True)
-            else:
-                del pending_work_items[work_id]
-                continue
+                                         work_item.kwargs), block=True)
+                break
+
+        if not batch:
+            if work_ids.empty():
+                return
+            continue
+        if len(batch) == 1:
+            call_queue.put(batch[0], block=True)
+        else:
+            ids = tuple(call[0] for call in batch)
+            for work_id in ids:
+                pending_work_items[work_id].batch = ids
+            call_queue.put(batch, block=True)
+
+def _requeue_batch(pending_work_items, work_ids, work_item, work_id):
+    """Requeues the other calls of a batch whose worker died.
+
+    Results are sent once the whole batch has run, so every other call of the
+    batch is run again, including those that had already finished.
+    """
+    for other_id in work_item.batch or ():
+        other = pending_work_items.get(other_id)
+        if other_id != work_id and other is not None:
+            other.batch = None
+            work_ids.put((other.priority, other_id))
+
+def _kill_process(p):
+    """Terminates a worker process, escalating to SIGKILL if it ignores it."""
+    p.terminate()
+    p.join(KILL_GRACE)
+    if p.is_alive():
+        os.kill(p.pid, signal.SIGKILL)
+        p.join()
+
+def _get_running_item(slots, slot):
+    """Reads the work id and start time of the call a worker is running.
+
+    Returns:
+        (work id, start time), or None if the worker is idle.
+    """
+    work_id = slots[slot * 2]
+    started = slots[slot * 2 + 1]
+    if work_id < 0 or slots[slot * 2] != work_id:
+        # idle, or it moved on to another call while this was reading
+        return None
+    return int(work_id), started
+
+def _recycle_worker(executor_reference, processes, process_slots, pid):
+    """Removes a dead worker, and starts a replacement in its slot."""
+    processes.pop(pid, None)
+    slot = process_slots.pop(pid, None)
+    executor = executor_reference()
+    if executor is not None and slot is not None \
+            and not executor._shutdown_thread:
+        executor._start_worker(slot)
+
+def _check_deadlines(executor_reference, processes, process_slots, slots,
+                     pending_work_items, work_ids, recycled):
+    """Kills and replaces the workers running calls past their deadline."""
+    now = time.monotonic()
+    for pid, slot in list(process_slots.items()):
+        running = _get_running_item(slots, slot)
+        if running is None:
+            continue
+        work_id, started = running
+        work_item = pending_work_items.get(work_id)
+        if work_item is None or work_item.deadline is None \
+                or now - started < work_item.deadline:
+            continue
+
+        p = processes.get(pid)
+        if p is not None:
+            _kill_process(p)
+        recycled["deadline"] += 1
+        _recycle_worker(executor_reference, processes, process_slots, pid)
+
+        del pending_work_items[work_id]
+        _requeue_batch(pending_work_items, work_ids, work_item, work_id)
+        work_item.future.set_exception(DeadlineExceeded(
+            "The call ran for longer than its deadline of {}s, so its "
+            "worker was killed".format(work_item.deadline)))
+        del work_item
 
 def _queue_management_worker(executor_reference,
                              processes,
                              pending_work_items,
                              work_ids_queue,
                              call_queue,
-                             result_queue):
+                             result_queue,
+                             process_slots=None,
+                             slots=None,
+                             recycled=None,
+                             batch_size=1):
     """Manages the communication between this process and the worker processes.
 
     This function is run in a local thread.
@@ -245,6 +516,12 @@ def _queue_management_worker(executor_reference,
             derived from _WorkItems for processing by the process workers.
         result_queue: A multiprocessing.Queue of _ResultItems generated by the
             process workers.
+        process_slots: A dict mapping the pid of each worker to its slot.
+        slots: The shared array the workers record their running calls in.
+        recycled: A dict counting workers replaced after passing a deadline
+            ("deadline") or dying while running a call ("crash").
+        batch_size: The maximum number of named task calls sent to a worker
+            in one message.
     """
     executor = None
 
@@ -263,18 +540,52 @@ def _queue_management_worker(executor_reference,
         for p in processes.values():
             p.join()
 
+    def set_result(result_item):
+        work_item = pending_work_items.pop(result_item.work_id, None)
+        # work_item can be None if another process terminated (see above)
+        if work_item is None:
+            return
+        if result_item.exception:
+            work_item.future.set_exception(result_item.exception)
+        elif work_item.task is not None:
+            try:
+                result = decode_plain(result_item.result)
+            except Exception as e:
+                work_item.future.set_exception(e)
+            else:
+                work_item.future.set_result(result)
+        else:
+            work_item.future.set_result(result_item.result)
+
     reader = result_queue._reader
 
     while True:
         _add_call_item_to_queue(pending_work_items,
                                 work_ids_queue,
-                                call_queue)
+                                call_queue,
+                                batch_size,
+                                call_queue._maxsize)
 
-        sentinels = [p.sentinel for p in processes.values()]
+        sentinels = {p.sentinel: pid for (pid, p) in processes.items()}
         assert sentinels
-        ready = wait([reader] + sentinels)
+        timeout = None
+        if slots is not None and any(w.deadline is not None
+                                     for w in pending_work_items.values()):
+            timeout = DEADLINE_POLL_INTERVAL
+        ready = wait([reader] + list(sentinels), timeout)
+        if slots is not None:
+            _check_deadlines(executor_reference, processes, process_slots,
+                             slots, pending_work_items, work_ids_queue,
+                             recycled)
+        if not ready:
+            continue
         if reader in ready:
             result_item = reader.recv()
+        elif _recover_crashed(executor_reference, processes, process_slots,
+                              slots, pending_work_items, work_ids_queue,
+                              recycled,
+                              [sentinels[r] for r in ready if r in sentinels]):
+            continue
         else:
             # Mark the process pool broken so that submits fail right now.
             executor = executor_reference()
@@ -308,16 +619,11 @@ def _queue_management_worker(executor_reference,
             if not processes:
                 shutdown_worker()
                 return
+        elif isinstance(result_item, list):
+            for item in result_item:
+                set_result(item)
         elif result_item is not None:
-            work_item = pending_work_items.pop(result_item.work_id, None)
-            # work_item can be None if another process terminated (see above)
-            if work_item is not None:
-                if result_item.exception:
-                    work_item.future.set_exception(result_item.exception)
-                else:
-                    work_item.future.set_result(result_item.result)
-                # Delete references to object. See issue16284
-                del work_item
+            set_result(result_item)
         # Check whether we should start shutting down.
         executor = executor_reference()
         # No more work items can be added if:
@@ -337,6 +643,42 @@ def _queue_management_worker(executor_reference,
                 pass
         executor = None
 
+def _recover_crashed(executor_reference, processes, process_slots, slots,
+                     pending_work_items, work_ids, recycled, dead):
+    """Replaces workers that died while running a call.
+
+    Only the calls they were running fail. A worker that died while idle
+    may have been holding the call queue's lock, so that still breaks the
+    pool.
+
+    Returns:
+        If every dead worker was replaced.
+    """
+    if slots is None or not dead:
+        return False
+    running = {}
+    for pid in dead:
+        if pid not in processes:
+            # already killed for passing its deadline
+            continue
+        item = _get_running_item(slots, process_slots.get(pid, 0))
+        if item is None:
+            return False
+        running[pid] = item[0]
+
+    for pid, work_id in running.items():
+        processes[pid].join()
+        recycled["crash"] += 1
+        _recycle_worker(executor_reference, processes, process_slots, pid)
+        work_item = pending_work_items.pop(work_id, None)
+        if work_item is not None:
+            _requeue_batch(pending_work_items, work_ids, work_item, work_id)
+            work_item.future.set_exception(BrokenProcessPool(
+                "A worker process terminated abruptly while running this "
+                "call. It has been replaced."))
+            del work_item
+    return True
+
 _system_limits_checked = False
 _system_limited = None
 def _check_system_limits():
@@ -369,14 +711,33 @@ class BrokenProcessPool(RuntimeError):
     """
 
 
+class DeadlineExceeded(_base.TimeoutError):
+    """
+    Raised when a call ran past its deadline, and its worker was killed.
+    """
+
+
 class ProcessPoolExecutor(_base.Executor):
-    def __init__(self, max_workers=None):
+    def __init__(self, max_workers=None, initializer=None, initargs=(),
+                 max_result_bytes=DEFAULT_MAX_RESULT_BYTES, deadline=None,
+                 queue_depth=EXTRA_QUEUED_CALLS, batch_size=DEFAULT_BATCH_SIZE):
         """Initializes a new ProcessPoolExecutor instance.
 
         Args:
             max_workers: The maximum number of processes that can be used to
                 execute the given calls. If None or not given then as many
                 worker processes will be created as the machine has processors.
+            initializer: A callable ran in each worker process when it starts.
+            initargs: The arguments passed to the initializer.
+            max_result_bytes: The maximum size of the encoded result of a
+                named task. Larger results raise ResultTooLarge.
+            deadline: The default number of seconds a call may run for. A
+                worker still running a call past its deadline is killed and
+                replaced, and the call fails with DeadlineExceeded.
+            queue_depth: How many more messages than workers are sent ahead
+                to the workers. Calls sent ahead can no longer be cancelled.
+            batch_size: The maximum number of named task calls sent to a
+                worker in one message.
         """
         _check_system_limits()
 
@@ -388,17 +749,23 @@ class ProcessPoolExecutor(_base.Executor):
 
             self._max_workers = max_workers
 
+        if queue_depth < 0:
+            raise ValueError("queue_depth must not be negative")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
         # Make the call queue slightly larger than the number of processes to
         # prevent the worker processes from idling. But don't make it too big
         # because futures in the call queue cannot be cancelled.
         self._call_queue = multiprocessing.Queue(self._max_workers +
-                                                 EXTRA_QUEUED_CALLS)
+                                                 queue_depth)
         # Killed worker processes can produce spurious "broken pipe"
         # tracebacks in the queue's own worker thread. But we detect killed
         # processes anyway, so silence the tracebacks.
         self._call_queue._ignore_epipe = True
         self._result_queue = SimpleQueue()
-        self._work_ids = queue.Queue()
+        # Lower priorities run first, and equal priorities in submission order.
+        self._work_ids = queue.PriorityQueue()
         self._queue_management_thread = None
         # Map of pids to processes
         self._processes = {}
@@ -410,6 +777,18 @@ class ProcessPoolExecutor(_base.Executor):
         self._queue_count = 0
         self._pending_work_items = {}
 
+        self._initializer = initializer
+        self._initargs = initargs
+        self._max_result_bytes = max_result_bytes
+        self._deadline = deadline
+        self._batch_size = batch_size
+
+        # What each worker is running, as (work id, start time) pairs.
+        self._slots = multiprocessing.RawArray('d', [-1.0] * (self._max_workers * 2))
+        # Map of pids to slots
+        self._process_slots = {}
+        self._recycled = {"deadline": 0, "crash": 0}
+
     def _start_queue_management_thread(self):
         # When the executor gets lost, the weakref callback will wake up
         # the queue management thread.
@@ -425,21 +804,41 @@ class ProcessPoolExecutor(_base.Executor):
                           self._pending_work_items,
                           self._work_ids,
                           self._call_queue,
-                          self._result_queue))
+                          self._result_queue,
+                          self._process_slots,
+                          self._slots,
+                          self._recycled,
+                          self._batch_size))
             self._queue_management_thread.daemon = True
             self._queue_management_thread.start()
             _threads_queues[self._queue_management_thread] = self._result_queue
 
     def _adjust_process_count(self):
-        for _ in range(len(self._processes), self._max_workers):
-            p = multiprocessing.Process(
-                    target=_process_worker,
-                    args=(self._call_queue,
-                          self._result_queue))
-            p.start()
-            self._processes[p.pid] = p
-
-    def submit(self, fn, *args, **kwargs):
+        used = set(self._process_slots.values())
+        for slot in range(self._max_workers):
+            if slot not in used:
+                self._start_worker(slot)
+
+    def _start_worker(self, slot):
+        self._slots[slot * 2] = -1
+        p = multiprocessing.Process(
+                target=_process_worker,
+                args=(self._call_queue,
+                      self._result_queue,
+                      self._initializer,
+                      self._initargs,
+                      self._max_result_bytes,
+                      self._slots,
+                      slot))
+        p.start()
+        self._processes[p.pid] = p
+        self._process_slots[p.pid] = slot
+
+    def _submit(self, fn, args, kwargs, task=None, deadline=None, priority=0):
+        return self._submit_all([(fn, args, kwargs)], task, deadline,
+                                priority)[0]
+
+    def _submit_all(self, calls, task=None, deadline=None, priority=0):
         with self._shutdown_lock:
             if self._broken:
                 raise BrokenProcessPool('A child process terminated '
@@ -447,19 +846,126 @@ class ProcessPoolExecutor(_base.Executor):
             if self._shutdown_thread:
                 raise RuntimeError('cannot schedule new futures after shutdown')
 
-            f = _base.Future()
-            w = _WorkItem(f, fn, args, kwargs)
-
-            self._pending_work_items[self._queue_count] = w
-            self._work_ids.put(self._queue_count)
-            self._queue_count += 1
-            # Wake up queue management thread
+            if deadline is None:
+                deadline = self._deadline
+            futures = []
+            for fn, args, kwargs in calls:
+                f = _base.Future()
+                w = _WorkItem(f, fn, args, kwargs, task, deadline, priority)
+
+                self._pending_work_items[self._queue_count] = w
+                self._work_ids.put((priority, self._queue_count))
+                self._queue_count += 1
+                futures.append(f)
+            # Wake up queue management thread, once for all the calls
             self._result_queue.put(None)
 
             self._start_queue_management_thread()
-            return f
+            return futures
+
+    def submit(self, fn, *args, **kwargs):
+        return self._submit(fn, args, kwargs)
     submit.__doc__ = _base.Executor.submit.__doc__
 
+    def submit_call(self, fn, args=(), kwargs=None, *, deadline=None,
+                    priority=0):
+        """Submits a call like submit(), with a deadline and a priority.
+
+        Args:
+            fn: The callable, which is serialized with dill.
+            args: The positional arguments.
+            kwargs: The keyword arguments.
+            deadline: Overrides the executor's deadline for this call.
+            priority: Calls with lower priorities are started first.
+
+        Returns:
+            A Future of the call's result.
+        """
+        return self._submit(fn, tuple(args), kwargs or {}, deadline=deadline,
+                            priority=priority)
+
+    def submit_task(self, name, *args, deadline=None, priority=0, **kwargs):
+        """Submits a registered task, referenced by name.
+
+        Unlike submit(), neither the function nor anything it closes over is
+        serialized: only the name and the plain data arguments are sent, with
+        the C pickler rather than dill.
+
+        Args:
+            name: The name the task was registered under with register_task.
+            deadline: Overrides the executor's deadline for this call.
+            priority: Calls with lower priorities are started first.
+
+        Returns:
+            A Future of the task's result. Results larger than the executor's
+            max_result_bytes fail with ResultTooLarge.
+        """
+        fn = _tasks.get(name)
+        if fn is None:
+            raise LookupError("No task is registered as {!r}".format(name))
+
+        return self._submit(None, encode_plain((args, kwargs)), None,
+                            task=(name, fn.__module__), deadline=deadline,
+                            priority=priority)
+
+    def submit_tasks(self, name, calls, *, deadline=None, priority=0):
+        """Submits many calls of a registered task at once.
+
+        This is much cheaper than calling submit_task() for each call: the
+        queue management thread is only woken up once, and waiting calls are
+        sent to the workers in batches.
+
+        Args:
+            name: The name the task was registered under with register_task.
+            calls: An iterable of the positional arguments of each call.
+            deadline: Overrides the executor's deadline for each call.
+            priority: Calls with lower priorities are started first.
+
+        Returns:
+            A list of Futures of each call's result, in the order of calls.
+            Cancelling a Future cancels its call, unless it was already sent
+            to a worker.
+        """
+        fn = _tasks.get(name)
+        if fn is None:
+            raise LookupError("No task is registered as {!r}".format(name))
+
+        calls = [(None, encode_plain((tuple(args), {})), None)
+                 for args in calls]
+        return self._submit_all(calls, task=(name, fn.__module__),
+                                deadline=deadline, priority=priority)
+
+    def get_capacity(self):
+        """Gets a snapshot of the pool's capacity.
+
+        Returns:
+            A dict of the live workers, the workers running a call, the calls
+            waiting for a worker, and the workers replaced after passing a
+            deadline or crashing.
+        """
+        processes = self._processes or {}
+        alive = sum(1 for p in list(processes.values()) if p.is_alive())
+        busy = sum(1 for slot in list(self._process_slots.values())
+                   if _get_running_item(self._slots, slot) is not None)
+        return {
+            "workers": alive,
+            "busy": busy,
+            "queued": max(0, len(self._pending_work_items) - busy),
+            "killed": self._recycled["deadline"],
+            "crashed": self._recycled["crash"],
+        }
+
+    def prewarm(self):
+        """Starts every worker process now, instead of on the first submit.
+
+        Each worker runs the initializer as soon as it starts, so the first
+        calls don't pay for process start-up or initialization.
+        """
+        with self._shutdown_lock:
+            if self._shutdown_thread:
+                raise RuntimeError('cannot prewarm after shutdown')
+            self._start_queue_management_thread()
+
     def map(self, fn, *iterables, timeout=None, chunksize=1):
         """Returns an iterator equivalent to map(fn, iter).
 
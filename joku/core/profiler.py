@@ -0,0 +1,140 @@
+"""
+Profiling.
+
+:class:`StartupProfiler` records how long each part of booting the bot takes - importing and setting up each cog,
+each phase of ``on_ready``, and each cog's ``ready()`` hook - so that slow startups can be tracked down.
+
+:class:`SamplingProfiler` samples the stacks of every thread of the live process, producing a collapsed stack file
+that can be turned into a flamegraph.
+"""
+import collections
+import contextlib
+import sys
+import threading
+import time
+import typing
+
+#: The longest a sampling profile can run for, in seconds.
+MAX_PROFILE_SECONDS = 120
+
+
+class StartupProfiler(object):
+    """
+    Collects startup timings.
+    """
+
+    def __init__(self):
+        #: Kind -> name -> seconds taken
+        self.timings = collections.OrderedDict()  # type: typing.Dict[str, typing.Dict[str, float]]
+
+        #: Cog names whose `ready()` is still running.
+        self.running = set()
+
+    def record(self, kind: str, name: str, taken: float):
+        self.timings.setdefault(kind, collections.OrderedDict())[name] = taken
+
+    @contextlib.contextmanager
+    def measure(self, kind: str, name: str):
+        """
+        Measures the wall time of the body.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.perf_counter() - start)
+
+    async def measure_ready(self, name: str, coro: typing.Awaitable):
+        """
+        Awaits a `ready()` hook, recording how long it took.
+        """
+        self.running.add(name)
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.running.discard(name)
+            self.record("ready", name, time.perf_counter() - start)
+
+    def get_report(self) -> typing.List[str]:
+        """
+        :return: The lines of a human readable breakdown.
+        """
+        lines = []
+        for kind, timings in self.timings.items():
+            total = sum(timings.values())
+            lines.append("{} ({:.3f}s total):".format(kind, total))
+            for name, taken in sorted(timings.items(), key=lambda i: -i[1]):
+                lines.append("  {:<40} {:>8.3f}s".format(name, taken))
+
+        if self.running:
+            lines.append("ready (still running):")
+            for name in sorted(self.running):
+                lines.append("  {}".format(name))
+
+        return lines
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stacks of every thread at a fixed interval.
+
+    Sampling happens on its own thread and only reads frames, so it is safe to run against the live bot; the only
+    cost is the GIL time taken by each sample.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+
+        #: Collapsed stack -> the number of samples it was seen in.
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+        # Only one profile at a time.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _format_frame(frame) -> str:
+        code = frame.f_code
+        return "{} ({}:{})".format(code.co_name, code.co_filename, code.co_firstlineno).replace(";", ":")
+
+    def _sample(self, thread_names: typing.Dict[int, str], own_ident: int):
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(self._format_frame(frame))
+                frame = frame.f_back
+
+            stack.append(thread_names.get(ident, "thread-{}".format(ident)))
+            self.stacks[";".join(reversed(stack))] += 1
+
+        self.samples += 1
+
+    def run(self, seconds: float) -> bytes:
+        """
+        Samples for some time. This blocks, so it should be ran in an executor.
+
+        :return: The samples, in the collapsed stack format used by flamegraph tools.
+        """
+        seconds = min(seconds, MAX_PROFILE_SECONDS)
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+
+        try:
+            self.stacks.clear()
+            self.samples = 0
+
+            own_ident = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+                self._sample(thread_names, own_ident)
+                time.sleep(self.interval)
+
+            return "\n".join("{} {}".format(stack, count)
+                             for (stack, count) in self.stacks.most_common()).encode("utf-8")
+        finally:
+            self._lock.release()
@@ -2,6 +2,8 @@
 A redis adapter for the bot.
 """
 import functools
+import struct
+import typing
 
 import aioredis
 import asyncio
@@ -9,6 +11,151 @@ import discord
 import logbook
 import time
 
+#: The number of hashes the compact presence layout spreads users over.
+#: This is chosen so that each bucket stays well under Redis' `hash-max-ziplist-entries`, which keeps every
+#: bucket in the compact ziplist encoding even with several million tracked users.
+PRESENCE_BUCKETS = 65536
+
+#: The fixed-width record stored per user in the compact presence layout.
+#: (last seen, last message, message count) - all unsigned 32-bit big endian.
+PRESENCE_STRUCT = struct.Struct(">III")
+
+# Updates a single compact presence record in place.
+# KEYS[1] is the bucket, ARGV is (packed user id, "seen" or "message", timestamp).
+# The struct format here must match PRESENCE_STRUCT.
+_PRESENCE_UPDATE_SCRIPT = """
+local packed = redis.call('HGET', KEYS[1], ARGV[1])
+local seen, message, count = 0, 0, 0
+if packed then
+  seen, message, count = struct.unpack('>I4I4I4', packed)
+end
+
+local now = tonumber(ARGV[3])
+if ARGV[2] == 'seen' then
+  seen = now
+else
+  message = now
+  count = count + 1
+end
+
+redis.call('HSET', KEYS[1], ARGV[1], struct.pack('>I4I4I4', seen, message, count))
+return count
+"""
+
+# Merges a user's legacy presence keys into their compact record, and deletes the legacy keys.
+# KEYS is (bucket, legacy hash, legacy message count), ARGV[1] is the packed user id.
+# The compact record may already have newer data written since switching layouts, so the timestamps take whichever
+# is newer and the message counts are added together.
+_PRESENCE_MIGRATE_SCRIPT = """
+local last_seen = tonumber(redis.call('HGET', KEYS[2], 'last_seen') or '0')
+local last_message = tonumber(redis.call('HGET', KEYS[2], 'last_message') or '0')
+local msgs = tonumber(redis.call('GET', KEYS[3]) or '0')
+
+local packed = redis.call('HGET', KEYS[1], ARGV[1])
+local seen, message, count = 0, 0, 0
+if packed then
+  seen, message, count = struct.unpack('>I4I4I4', packed)
+end
+
+seen = math.max(seen, math.floor(last_seen))
+message = math.max(message, math.floor(last_message))
+count = count + msgs
+
+redis.call('HSET', KEYS[1], ARGV[1], struct.pack('>I4I4I4', seen, message, count))
+redis.call('DEL', KEYS[2], KEYS[3])
+return 1
+"""
+
+# Caches a tag output under its own key, and records it in the tag's index of outputs.
+# KEYS is (output key, index), ARGV is (output, ttl, the most outputs kept for the tag, now).
+# Outputs that have expired, and then the oldest outputs over the limit, are dropped from the index.
+_TAG_OUTPUT_SET_SCRIPT = """
+local ttl = tonumber(ARGV[2])
+local now = tonumber(ARGV[4])
+if redis.call('TYPE', KEYS[2]).ok ~= 'zset' then
+  -- outputs used to be kept in a hash under the index's key
+  redis.call('DEL', KEYS[2])
+end
+
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ttl)
+redis.call('ZADD', KEYS[2], now, KEYS[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - ttl)
+
+local over = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[3])
+if over > 0 then
+  local oldest = redis.call('ZRANGE', KEYS[2], 0, over - 1)
+  redis.call('DEL', unpack(oldest))
+  redis.call('ZREMRANGEBYRANK', KEYS[2], 0, over - 1)
+end
+
+redis.call('EXPIRE', KEYS[2], ttl)
+return 1
+"""
+
+# Deletes every cached output of a tag, and its index.
+# KEYS[1] is the index.
+_TAG_OUTPUT_CLEAR_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'zset' then
+  return redis.call('DEL', KEYS[1])
+end
+
+local outputs = redis.call('ZRANGE', KEYS[1], 0, -1)
+for i = 1, #outputs, 1000 do
+  redis.call('DEL', unpack(outputs, i, math.min(i + 999, #outputs)))
+end
+redis.call('DEL', KEYS[1])
+return #outputs
+"""
+
+#: Set once every legacy presence key has been migrated into the compact layout.
+PRESENCE_MIGRATED_KEY = "presence-migrated"
+
+
+def get_presence_bucket(user_id: int) -> typing.Tuple[str, bytes]:
+    """
+    Gets the compact presence bucket key and field for a user ID.
+
+    Snowflakes are bucketed by their timestamp part, as the low bits are mostly zero and the high bits
+    are clustered by account age.
+
+    :param user_id: The ID of the user.
+    :return: A tuple of (bucket key, packed field).
+    """
+    bucket = "presence:c:{}".format((user_id >> 22) % PRESENCE_BUCKETS)
+    return bucket, struct.pack(">Q", user_id)
+
+
+class _TimedConnection(object):
+    """
+    Wraps a pooled connection context manager, timing how long the connection is held.
+
+    The time is also counted towards the command running in the current task, if any.
+    """
+
+    def __init__(self, cm, bot):
+        self.cm = cm
+        self.bot = bot
+        self.start = 0.0
+        self._measure = None
+
+    async def __aenter__(self) -> aioredis.Redis:
+        self.start = time.perf_counter()
+        self._measure = self.bot.command_timer.measure("redis")
+        self._measure.__enter__()
+        try:
+            return await self.cm.__aenter__()
+        except BaseException:
+            # __aexit__ is never called if the connection isn't acquired
+            self._measure.__exit__(None, None, None)
+            raise
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self.cm.__aexit__(*exc_info)
+        finally:
+            self._measure.__exit__(None, None, None)
+            self.bot.metrics.redis_latency.observe(time.perf_counter() - self.start)
+
 
 class RedisAdapter(object):
     def __init__(self, bot):
@@ -21,6 +168,9 @@ class RedisAdapter(object):
         self.repl = None  # type: aioredis.Redis
         self._repl_conn = None
 
+        # If the legacy presence keys are known to be migrated, so don't need to be read anymore.
+        self._presence_migrated = False
+
     async def connect(self, *args, **kwargs):
         """
         Connects the redis pool.
@@ -42,7 +192,7 @@ class RedisAdapter(object):
         """
         Gets a new connection from the pool.
         """
-        return self.pool.get()
+        return _TimedConnection(self.pool.get(), self.bot)
 
     async def level_notifs_disabled(self, channel: discord.TextChannel):
         """
@@ -135,12 +285,36 @@ class RedisAdapter(object):
         async with self.get_redis() as redis:
             return await redis.ttl(key)
 
+    @property
+    def compact_presence(self) -> bool:
+        """
+        :return: If presence data is stored in the compact bucketed layout.
+        """
+        return self.bot.config.get("presence_storage", "legacy") == "compact"
+
+    async def _update_compact_presence(self, member: discord.Member, what: str):
+        """
+        Updates a compact presence record for this member.
+
+        :param what: Either "seen" or "message".
+        """
+        bucket, field = get_presence_bucket(member.id)
+
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            return await redis.eval(_PRESENCE_UPDATE_SCRIPT, keys=[bucket],
+                                    args=[field, what, int(time.time())])
+
     async def update_last_seen(self, member: discord.Member):
         """
         Updates the current last seen for this member.
 
         This will set the last seen to now.
         """
+        if self.compact_presence:
+            return await self._update_compact_presence(member, "seen")
+
         async with self.get_redis() as redis:
             assert isinstance(redis, aioredis.Redis)
 
@@ -154,6 +328,9 @@ class RedisAdapter(object):
 
         This will set the last message to now.
         """
+        if self.compact_presence:
+            return await self._update_compact_presence(member, "message")
+
         async with self.get_redis() as redis:
             assert isinstance(redis, aioredis.Redis)
 
@@ -163,10 +340,7 @@ class RedisAdapter(object):
 
             await redis.incr("presence:{}:msgs".format(member.id))
 
-    async def get_presence_data(self, member: discord.Member):
-        """
-        Gets presence data for the specified member.
-        """
+    async def _get_legacy_presence_data(self, member: discord.Member):
         async with self.get_redis() as redis:
             assert isinstance(redis, aioredis.Redis)
 
@@ -179,6 +353,76 @@ class RedisAdapter(object):
                 "last_message": float(tracking.get(b"last_message", b"0").decode())
             }
 
+    async def get_presence_data(self, member: discord.Member):
+        """
+        Gets presence data for the specified member.
+        """
+        if not self.compact_presence:
+            return await self._get_legacy_presence_data(member)
+
+        bucket, field = get_presence_bucket(member.id)
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            packed = await redis.hget(bucket, field)
+            if not self._presence_migrated:
+                self._presence_migrated = bool(await redis.exists(PRESENCE_MIGRATED_KEY))
+
+        data = None
+        if packed is not None:
+            last_seen, last_message, _ = PRESENCE_STRUCT.unpack(packed)
+            data = {
+                "last_seen": float(last_seen),
+                "last_message": float(last_message)
+            }
+
+        if self._presence_migrated:
+            return data
+
+        # until the migration has ran, the older data may still only be in the legacy keys
+        legacy = await self._get_legacy_presence_data(member)
+        if data is None or legacy is None:
+            return data or legacy
+
+        return {key: max(data[key], legacy[key]) for key in data}
+
+    async def migrate_presence_data(self) -> int:
+        """
+        Migrates presence data from the legacy per-user keys into the compact bucketed layout.
+
+        Each user's legacy keys are merged into their compact record and deleted in one script, so this is safe to run
+        while presence is being updated.
+
+        This refuses to run unless presence is stored in the compact layout, as the legacy keys it deletes would
+        still be the ones being read.
+
+        :return: The number of users migrated.
+        """
+        if not self.compact_presence:
+            raise RuntimeError("Presence data is not stored in the compact layout")
+
+        migrated = 0
+
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            async for key in redis.iscan(match="presence:*"):
+                parts = key.decode().split(":")
+                # only `presence:<id>` keys are the legacy hashes
+                if len(parts) != 2 or not parts[1].isdigit():
+                    continue
+
+                user_id = int(parts[1])
+                bucket, field = get_presence_bucket(user_id)
+                await redis.eval(_PRESENCE_MIGRATE_SCRIPT,
+                                 keys=[bucket, key, "presence:{}:msgs".format(user_id)], args=[field])
+                migrated += 1
+
+            await redis.set(PRESENCE_MIGRATED_KEY, b"1")
+
+        self._presence_migrated = True
+        return migrated
+
     async def update_stock_prices(self, channel: discord.TextChannel, new_price: float):
         """
         Updates a stock's cached price.
@@ -194,6 +438,26 @@ class RedisAdapter(object):
             # push to the right of the key
             await redis.rpush(key, str(new_price).encode())
 
+    async def increase_stock_tick(self, guild: discord.Guild) -> int:
+        """
+        Increases the stock tick of a guild, after its stock prices have changed.
+        """
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            key = "stocks:tick:{}".format(guild.id)
+            return await redis.incr(key)
+
+    async def get_stock_tick(self, guild: discord.Guild) -> int:
+        """
+        Gets the stock tick of a guild. This changes every time the guild's stock prices change.
+        """
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            key = "stocks:tick:{}".format(guild.id)
+            return int((await redis.get(key)) or 0)
+
     async def get_historical_prices(self, channel: discord.TextChannel):
         """
         Gets the historical stock prices for a channel.
@@ -207,6 +471,69 @@ class RedisAdapter(object):
 
         return [float(_.decode()) for _ in r]
 
+    async def update_cluster_status(self, cluster_id: int, status: dict):
+        """
+        Updates the status for a cluster.
+
+        The status expires after 30 seconds, so dead clusters drop out on their own.
+        """
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            key = "cluster:{}".format(cluster_id)
+            await redis.hmset_dict(key, **status)
+            await redis.expire(key, 30)
+
+    async def get_cluster_statuses(self) -> typing.Dict[int, dict]:
+        """
+        Gets the statuses of every live cluster.
+        """
+        statuses = {}
+
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            async for key in redis.iscan(match="cluster:*"):
+                cluster_id = int(key.decode().split(":")[1])
+                status = await redis.hgetall(key)
+                statuses[cluster_id] = {k.decode(): v.decode() for (k, v) in status.items()}
+
+        return statuses
+
+    async def get_tag_output(self, guild_id: int, tag_id: int, key: str) -> typing.Union[str, None]:
+        """
+        Gets a cached tag output.
+        """
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            output = await redis.get("tagout:{}:{}:{}".format(guild_id, tag_id, key))
+
+        return output.decode() if output is not None else None
+
+    async def set_tag_output(self, guild_id: int, tag_id: int, key: str, output: str, ttl: int, max_entries: int):
+        """
+        Caches a tag output for `ttl` seconds.
+
+        Only the newest `max_entries` outputs of each tag are kept.
+        """
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            await redis.eval(_TAG_OUTPUT_SET_SCRIPT,
+                             keys=["tagout:{}:{}:{}".format(guild_id, tag_id, key),
+                                   "tagout:{}:{}".format(guild_id, tag_id)],
+                             args=[output.encode(), ttl, max_entries, int(time.time())])
+
+    async def clear_tag_outputs(self, guild_id: int, tag_id: int):
+        """
+        Removes every cached output of a tag.
+        """
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            await redis.eval(_TAG_OUTPUT_CLEAR_SCRIPT, keys=["tagout:{}:{}".format(guild_id, tag_id)])
+
     async def get_cooldown_expiration(self, user: discord.User, bucket: str):
         built_field = "exp:{}:{}".format(user.id, bucket).encode()
 
@@ -0,0 +1,120 @@
+"""
+A cache of deterministic tag outputs.
+
+A deterministic tag's output only depends on its version and its render context (see
+:mod:`joku.core.tagcontext`), so outputs are cached under a hash of both. Editing a tag changes its version, so
+an edited tag can never hit an old output; edits and deletions also drop the tag's outputs straight away, so that
+they don't sit in the cache until they're evicted.
+
+Outputs are kept per guild, either in memory or in Redis, which shares them between every bot process.
+"""
+import collections
+import hashlib
+import pickle
+import typing
+
+#: The default number of outputs kept per guild in memory, or per tag in Redis.
+DEFAULT_MAX_ENTRIES = 128
+
+#: The default number of guilds outputs are kept for, in memory.
+DEFAULT_MAX_GUILDS = 4096
+
+#: How long each output is kept in Redis, in seconds.
+REDIS_TTL = 86400
+
+
+def get_context_key(version: str, context: dict) -> str:
+    """
+    Gets the key a tag output is cached under, from the tag's version and render context.
+    """
+    # contexts are built in a fixed order, so the same context always pickles the same way
+    digest = hashlib.sha1(pickle.dumps(context, protocol=4)).hexdigest()
+    return "{}:{}".format(version, digest)
+
+
+class MemoryOutputCache(object):
+    """
+    Keeps tag outputs in this process, in an LRU per guild.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_guilds: int = DEFAULT_MAX_GUILDS):
+        self.max_entries = max_entries
+        self.max_guilds = max_guilds
+
+        #: Guild ID -> (tag ID, context key) -> output
+        self._guilds = collections.OrderedDict()  # type: typing.Dict[int, typing.Dict[tuple, str]]
+
+    async def get(self, guild_id: int, tag_id: int, key: str) -> typing.Union[str, None]:
+        outputs = self._guilds.get(guild_id)
+        if outputs is None:
+            return None
+
+        output = outputs.get((tag_id, key))
+        if output is not None:
+            outputs.move_to_end((tag_id, key))
+            self._guilds.move_to_end(guild_id)
+
+        return output
+
+    async def put(self, guild_id: int, tag_id: int, key: str, output: str):
+        outputs = self._guilds.get(guild_id)
+        if outputs is None:
+            outputs = self._guilds[guild_id] = collections.OrderedDict()
+            if len(self._guilds) > self.max_guilds:
+                self._guilds.popitem(last=False)
+        else:
+            self._guilds.move_to_end(guild_id)
+
+        outputs[(tag_id, key)] = output
+        outputs.move_to_end((tag_id, key))
+        if len(outputs) > self.max_entries:
+            outputs.popitem(last=False)
+
+    async def invalidate(self, guild_id: int, tag_id: int):
+        outputs = self._guilds.get(guild_id)
+        if outputs is None:
+            return
+
+        for cache_key in [k for k in outputs if k[0] == tag_id]:
+            del outputs[cache_key]
+
+
+class RedisOutputCache(object):
+    """
+    Keeps tag outputs in Redis, each under its own key.
+
+    Each output expires on its own, and only the newest `max_entries` outputs of each tag are kept, as contexts that
+    include things like the member count are rarely seen twice.
+    """
+
+    def __init__(self, redis, ttl: int = REDIS_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    async def get(self, guild_id: int, tag_id: int, key: str) -> typing.Union[str, None]:
+        return await self.redis.get_tag_output(guild_id, tag_id, key)
+
+    async def put(self, guild_id: int, tag_id: int, key: str, output: str):
+        await self.redis.set_tag_output(guild_id, tag_id, key, output, self.ttl, self.max_entries)
+
+    async def invalidate(self, guild_id: int, tag_id: int):
+        await self.redis.clear_tag_outputs(guild_id, tag_id)
+
+
+def from_config(bot, config: dict):
+    """
+    Creates the output cache from the `tags` section of the config.
+
+    :return: The cache, or None if output caching is turned off.
+    """
+    section = config.get("tags", {})
+    backend = section.get("output_cache", "memory")
+
+    if backend == "redis":
+        return RedisOutputCache(bot.redis, max_entries=section.get("output_cache_entries", DEFAULT_MAX_ENTRIES))
+
+    if backend == "memory":
+        return MemoryOutputCache(max_entries=section.get("output_cache_entries", DEFAULT_MAX_ENTRIES))
+
+    return None
@@ -0,0 +1,263 @@
+"""
+Lazily built tag render contexts.
+
+Tags can reference the message, channel, author and guild they were called in. Building all of that for every tag
+call is wasteful, as most tags only use one or two fields, so each tag's source is statically analysed for the
+variables and fields it references, and only those are built.
+
+The analysis is conservative: anything it can't follow (a variable passed to a function, looped over, indexed with
+a non-constant, ...) is treated as a reference to the whole variable.
+
+Contexts are built from plain data only - strings, numbers, bools, lists, dicts and datetimes - which keeps them
+cheap to send to the tag workers.
+
+The same analysis decides if a tag is deterministic: its output only depends on its context, and its context
+doesn't depend on who called it or what arguments they passed. The outputs of these tags can be cached.
+"""
+import re
+import shlex
+import typing
+
+import discord
+
+#: Marks that the whole of a variable or field is referenced.
+ALL = True
+
+#: The top-level variables available to tags.
+TAG_VARIABLES = ("args", "clean_args", "message", "channel", "author", "server")
+
+#: Requirements are a tree of field name -> sub-requirements, or ALL.
+Requirements = typing.Union[bool, typing.Dict[str, typing.Any]]
+
+#: The fields a deterministic tag may reference under each variable, or ALL.
+#: Anything else differs between invocations in the same channel.
+DETERMINISTIC_FIELDS = {
+    "server": ALL,
+    "channel": ALL,
+    "message": {"guild", "channel"},
+    "author": {"guild"},
+}
+
+#: Jinja globals and filters that give a different result each time.
+_JINJA_RANDOM = {"random", "lipsum", "shuffle"}
+
+# Anything in Lua code that gives a different result each time, such as `math.random` or `os.time`.
+_LUA_RANDOM = re.compile(r"\b(random|randomseed|os)\b")
+
+# The environment table itself, which can reach any variable without naming it.
+_LUA_ENV = re.compile(r"\b_ENV\b")
+
+# A reference to a tag variable in Lua code, followed by any `.field` accesses.
+_LUA_REFERENCE = re.compile(r"(?<![\w.:])({})\b((?:\s*\.\s*[A-Za-z_]\w*)*)"
+                            .format("|".join(TAG_VARIABLES)))
+
+
+class TagAnalysis(typing.NamedTuple("TagAnalysis", [("requirements", dict), ("deterministic", bool),
+                                                    ("static", typing.Optional[str])])):
+    """
+    What static analysis found out about a tag.
+
+    :ivar requirements: The variables and fields the tag references.
+    :ivar deterministic: If the tag's output only depends on the guild and channel it is used in.
+    :ivar static: The output of tags that are plain text, which don't need rendering at all.
+    """
+
+
+def _is_deterministic(requirements: dict) -> bool:
+    for name, sub in requirements.items():
+        allowed = DETERMINISTIC_FIELDS.get(name)
+        if allowed is None:
+            return False
+
+        if allowed is not ALL and (sub is ALL or not set(sub) <= allowed):
+            return False
+
+    return True
+
+
+def _add_path(tree: dict, name: str, path: typing.Sequence[str]):
+    """
+    Adds a referenced path to a requirements tree.
+    """
+    if tree.get(name) is ALL:
+        return
+
+    if not path:
+        tree[name] = ALL
+        return
+
+    _add_path(tree.setdefault(name, {}), path[0], path[1:])
+
+
+def analyse_jinja(source: str) -> TagAnalysis:
+    """
+    Finds the tag variables and fields a Jinja template references.
+    """
+    # jinja2 is slow to import, so only import it the first time a tag is analysed
+    from jinja2 import Environment, nodes
+
+    tree = {}
+    random = False
+
+    def visit(node):
+        nonlocal random
+        if isinstance(node, (nodes.Name, nodes.Filter)) and node.name in _JINJA_RANDOM:
+            random = True
+
+        # calling a method, such as `a.b.items()`, references the whole object it is called on
+        if isinstance(node, nodes.Call) and isinstance(node.node, nodes.Getattr):
+            visit(node.node.node)
+            for child in node.iter_child_nodes(exclude=("node",)):
+                visit(child)
+            return
+
+        # follow chains of `a.b.c` and `a["b"]["c"]` back to the variable
+        path = []
+        current = node
+        while True:
+            if isinstance(current, nodes.Getattr):
+                path.insert(0, current.attr)
+            elif isinstance(current, nodes.Getitem) and isinstance(current.arg, nodes.Const) \
+                    and isinstance(current.arg.value, str):
+                path.insert(0, current.arg.value)
+            else:
+                break
+
+            current = current.node
+
+        if isinstance(current, nodes.Name) and current.name in TAG_VARIABLES:
+            _add_path(tree, current.name, path)
+            return
+
+        for child in node.iter_child_nodes():
+            visit(child)
+
+    template = Environment().parse(source)
+    visit(template)
+
+    # plain text parses to output nodes holding nothing but template data
+    static = None
+    if source and all(isinstance(node, nodes.Output) and all(isinstance(n, nodes.TemplateData) for n in node.nodes)
+                      for node in template.body):
+        static = "".join(n.data for node in template.body for n in node.nodes)
+
+    return TagAnalysis(tree, not random and _is_deterministic(tree), static)
+
+
+def analyse_lua(source: str) -> TagAnalysis:
+    """
+    Finds the tag variables and fields a Lua tag references.
+
+    This works on the raw source, so references inside strings and comments are counted too. That only means a
+    field is built when it didn't need to be.
+    """
+    if _LUA_ENV.search(source) is not None:
+        # `_ENV.author`, `local e = _ENV`, ... can't be followed, so the tag could use anything
+        return TagAnalysis({name: ALL for name in TAG_VARIABLES}, False, None)
+
+    tree = {}
+
+    for match in _LUA_REFERENCE.finditer(source):
+        # `a.b:method()` or `a.b[c]` simply counts as using the whole of `a.b`
+        name, chain = match.groups()
+        _add_path(tree, name, [part.strip() for part in chain.split(".")[1:]])
+
+    random = _LUA_RANDOM.search(source) is not None
+    return TagAnalysis(tree, not random and _is_deterministic(tree), None)
+
+
+def analyse(source: str, lua: bool) -> TagAnalysis:
+    """
+    Analyses a tag's source.
+    """
+    return analyse_lua(source) if lua else analyse_jinja(source)
+
+
+class _Lazy(object):
+    """
+    An object whose fields are only computed when referenced.
+    """
+
+    def __init__(self, fields: typing.Dict[str, typing.Callable[[], typing.Any]]):
+        self.fields = fields
+
+
+def _materialize(value, requirements: Requirements):
+    if isinstance(value, _Lazy):
+        if requirements is ALL:
+            return {name: _materialize(field(), ALL) for (name, field) in value.fields.items()}
+
+        return {name: _materialize(value.fields[name](), sub)
+                for (name, sub) in requirements.items() if name in value.fields}
+
+    # anything else, such as a dict of permissions, is already built and sent whole
+    # its references could be method calls like `.items()` rather than keys, so it can't be trimmed to them
+    return value
+
+
+def _permissions(permissions: discord.Permissions) -> dict:
+    return dict(iter(permissions))
+
+
+def _guild(guild: discord.Guild) -> _Lazy:
+    return _Lazy({
+        "name": lambda: guild.name,
+        "icon_url": lambda: guild.icon_url,
+        "id": lambda: guild.id,
+        "member_count": lambda: guild.member_count,
+        "created_at": lambda: guild.created_at,
+    })
+
+
+def _author(message: discord.Message) -> _Lazy:
+    author = message.author
+    return _Lazy({
+        "name": lambda: author.name,
+        "nick": lambda: author.nick,
+        "discriminator": lambda: author.discriminator,
+        "id": lambda: author.id,
+        "colour": lambda: str(author.colour),
+        "mention": lambda: author.mention,
+        "permissions": lambda: _permissions(message.channel.permissions_for(author)),
+        "guild_permissions": lambda: _permissions(author.guild_permissions),
+        "joined_at": lambda: author.joined_at,
+        "created_at": lambda: author.created_at,
+        "guild": lambda: _guild(message.guild),
+    })
+
+
+def _channel(message: discord.Message) -> _Lazy:
+    channel = message.channel
+    return _Lazy({
+        "name": lambda: channel.name,
+        "id": lambda: channel.id,
+        "mention": lambda: channel.mention,
+        "guild": lambda: _guild(message.guild),
+    })
+
+
+def _message(message: discord.Message) -> _Lazy:
+    return _Lazy({
+        "id": lambda: message.id,
+        "content": lambda: message.content,
+        "clean_content": lambda: message.clean_content,
+        "channel": lambda: _channel(message),
+        "guild": lambda: _guild(message.guild),
+        "author": lambda: _author(message),
+    })
+
+
+def build_tag_context(message: discord.Message, prefix: str, requirements: dict) -> dict:
+    """
+    Builds the variables for a tag call, containing only what the requirements reference.
+    """
+    variables = _Lazy({
+        "args": lambda: shlex.split(message.content[len(prefix):])[1:],
+        "clean_args": lambda: shlex.split(message.clean_content[len(prefix):])[1:],
+        "message": lambda: _message(message),
+        "channel": lambda: _channel(message),
+        "author": lambda: _author(message),
+        "server": lambda: _guild(message.guild),
+    })
+
+    return _materialize(variables, requirements)
@@ -10,33 +10,37 @@ from concurrent.futures import ThreadPoolExecutor
 import discord
 import functools
 
-import lupa
 from discord.abc import GuildChannel
-from jinja2 import Template
-from jinja2.sandbox import SandboxedEnvironment
-from lupa._lupa import LuaRuntime
 
-from joku.cogs.lua import sandbox_preamble, dictify_table_recursively, NO_RESULT
+from joku.cogs.lua import dictify_table_recursively, get_runtime, tag_getter, warm_runtimes
 from joku.core.bot import Context, Jokusoramame
-from joku.core.mp2 import ProcessPoolExecutor
+from joku.core.compilecache import CompiledCache, get_tag_version
+from joku.core import tagcache
+from joku.core.mp2 import register_task
+from joku.core.tagcontext import TagAnalysis, analyse, build_tag_context
 from joku.db.tables import Tag
 
 
-class TagEngine(object):
-    def __init__(self, bot: Jokusoramame):
-        # Template environment.
-        # This is a SandboxedEnvironment for security purposes.
-        self.tmpl_env = SandboxedEnvironment()
+#: The compiled Jinja templates of this worker process.
+_template_cache = None  # type: CompiledCache
 
-        # The process pool used.
-        self.executor = ProcessPoolExecutor()
+#: The template environment of this worker process.
+_tmpl_env = None
 
-        # The bot instance.
-        # We use this for getting the tag instance.
-        self.bot = bot
+
+def _get_tmpl_env() -> 'SandboxedEnvironment':
+    """
+    :return: This worker's template environment. This is a SandboxedEnvironment for security purposes.
+    """
+    global _tmpl_env
+
+    if _tmpl_env is None:
+        # jinja2 is slow to import, so only the workers import it
+        from jinja2.sandbox import SandboxedEnvironment
+        _tmpl_env = SandboxedEnvironment()
 
         # Update the globals of the template environment.
-        self.tmpl_env.globals.update(
+        _tmpl_env.globals.update(
             {
                 "random": random,
                 "string": string,
@@ -46,100 +50,159 @@ class TagEngine(object):
             }
         )
 
-    @staticmethod
-    def _lua_render_template(luastr: str, kwargs=None):
-        """
-        Renders a Lua template.
-        """
+    return _tmpl_env
 
-        def getter(obj, attr_name):
-            if attr_name.startswith("_"):
-                raise AttributeError("Not allowed to access attribute `{}` of `{}`"
-                                     .format(attr_name, type(obj).__name__))
 
-            return attr_name
+def _get_template_cache() -> CompiledCache:
+    global _template_cache
 
-        def setter(obj, attr_name, value):
-            raise AttributeError("Python object attribute setting is forbidden")
+    if _template_cache is None:
+        _template_cache = CompiledCache()
 
-        # the attribute_handlers are probably enough to prevent access eval otherwise
-        lua = LuaRuntime(register_eval=False,
-                         unpack_returned_tuples=True,
-                         attribute_handlers=(getter, setter))
+    return _template_cache
 
-        # execute the sandbox preamble
-        sandbox = lua.execute(sandbox_preamble)
 
-        # call sandbox.run with `glob.sandbox, code`
-        # and unpack the variables
-        new = {}
-        # HECK
-        for key, val in kwargs.items():
-            new[key] = lua.table_from(val)
+def _init_worker(cache_bytes: int = None, lua_limits: dict = None):
+    """
+    Warms up a tag worker process: the template environment, the template cache and the Lua runtime.
+    """
+    global _template_cache
 
-        _ = sandbox.run(luastr, lua.table_from(new))
-        if isinstance(_, bool):
-            # idk
-            return NO_RESULT
+    _template_cache = CompiledCache(cache_bytes) if cache_bytes else CompiledCache()
+    _get_tmpl_env()
+    warm_runtimes(tag_getter, cache_bytes=cache_bytes, limits=lua_limits)
 
-        called, result = _
 
-        if lupa.lua_type(result) == 'table':
-            # dictify
-            result = dictify_table_recursively(result)
+@register_task("tags.render_lua")
+def _lua_render_template(tag_id: int, version: str, luastr: str, kwargs=None):
+    """
+    Renders a Lua template.
+    """
+    # lupa is only imported inside the worker processes
+    import lupa
 
-        return str(result)
+    # the runtime is created once per worker, with the sandbox already loaded
+    # and the chunk is only compiled the first time this version of the tag is used
+    _ = get_runtime(tag_getter).run_cached((tag_id, version), luastr, kwargs)
+    if isinstance(_, bool):
+        # nothing was returned, so there is nothing to send
+        return None
 
-    @staticmethod
-    def _pp_render_template(tmpl_env: SandboxedEnvironment, tag: Tag, kwargs=None):
-        """
-        Called inside the process pool to render the template.
-        """
-        template = tmpl_env.from_string(tag.content or "Broken tag!")  # type: Template
+    called, result = _
 
-        # variables = tag.get("variables", {})
+    if lupa.lua_type(result) == 'table':
+        # dictify
+        result = dictify_table_recursively(result)
 
-        # def _set_variable(name, value):
-        #     variables[name] = value
+    return str(result)
 
-        # local = {
-        #     "set_variable": _set_variable,
-        #     **variables,
-        # }
-        # if kwargs:
-        #     local.update(kwargs)
 
-        rendered = template.render(**kwargs)
+@register_task("tags.render_jinja")
+def _pp_render_template(tag_id: int, version: str, content: str, kwargs=None):
+    """
+    Called inside the process pool to render the template.
+    """
+    # edited tags have a new version, so they never hit an old template
+    template = _get_template_cache().get_or_compile((tag_id, version), content or "Broken tag!",
+                                                    _get_tmpl_env().from_string)  # type: jinja2.Template
 
-        return rendered
+    # variables = tag.get("variables", {})
+
+    # def _set_variable(name, value):
+    #     variables[name] = value
+
+    # local = {
+    #     "set_variable": _set_variable,
+    #     **variables,
+    # }
+    # if kwargs:
+    #     local.update(kwargs)
+
+    rendered = template.render(**kwargs)
 
-    async def _render_template(self, tag: Tag, **kwargs):
+    return rendered
+
+
+class TagEngine(object):
+    def __init__(self, bot: Jokusoramame):
+        # The bot instance.
+        # We use this for getting the tag instance, and renders run on its compute service.
+        # Renders are submitted as named tasks on the highest priority queue, so only the tag's plain data crosses
+        # the process boundary and they never wait behind charts.
+        self.bot = bot
+
+        # The variables and fields each tag references, by tag ID and version.
+        # These are tiny, so this is mostly bounded by the entry count.
+        self.analyses = CompiledCache()
+
+        # The outputs of deterministic tags, or None if output caching is turned off.
+        self.outputs = tagcache.from_config(bot, bot.config)
+
+    def get_analysis(self, tag: Tag, version: str) -> TagAnalysis:
         """
-        Renders the template in a process pool.
+        Gets what static analysis found out about a tag, analysing its source the first time this version is used.
         """
-        if tag.lua:
-            partial = functools.partial(self._lua_render_template, tag.content, kwargs)
-        else:
-            partial = functools.partial(self._pp_render_template, self.tmpl_env, tag, kwargs)
+        return self.analyses.get_or_compile((tag.id, version, tag.lua), tag.content or "",
+                                            functools.partial(analyse, lua=tag.lua))
 
-        rendered = await asyncio.wait_for(self.bot.loop.run_in_executor(self.executor, partial), 5, loop=self.bot.loop)
+    async def invalidate(self, guild_id: int, tag_id: int):
+        """
+        Drops the cached outputs of a tag, after it was edited or deleted.
+        """
+        if self.outputs is not None:
+            await self.outputs.invalidate(guild_id, tag_id)
+
+    async def _render_template(self, tag: Tag, ctx: Context = None, **kwargs):
+        """
+        Renders the template on the compute service.
+
+        If no variables are passed, they are built from the context, containing only what the tag references.
+        Plain text tags are returned as they are, and the outputs of deterministic tags are cached.
+        """
+        # only plain data is sent to the workers, not the tag row
+        version = get_tag_version(tag.last_modified, tag.content)
+        cache_key = None
+        if not kwargs and ctx is not None:
+            analysis = self.get_analysis(tag, version)
+            if analysis.static is not None:
+                return analysis.static
+
+            kwargs = build_tag_context(ctx.message, ctx.prefix, analysis.requirements)
+
+            if analysis.deterministic and self.outputs is not None:
+                cache_key = tagcache.get_context_key(version, kwargs)
+                rendered = await self.outputs.get(tag.guild_id, tag.id, cache_key)
+                self.bot.metrics.cache("tag_output", rendered is not None)
+                if rendered is not None:
+                    return rendered
+
+        task = "tags.render_lua" if tag.lua else "tags.render_jinja"
+        coro = self.bot.compute.run_task("tags", task, tag.id, version, tag.content, kwargs)
+
+        rendered = await asyncio.wait_for(coro, 5, loop=self.bot.loop)
+
+        if cache_key is not None and rendered is not None:
+            await self.outputs.put(tag.guild_id, tag.id, cache_key, rendered)
 
         return rendered
 
     async def render_template(self, tag_id: str, ctx: Context = None, guild: discord.Guild = None,
-                              **kwargs) -> str:
+                              check_index: bool = True, **kwargs) -> str:
         """
         Renders a template.
 
         This will load all variables, render the template, and return the rendered template as output.
+        The variables are only built once the tag is known to exist.
+
+        :param check_index: If the tag name index should be checked first, see :meth:`DatabaseInterface.get_tag`.
         """
         guild = guild or ctx.message.guild
 
-        tag = await self.bot.database.get_tag(guild, tag_id)
+        tag = await self.bot.database.get_tag(guild, tag_id, check_index=check_index)
         if not tag:
             return None
 
-        final_template = await self._render_template(tag, **kwargs)
+        final_template = await self._render_template(tag, ctx=ctx, **kwargs)
 
         # await self.bot.database.save_tag(guild, tag_id, content=tag.get("content"),
         #                                  variables=new_variables)
@@ -0,0 +1,225 @@
+"""
+An in-memory index of the tag and alias names in each guild.
+
+Every unknown command is treated as a possible tag, so without this every typo (and every command meant for
+another bot) costs a tag query and an alias query. The index answers "could this be a tag?" without any I/O once a
+guild's names are loaded.
+
+Guilds with a huge number of tags are indexed with a Bloom filter instead of a set. A Bloom filter can give false
+positives, which just fall through to the database, but never false negatives.
+
+The names in a set are also used to suggest tags when a name doesn't exist, again without any I/O.
+"""
+import asyncio
+import difflib
+import hashlib
+import math
+import time
+import typing
+
+#: Guilds with more names than this are indexed with a Bloom filter.
+BLOOM_THRESHOLD = 20000
+
+#: The false positive rate of the Bloom filters.
+BLOOM_ERROR_RATE = 0.01
+
+#: How long a guild's names are trusted for before being reloaded, in seconds.
+INDEX_TTL = 3600
+
+#: How similar a name must be to be suggested, from 0 to 1.
+SUGGESTION_CUTOFF = 0.75
+
+#: Guilds with more names than this get no suggestions, as comparing against every name would block the loop.
+SUGGESTION_MAX_NAMES = 2000
+
+
+class BloomFilter(object):
+    """
+    A fixed size Bloom filter over strings.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = max(capacity, 1)
+
+        #: The number of bits, and the number of hashes per item.
+        self.size = int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / self.capacity * math.log(2))))
+
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> typing.Iterator[int]:
+        # double hashing: two halves of one digest give every position
+        digest = hashlib.sha1(item.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    @property
+    def full(self) -> bool:
+        return self.count > self.capacity
+
+
+class _GuildNames(object):
+    """
+    The names in a single guild.
+    """
+
+    def __init__(self, names: typing.Collection[str]):
+        self.loaded_at = time.monotonic()
+
+        if len(names) > BLOOM_THRESHOLD:
+            # leave room to grow before it has to be rebuilt
+            self.names = BloomFilter(len(names) * 2)
+            for name in names:
+                self.names.add(name)
+        else:
+            self.names = set(names)
+
+    @property
+    def is_bloom(self) -> bool:
+        return isinstance(self.names, BloomFilter)
+
+    @property
+    def stale(self) -> bool:
+        if time.monotonic() - self.loaded_at > INDEX_TTL:
+            return True
+
+        return self.is_bloom and self.names.full
+
+    def add(self, name: str):
+        self.names.add(name)
+
+    def remove(self, name: str):
+        # names can't be removed from a Bloom filter; the database has the final say anyway
+        if not self.is_bloom:
+            self.names.discard(name)
+
+
+class TagNameIndex(object):
+    """
+    Lazily loaded tag and alias names for every guild.
+    """
+
+    def __init__(self, database):
+        self.database = database
+
+        #: Guild ID -> names
+        self._guilds = {}  # type: typing.Dict[int, _GuildNames]
+
+        #: Guild ID -> the task loading its names
+        self._loading = {}  # type: typing.Dict[int, asyncio.Task]
+
+        #: Guild ID -> changes made while its names were loading, as (added, name)
+        self._pending = {}  # type: typing.Dict[int, typing.List[typing.Tuple[bool, str]]]
+
+        self.hits = 0
+        self.rejections = 0
+
+    async def _load(self, guild_id: int) -> _GuildNames:
+        self._pending[guild_id] = []
+        try:
+            names = await self.database.get_tag_names(guild_id)
+            index = _GuildNames(names)
+
+            for added, name in self._pending[guild_id]:
+                if added:
+                    index.add(name)
+                else:
+                    index.remove(name)
+
+            self._guilds[guild_id] = index
+            return index
+        finally:
+            self._pending.pop(guild_id, None)
+            self._loading.pop(guild_id, None)
+
+    async def _get(self, guild_id: int) -> _GuildNames:
+        index = self._guilds.get(guild_id)
+        if index is not None and not index.stale:
+            return index
+
+        task = self._loading.get(guild_id)
+        if task is None:
+            task = self._loading[guild_id] = self.database.bot.loop.create_task(self._load(guild_id))
+
+        return await task
+
+    async def might_exist(self, guild_id: int, name: str) -> bool:
+        """
+        Checks if a tag or alias could exist with this name.
+
+        :return: False if there is definitely no such tag. True if there probably is.
+        """
+        index = await self._get(guild_id)
+        if name in index.names:
+            self.hits += 1
+            return True
+
+        self.rejections += 1
+        return False
+
+    def get_similar(self, guild_id: int, name: str, limit: int, cutoff: float = SUGGESTION_CUTOFF) -> typing.List[str]:
+        """
+        Gets the names most similar to a name, out of the names already loaded for a guild.
+
+        Nothing is loaded for this. Guilds indexed with a Bloom filter have no names to compare with, and guilds with
+        more than `SUGGESTION_MAX_NAMES` names take too long to compare with, so neither get suggestions.
+
+        :param cutoff: The lowest similarity to include, from 0 to 1.
+        :return: Up to `limit` names, most similar first.
+        """
+        index = self._guilds.get(guild_id)
+        if index is None or index.is_bloom or len(index.names) > SUGGESTION_MAX_NAMES:
+            return []
+
+        # names too much shorter or longer than this one can't be similar enough
+        shortest, longest = len(name) * cutoff / (2 - cutoff), len(name) * (2 - cutoff) / cutoff
+        candidates = [candidate for candidate in index.names if shortest <= len(candidate) <= longest]
+
+        return difflib.get_close_matches(name, candidates, n=limit, cutoff=cutoff)
+
+    def add(self, guild_id: int, name: str):
+        """
+        Records that a tag or alias with this name now exists.
+        """
+        pending = self._pending.get(guild_id)
+        if pending is not None:
+            pending.append((True, name))
+
+        index = self._guilds.get(guild_id)
+        if index is not None:
+            index.add(name)
+
+    def remove(self, guild_id: int, name: str):
+        """
+        Records that a tag or alias with this name no longer exists.
+        """
+        pending = self._pending.get(guild_id)
+        if pending is not None:
+            pending.append((False, name))
+
+        index = self._guilds.get(guild_id)
+        if index is not None:
+            index.remove(name)
+
+    def invalidate(self, guild_id: int):
+        self._guilds.pop(guild_id, None)
+
+    def get_stats(self) -> dict:
+        return {
+            "guilds": len(self._guilds),
+            "bloom_guilds": sum(1 for index in self._guilds.values() if index.is_bloom),
+            "hits": self.hits,
+            "rejections": self.rejections,
+        }
@@ -0,0 +1,261 @@
+"""
+Supervised background tasks.
+
+Every long running task the bot starts goes through the :class:`TaskSupervisor`, which names it, groups it under
+the cog that owns it, and times how much CPU each step of it takes. When an extension is unloaded every task
+owned by its cogs is cancelled, so reloading a cog never leaves its old loops running alongside the new ones.
+
+Tasks started from inside a supervised task inherit its owner, so a job started by a cog's ``ready()`` is
+cancelled along with it.
+"""
+import asyncio
+import time
+import typing
+
+import logbook
+
+#: The longest a crashed loop will wait before being restarted.
+MAX_BACKOFF = 300
+
+#: How long a loop has to run for its backoff to be reset.
+STABLE_AFTER = 60
+
+
+class TaskInfo(object):
+    """
+    Book-keeping for a single supervised task.
+    """
+
+    def __init__(self, name: str, owner: str):
+        self.name = name
+        self.owner = owner
+
+        self.task = None  # type: asyncio.Task
+        self.started_at = time.time()
+
+        #: The CPU time spent inside this task, in seconds.
+        self.cpu_time = 0.0
+
+        #: The number of times this task has been resumed.
+        self.steps = 0
+
+        #: The number of times this task has been restarted after crashing.
+        self.restarts = 0
+
+    @property
+    def state(self) -> str:
+        if not self.task.done():
+            return "running"
+
+        if self.task.cancelled():
+            return "cancelled"
+
+        return "crashed" if self.task.exception() is not None else "finished"
+
+
+class _Timed(object):
+    """
+    Wraps a coroutine, timing every step of it on the thread CPU clock.
+    """
+
+    def __init__(self, coro: typing.Awaitable, info: TaskInfo):
+        self.coro = coro
+        self.info = info
+
+    def __await__(self):
+        coro = self.coro.__await__()
+        value, exc = None, None
+
+        while True:
+            start = time.thread_time()
+            try:
+                if exc is not None:
+                    future = coro.throw(exc)
+                else:
+                    future = coro.send(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.info.cpu_time += time.thread_time() - start
+                self.info.steps += 1
+
+            try:
+                value, exc = (yield future), None
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:
+                value, exc = None, e
+
+
+class TaskSupervisor(object):
+    """
+    Tracks every background task the bot starts.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.logger = logbook.Logger("Jokusoramame.Tasks")
+
+        #: Task name -> info
+        self._tasks = {}  # type: typing.Dict[str, TaskInfo]
+
+        #: asyncio task -> info, used to inherit owners.
+        self._by_task = {}  # type: typing.Dict[asyncio.Task, TaskInfo]
+
+    def _current_owner(self) -> typing.Union[str, None]:
+        try:
+            current = asyncio.Task.current_task(loop=self.bot.loop)
+        except AttributeError:
+            current = asyncio.current_task(loop=self.bot.loop)
+
+        info = self._by_task.get(current)
+        return info.owner if info is not None else None
+
+    def _start(self, name: str, owner: str, factory: typing.Callable[[TaskInfo], typing.Awaitable]) -> asyncio.Task:
+        existing = self._tasks.get(name)
+        if existing is not None and not existing.task.done():
+            return existing.task
+
+        info = TaskInfo(name, owner or self._current_owner() or "bot")
+        info.task = self.bot.loop.create_task(factory(info))
+        self._tasks[name] = info
+        self._by_task[info.task] = info
+        info.task.add_done_callback(lambda t: self._done(info))
+
+        return info.task
+
+    def _done(self, info: TaskInfo):
+        self._by_task.pop(info.task, None)
+
+        if info.task.cancelled():
+            return
+
+        exc = info.task.exception()
+        if exc is None:
+            # nothing interesting to show, so don't let one-off tasks pile up
+            if self._tasks.get(info.name) is info:
+                del self._tasks[info.name]
+            return
+
+        # crashed tasks are kept for the debug listing until pruned or replaced
+        self.logger.error("Task `{}` ({}) crashed: {!r}".format(info.name, info.owner, exc))
+
+    def spawn(self, coro: typing.Awaitable, *, name: str, owner: str = None) -> asyncio.Task:
+        """
+        Starts a supervised task.
+
+        If a task with this name is still running, it is returned instead and ``coro`` is closed.
+
+        :param coro: The coroutine to run.
+        :param name: The unique name of this task.
+        :param owner: The cog that owns this task. Defaults to the owner of the current task, or ``bot``.
+        """
+        existing = self._tasks.get(name)
+        if existing is not None and not existing.task.done():
+            if hasattr(coro, "close"):
+                coro.close()
+            return existing.task
+
+        async def _run(info: TaskInfo):
+            return await _Timed(coro, info)
+
+        return self._start(name, owner, _run)
+
+    def spawn_loop(self, factory: typing.Callable[[], typing.Awaitable], *, name: str,
+                   owner: str = None) -> asyncio.Task:
+        """
+        Starts a supervised task that is restarted with backoff if it crashes.
+
+        The task is finished once ``factory()`` returns normally or is cancelled.
+
+        :param factory: A callable returning a new coroutine for each run.
+        :param name: The unique name of this task.
+        :param owner: The cog that owns this task. Defaults to the owner of the current task, or ``bot``.
+        """
+        async def _run(info: TaskInfo):
+            backoff = 1
+            while True:
+                started = time.monotonic()
+                try:
+                    return await _Timed(factory(), info)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.logger.exception("Loop `{}` ({}) crashed, restarting in {} seconds."
+                                          .format(info.name, info.owner, backoff))
+
+                if time.monotonic() - started > STABLE_AFTER:
+                    backoff = 1
+
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                info.restarts += 1
+
+        return self._start(name, owner, _run)
+
+    def cancel(self, name: str) -> bool:
+        """
+        Cancels a task by name.
+
+        :return: If a running task was cancelled.
+        """
+        info = self._tasks.get(name)
+        if info is None or info.task.done():
+            return False
+
+        info.task.cancel()
+        return True
+
+    def cancel_owner(self, owner: str) -> int:
+        """
+        Cancels every task owned by a cog.
+
+        :return: The number of tasks cancelled.
+        """
+        cancelled = 0
+        for name, info in list(self._tasks.items()):
+            if info.owner != owner:
+                continue
+
+            if not info.task.done():
+                info.task.cancel()
+                cancelled += 1
+
+            del self._tasks[name]
+
+        if cancelled:
+            self.logger.info("Cancelled {} tasks owned by {}.".format(cancelled, owner))
+
+        return cancelled
+
+    def prune(self):
+        """
+        Forgets about tasks that crashed or were cancelled.
+        """
+        for name, info in list(self._tasks.items()):
+            if info.task.done():
+                del self._tasks[name]
+
+    def get_counts(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """
+        :return: Owner -> state -> the number of tasks.
+        """
+        counts = {}
+        for info in self._tasks.values():
+            by_state = counts.setdefault(info.owner, {})
+            by_state[info.state] = by_state.get(info.state, 0) + 1
+
+        return counts
+
+    def get_rows(self) -> typing.List[list]:
+        """
+        :return: Table rows of (owner, name, state, CPU ms, steps, restarts, age), by CPU time.
+        """
+        now = time.time()
+        rows = []
+        for info in sorted(self._tasks.values(), key=lambda i: (i.owner, -i.cpu_time)):
+            rows.append([info.owner, info.name, info.state, round(info.cpu_time * 1000, 2), info.steps,
+                         info.restarts, int(now - info.started_at)])
+
+        return rows
@@ -0,0 +1,182 @@
+"""
+Per-command latency breakdowns.
+
+While a command runs, the time its task spends awaiting the database, Redis, executors and the Discord HTTP API is
+added up, so that a slow command can be blamed on the right thing. Anything that isn't one of these is the
+command's own time on the event loop.
+
+Time is attributed to the asyncio task the command is running in. Work the command hands off to another task
+is not counted.
+"""
+import asyncio
+import contextlib
+import functools
+import time
+import typing
+
+#: The categories time is split into, besides wall time.
+CATEGORIES = ("db", "redis", "executor", "http")
+
+
+class Breakdown(object):
+    """
+    The time spent by a single command invocation.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.wall = 0.0
+        self.times = dict.fromkeys(CATEGORIES, 0.0)
+
+        # Category -> nesting depth, so that nested calls (a DB method calling another) count once.
+        self._depth = dict.fromkeys(CATEGORIES, 0)
+
+    def busy(self, category: str) -> bool:
+        return self._depth[category] > 0
+
+
+class CommandTimer(object):
+    """
+    Tracks the breakdown of every running command, and aggregates them per command.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+        #: Task -> the breakdown of the command running in it.
+        self._running = {}  # type: typing.Dict[asyncio.Task, Breakdown]
+
+        #: Command name -> [calls, wall, max wall, {category: total}]
+        self.stats = {}  # type: typing.Dict[str, list]
+
+    def _current_task(self) -> typing.Union[asyncio.Task, None]:
+        try:
+            return asyncio.Task.current_task(loop=self.loop)
+        except AttributeError:
+            return asyncio.current_task(loop=self.loop)
+
+    def current(self) -> typing.Union[Breakdown, None]:
+        """
+        :return: The breakdown of the command running in the current task, if any.
+        """
+        if not self._running:
+            return None
+
+        return self._running.get(self._current_task())
+
+    # region Invocations
+    def begin(self) -> Breakdown:
+        breakdown = Breakdown()
+        self._running[self._current_task()] = breakdown
+        return breakdown
+
+    def end(self, name: str) -> typing.Union[Breakdown, None]:
+        breakdown = self._running.pop(self._current_task(), None)
+        if breakdown is None:
+            return None
+
+        breakdown.wall = time.perf_counter() - breakdown.start
+
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = [0, 0.0, 0.0, dict.fromkeys(CATEGORIES, 0.0)]
+
+        stat[0] += 1
+        stat[1] += breakdown.wall
+        stat[2] = max(stat[2], breakdown.wall)
+        for category, taken in breakdown.times.items():
+            stat[3][category] += taken
+
+        return breakdown
+
+    # endregion
+
+    # region Measuring
+    @contextlib.contextmanager
+    def measure(self, category: str, breakdown: Breakdown = None):
+        """
+        Adds the time spent in the body to the current command, if there is one.
+        """
+        breakdown = breakdown or self.current()
+        if breakdown is None:
+            yield
+            return
+
+        breakdown._depth[category] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            breakdown._depth[category] -= 1
+            if breakdown._depth[category] == 0:
+                breakdown.times[category] += time.perf_counter() - start
+
+    def wrap(self, category: str, func: typing.Callable[..., typing.Awaitable]):
+        """
+        Wraps a coroutine function, so that awaiting it is counted under a category.
+        """
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with self.measure(category):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    def instrument(self, obj, category: str, exclude: typing.Iterable[str] = ()):
+        """
+        Wraps every public coroutine method of an object, so that awaiting them is counted under a category.
+        """
+        for name in dir(type(obj)):
+            if name.startswith("_") or name in exclude:
+                continue
+
+            attr = getattr(type(obj), name)
+            if asyncio.iscoroutinefunction(attr):
+                setattr(obj, name, self.wrap(category, getattr(obj, name)))
+
+    def instrument_executor(self, executor):
+        """
+        Patches an executor, so that the time between submitting work and it finishing is counted as executor time.
+
+        Work submitted while the command is awaiting the database is not counted, as the database already counts it.
+        """
+        # process pools have their own ways of submitting, which don't go through submit
+        for name in ("submit", "submit_call", "submit_task"):
+            if hasattr(executor, name):
+                setattr(executor, name, self._wrap_submit(getattr(executor, name)))
+
+    def _wrap_submit(self, submit):
+        @functools.wraps(submit)
+        def wrapper(fn, *args, **kwargs):
+            future = submit(fn, *args, **kwargs)
+
+            breakdown = self.current()
+            if breakdown is None or breakdown.busy("db") or breakdown.busy("executor"):
+                return future
+
+            start = time.perf_counter()
+
+            def _done(_):
+                # this runs on the worker thread, but the command is still waiting on it so nothing else writes here
+                breakdown.times["executor"] += time.perf_counter() - start
+
+            future.add_done_callback(_done)
+            return future
+
+        return wrapper
+
+    # endregion
+
+    def get_rows(self) -> typing.List[list]:
+        """
+        :return: Table rows of (command, calls, mean wall ms, max wall ms, mean ms per category, mean other ms),
+            by total wall time.
+        """
+        rows = []
+        for name, (calls, wall, max_wall, times) in sorted(self.stats.items(), key=lambda i: -i[1][1]):
+            means = [times[category] / calls * 1000 for category in CATEGORIES]
+            other = max(0.0, wall / calls * 1000 - sum(means))
+            rows.append([name, calls, round(wall / calls * 1000, 1), round(max_wall * 1000, 1)]
+                        + [round(m, 1) for m in means] + [round(other, 1)])
+
+        return rows
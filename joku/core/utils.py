@@ -32,10 +32,6 @@ def parse_time(time_str: str, seconds: int=True) -> typing.Union[None, int, typi
         return dt, diff
 
 
-def get_role(guild: discord.Guild, role_id: int) -> discord.Role:
-    return discord.utils.get(guild.roles, id=role_id)
-
-
 def calculate_server_shard(guild: discord.Guild, shard_count: int) -> int:
     """
     Calculates the shard that this server will run on with ``shard_count`` shards.
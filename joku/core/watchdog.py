@@ -0,0 +1,220 @@
+"""
+Event loop lag monitoring.
+
+A heartbeat task on the event loop measures how late each of its wakeups is. A separate watchdog thread checks
+that the heartbeat keeps beating; if it stops for longer than the threshold, the loop is blocked, and the thread
+captures the stack of the loop's thread to find out what is blocking it. Stacks are aggregated, so the report
+shows which code blocks the loop most often rather than a flood of individual tracebacks.
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+import typing
+
+import logbook
+
+#: The lag histogram buckets, in seconds.
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: How many frames of each captured stack are kept.
+STACK_DEPTH = 12
+
+
+class BlockingReport(object):
+    """
+    Aggregated information about a single blocking stack.
+    """
+
+    def __init__(self, stack: typing.Tuple[str, ...]):
+        #: The frames of the stack, innermost last.
+        self.stack = stack
+
+        self.count = 0
+        self.max_lag = 0.0
+        self.last_seen = 0.0
+
+    @property
+    def culprit(self) -> str:
+        """
+        :return: The innermost frame in our own code, or the innermost frame if there is none.
+        """
+        for frame in reversed(self.stack):
+            if "joku" in frame:
+                return frame
+
+        return self.stack[-1] if self.stack else "<unknown>"
+
+
+class LoopWatchdog(object):
+    """
+    Watches the event loop for stalls.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float = 0.25, interval: float = 0.05,
+                 log_interval: float = 60):
+        """
+        :param threshold: How long the loop has to be blocked for, in seconds, before its stack is captured.
+        :param interval: How often the heartbeat beats, in seconds.
+        :param log_interval: The minimum time between two stall warnings in the log, in seconds.
+        """
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = interval
+        self.log_interval = log_interval
+
+        self.logger = logbook.Logger("Jokusoramame.Watchdog")
+
+        #: The most recent lag, in seconds.
+        self.lag = 0.0
+        #: The highest lag seen, in seconds.
+        self.max_lag = 0.0
+        #: The number of heartbeats, and the sum of their lag.
+        self.beats = 0
+        self.total_lag = 0.0
+        #: The number of heartbeats in each bucket of `LAG_BUCKETS`, plus one for anything above.
+        self.histogram = [0] * (len(LAG_BUCKETS) + 1)
+
+        #: The number of stalls over the threshold.
+        self.stalls = 0
+        #: Stack -> report
+        self.blocking = {}  # type: typing.Dict[typing.Tuple[str, ...], BlockingReport]
+
+        self._last_beat = time.monotonic()
+        self._loop_thread = None  # type: int
+        self._thread = None  # type: threading.Thread
+        self._captured = False
+        self._pending = None  # type: BlockingReport
+        self._last_log = 0.0
+        self._suppressed = 0
+        self._stopping = threading.Event()
+
+    # region Heartbeat
+    async def heartbeat(self):
+        """
+        Measures the loop's lag forever. This must be ran on the loop being watched.
+        """
+        self._loop_thread = threading.get_ident()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="joku-watchdog", daemon=True)
+            self._thread.start()
+
+        while True:
+            self._last_beat = before = time.monotonic()
+            self._captured = False
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - before - self.interval)
+            self.record_lag(lag)
+
+            # the watchdog only saw the start of the stall, so fill in how long it really was
+            report, self._pending = self._pending, None
+            if report is not None:
+                report.max_lag = max(report.max_lag, lag)
+
+    def record_lag(self, lag: float):
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.beats += 1
+        self.total_lag += lag
+
+        for i, bucket in enumerate(LAG_BUCKETS):
+            if lag <= bucket:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    @property
+    def mean_lag(self) -> float:
+        return self.total_lag / self.beats if self.beats else 0.0
+
+    # endregion
+
+    # region Watchdog thread
+    def _watch(self):
+        while not self._stopping.wait(self.interval):
+            blocked_for = time.monotonic() - self._last_beat - self.interval
+            if blocked_for < self.threshold or self._captured:
+                continue
+
+            # only capture once per stall, the first stack is the one that got us here
+            self._captured = True
+            try:
+                self._capture(blocked_for)
+            except Exception:
+                # never let the watchdog die
+                pass
+
+    def _capture(self, blocked_for: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+
+        stack = tuple("{}:{} in {}".format(f.filename, f.lineno, f.name)
+                      for f in traceback.extract_stack(frame, limit=STACK_DEPTH))
+        del frame
+
+        report = self.blocking.get(stack)
+        if report is None:
+            report = self.blocking[stack] = BlockingReport(stack)
+
+        report.count += 1
+        report.max_lag = max(report.max_lag, blocked_for)
+        report.last_seen = time.time()
+        self.stalls += 1
+        self._pending = report
+
+        now = time.monotonic()
+        if now - self._last_log < self.log_interval:
+            self._suppressed += 1
+            return
+
+        self.logger.warning("Event loop blocked for over {:.0f}ms in {} ({} similar warnings suppressed)."
+                            .format(blocked_for * 1000, report.culprit, self._suppressed),
+                            extra={"category": "watchdog"})
+        self._last_log = now
+        self._suppressed = 0
+
+    def stop(self):
+        self._stopping.set()
+
+    # endregion
+
+    def get_report(self, limit: int = 10) -> typing.List[BlockingReport]:
+        """
+        :return: The stacks that blocked the loop most often.
+        """
+        return sorted(self.blocking.values(), key=lambda r: (-r.count, -r.max_lag))[:limit]
+
+    def format_report(self, limit: int = 10) -> str:
+        """
+        :return: A plain text report of the lag and the worst blocking stacks.
+        """
+        lines = ["lag: current {:.1f}ms, mean {:.1f}ms, max {:.1f}ms over {} beats; {} stalls over {:.0f}ms"
+                 .format(self.lag * 1000, self.mean_lag * 1000, self.max_lag * 1000, self.beats, self.stalls,
+                         self.threshold * 1000)]
+
+        for report in self.get_report(limit):
+            lines.append("")
+            lines.append("{}x, max {:.0f}ms: {}".format(report.count, report.max_lag * 1000, report.culprit))
+            lines.extend("    " + frame for frame in report.stack)
+
+        return "\n".join(lines)
+
+    def reset(self):
+        """
+        Clears the collected stacks and the max lag.
+        """
+        self.blocking.clear()
+        self.max_lag = 0.0
+        self.stalls = 0
+
+
+def from_config(loop: asyncio.AbstractEventLoop, config: dict) -> LoopWatchdog:
+    """
+    Creates a watchdog from the `watchdog` section of the config.
+    """
+    cfg = config.get("watchdog", {}) or {}
+    return LoopWatchdog(loop, threshold=cfg.get("threshold", 0.25), interval=cfg.get("interval", 0.05),
+                        log_interval=cfg.get("log_interval", 60))
@@ -11,6 +11,7 @@ from sqlalchemy import Column, func
 from sqlalchemy.engine import Engine, create_engine
 from sqlalchemy.orm import sessionmaker, Session
 
+from joku.core.tagindex import TagNameIndex
 from joku.db.tables import User, RoleState, Guild, UserColour, EventSetting, Tag, Reminder, UserStock, Stock, \
     TagAlias
 
@@ -31,6 +32,9 @@ class DatabaseInterface(object):
         self.engine = None  # type: Engine
         self._sessionmaker = None  # type: sessionmaker
 
+        # The tag and alias names in each guild, so that unknown commands can be rejected without a query.
+        self.tag_names = TagNameIndex(self)
+
     async def connect(self, dsn: str):
         """
         Connects the bot to the database.
@@ -46,15 +50,18 @@ class DatabaseInterface(object):
     @contextmanager
     def get_session(self) -> Session:
         session = self._sessionmaker()  # type: Session
+        start = time.perf_counter()
 
         try:
             yield session
             session.commit()
         except:
             session.rollback()
+            self.bot.metrics.db_errors.inc()
             raise
         finally:
             session.close()
+            self.bot.metrics.db_latency.observe(time.perf_counter() - start)
 
     # region Guild
     async def get_or_create_guild(self, guild: discord.Guild) -> Guild:
@@ -142,11 +149,15 @@ class DatabaseInterface(object):
 
             return obbs
 
-    async def update_user_xp(self, member: discord.Member, xp_to_add: int = None) -> User:
+    async def update_user_xp(self, member: discord.Member, xp_to_add: int = None, *,
+                             user: User = None) -> User:
         """
         Updates the XP of a user.
+
+        :param user: The already loaded user object for this member, if available.
         """
-        user = await self.get_or_create_user(member)
+        if user is None:
+            user = await self.get_or_create_user(member)
         async with threadpool():
             with self.get_session() as session:
                 if xp_to_add is None:
@@ -302,10 +313,7 @@ class DatabaseInterface(object):
         g = await self.get_or_create_guild(guild)
 
         # load the role objects
-        roles = [discord.utils.get(guild.roles, id=r_id) for r_id in g.roleme_roles]
-        roles = [_ for _ in roles if _ is not None]
-
-        return roles
+        return self.bot.get_roles(guild, g.roleme_roles)
 
     async def add_roleme_role(self, role: discord.Role) -> Guild:
         """
@@ -359,10 +367,7 @@ class DatabaseInterface(object):
         g = await self.get_or_create_guild(guild)
 
         # load the role objects
-        roles = [discord.utils.get(guild.roles, id=r_id) for r_id in g.colourme_roles]
-        roles = [_ for _ in roles if _ is not None]
-
-        return roles
+        return self.bot.get_roles(guild, g.colourme_roles)
 
     async def add_colourme_role(self, role: discord.Role) -> Guild:
         """
@@ -418,8 +423,7 @@ class DatabaseInterface(object):
                 if uc is None:
                     return None
 
-                role = discord.utils.get(member.guild.roles, id=uc.role_id)
-                return role
+        return self.bot.get_role(member.guild, uc.role_id)
 
     async def set_colourme_role(self, member: discord.Member, role: discord.Role) -> UserColour:
         """
@@ -513,11 +517,17 @@ class DatabaseInterface(object):
     # endregion
 
     # region Tags
-    async def get_tag(self, guild: discord.Guild, name: str,
-                      return_alias: bool = False) -> typing.Union[Tag, typing.Tuple[Tag, TagAlias]]:
+    async def get_tag(self, guild: discord.Guild, name: str, return_alias: bool = False,
+                      check_index: bool = True) -> typing.Union[Tag, typing.Tuple[Tag, TagAlias]]:
         """
         Gets a tag from the database.
+
+        :param check_index: If the tag name index should be checked first. Callers that have already checked it
+            pass False, so that the lookup isn't made (and counted) twice.
         """
+        if check_index and not await self.tag_names.might_exist(guild.id, name):
+            return (None, None) if return_alias else None
+
         async with threadpool():
             with self.get_session() as sess:
                 tag = sess.query(Tag) \
@@ -537,6 +547,73 @@ class DatabaseInterface(object):
         else:
             return tag
 
+    async def get_tag_names(self, guild_id: int) -> typing.Set[str]:
+        """
+        Gets the names of every tag and alias in a guild.
+        """
+        async with threadpool():
+            with self.get_session() as sess:
+                names = {name for (name,) in sess.query(Tag.name).filter(Tag.guild_id == guild_id)}
+                names.update(name for (name,) in sess.query(TagAlias.alias_name)
+                             .filter(TagAlias.guild_id == guild_id))
+
+        return names
+
+    async def get_tag_names_page(self, guild: discord.Guild, page: int,
+                                 per_page: int = 50) -> typing.Tuple[typing.List[str], int]:
+        """
+        Gets a page of the names of the tags in a guild, in alphabetical order.
+
+        :param page: The page to get, starting at 0.
+        :return: A tuple of (the names on this page, the number of tags in the guild).
+        """
+        async with threadpool():
+            with self.get_session() as sess:
+                query = sess.query(Tag.name).filter(Tag.guild_id == guild.id)
+                total = query.count()
+                names = [name for (name,) in query.order_by(Tag.name).offset(page * per_page).limit(per_page)]
+
+        return names, total
+
+    async def search_tags(self, guild: discord.Guild, query: str, limit: int = 10,
+                          prefix: bool = True) -> typing.List[str]:
+        """
+        Searches the tag and alias names in a guild, by prefix and by trigram similarity.
+
+        :param prefix: If names starting with the query match too, rather than only similar names.
+        :return: Up to `limit` names, with prefix matches first and then the most similar names.
+        """
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+        async with threadpool():
+            with self.get_session() as sess:
+                matches = []
+                for name, guild_id in ((Tag.name, Tag.guild_id), (TagAlias.alias_name, TagAlias.guild_id)):
+                    # both conditions can use the trigram index on the name
+                    # pg_trgm's similarity operator is `%`, which has to be escaped for psycopg2
+                    similarity = func.similarity(name, query)
+                    condition = name.op("%%")(query)
+                    order = [similarity.desc()]
+                    if prefix:
+                        condition = name.ilike(pattern) | condition
+                        order.insert(0, name.ilike(pattern).desc())
+
+                    rows = sess.query(name, similarity) \
+                        .filter((guild_id == guild.id) & condition) \
+                        .order_by(*order) \
+                        .limit(limit)
+                    matches.extend(rows)
+
+        lowered = query.lower()
+        matches.sort(key=lambda match: (not match[0].lower().startswith(lowered), -match[1], match[0]))
+
+        names = []
+        for name, _ in matches:
+            if name not in names:
+                names.append(name)
+
+        return names[:limit]
+
     async def get_all_tags_for_guild(self, guild: discord.Guild) -> typing.Sequence[Tag]:
         """
         Gets all tags for this guild.
@@ -565,6 +642,7 @@ class DatabaseInterface(object):
 
                 sess.add(alias)
 
+        self.tag_names.add(guild.id, alias_name)
         return alias
 
     async def remove_tag_alias(self, guild: discord.Guild, alias: TagAlias):
@@ -576,6 +654,7 @@ class DatabaseInterface(object):
             with self.get_session() as sess:
                 sess.delete(alias)
 
+        self.tag_names.remove(guild.id, alias.alias_name)
         return alias
 
     async def save_tag(self, guild: discord.Guild, name: str, content: str, *,
@@ -603,6 +682,8 @@ class DatabaseInterface(object):
                 tag.guild_id = guild.id
                 tag.lua = lua
 
+        self.tag_names.add(guild.id, name)
+        self.bot.dispatch("tag_changed", guild.id, tag.id)
         return tag
 
     async def delete_tag(self, guild: discord.Guild, name: str) -> typing.Union[Tag, None]:
@@ -623,6 +704,11 @@ class DatabaseInterface(object):
                 for alias in aliases:
                     sess.delete(alias)
 
+        self.tag_names.remove(guild.id, tag.name)
+        for alias in aliases:
+            self.tag_names.remove(guild.id, alias.alias_name)
+
+        self.bot.dispatch("tag_changed", guild.id, tag.id)
         return tag
 
     # endregion
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, Integer, DateTime, func, String, ForeignKey, Boolean, Float
+from sqlalchemy import Column, BigInteger, Integer, DateTime, func, String, ForeignKey, Boolean, Float, Index
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY, HSTORE
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.mutable import MutableDict
@@ -170,6 +170,12 @@ class Tag(Base):
     Represents a tag in the database.
     """
     __tablename__ = "tag"
+    __table_args__ = (
+        # trigram index for searching and suggesting tag names
+        Index("ix_tag_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        # listing a guild's tag names in order
+        Index("ix_tag_guild_id_name", "guild_id", "name"),
+    )
 
     #: The ID of the tag.
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False,
@@ -203,6 +209,10 @@ class TagAlias(Base):
     Represents a tag alias.
     """
     __tablename__ = "tag_alias"
+    __table_args__ = (
+        Index("ix_tag_alias_alias_name_trgm", "alias_name", postgresql_using="gin",
+              postgresql_ops={"alias_name": "gin_trgm_ops"}),
+    )
 
     #: The ID of the tag alias.
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False,
@@ -0,0 +1,36 @@
+"""
+Debug pages, only visible to the owner of the bot.
+"""
+import itsdangerous
+from kyoukai.asphalt import HTTPRequestContext
+from kyoukai.blueprint import Blueprint
+from werkzeug.wrappers import Response
+
+from joku.core.bot import Jokusoramame
+
+debug = Blueprint("debug", prefix="/debug")
+
+
+@debug.before_request
+async def check_owner(ctx: HTTPRequestContext):
+    bot = ctx.bot  # type: Jokusoramame
+
+    cookie = ctx.request.cookies.get("joku_user_id")
+    try:
+        # the signed ID is a string
+        uid = int(bot.signer.loads(cookie)) if cookie is not None else None
+    except (itsdangerous.BadData, ValueError):
+        uid = None
+
+    if uid is None or uid != bot.owner_id:
+        raise Response("Forbidden", status=403, mimetype="text/plain")
+
+    return ctx
+
+
+@debug.route("/lag")
+async def lag(ctx: HTTPRequestContext):
+    """
+    Shows the event loop lag, and the stacks that blocked the loop most often.
+    """
+    return Response(ctx.bot.watchdog.format_report(limit=25), mimetype="text/plain")
@@ -0,0 +1,16 @@
+"""
+Prometheus metrics endpoint.
+"""
+from kyoukai.asphalt import HTTPRequestContext
+from kyoukai.blueprint import Blueprint
+from werkzeug.wrappers import Response
+
+metrics = Blueprint("metrics")
+
+
+@metrics.route("/metrics")
+async def render_metrics(ctx: HTTPRequestContext):
+    """
+    Renders every metric in the Prometheus text format.
+    """
+    return Response(ctx.bot.metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -103,7 +103,8 @@ class OAuth2DanceHelper(object):
         """
         Callback that schedules the coroutine above.
         """
-        return self.bot.loop.create_task(self._token_updater(token))
+        return self.bot.tasks.spawn(self._token_updater(token), name="oauth:token:{}".format(token["id"]),
+                                    owner="oauth")
 
     # OAuth2 methods
     def get_redirect_url_and_state(self, scopes: typing.List[str] = None) -> typing.Tuple[str, typing.Any]:
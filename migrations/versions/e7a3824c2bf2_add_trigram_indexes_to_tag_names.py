@@ -0,0 +1,32 @@
+"""Add trigram indexes to tag names
+
+Revision ID: e7a3824c2bf2
+Revises: b9286b9eae48
+Create Date: 2017-06-02 18:41:09.512734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a3824c2bf2'
+down_revision = 'b9286b9eae48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('ix_tag_name_trgm', 'tag', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_tag_alias_alias_name_trgm', 'tag_alias', ['alias_name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'alias_name': 'gin_trgm_ops'})
+    op.create_index('ix_tag_guild_id_name', 'tag', ['guild_id', 'name'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tag_guild_id_name', table_name='tag')
+    op.drop_index('ix_tag_alias_alias_name_trgm', table_name='tag_alias')
+    op.drop_index('ix_tag_name_trgm', table_name='tag')
+    # pg_trgm is left installed, as other databases on the server may use it
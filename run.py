@@ -10,7 +10,7 @@ import os
 import shutil
 import sys
 
-from joku.core.bot import Jokusoramame
+from joku.core.cluster import ClusterLauncher, load_config
 
 
 def main():
@@ -23,6 +23,14 @@ def main():
     if not os.path.exists(config):
         shutil.copy("config.example.yml", config)
 
+    cluster_cfg = load_config(config).get("cluster", {})
+    if cluster_cfg.get("count", 1) > 1:
+        launcher = ClusterLauncher(config, cluster_count=cluster_cfg["count"],
+                                   shard_count=cluster_cfg.get("shard_count", cluster_cfg["count"]))
+        launcher.run()
+        return
+
+    from joku.core.bot import Jokusoramame
     bot = Jokusoramame(config_file=config)
     bot.logger.info("Launching Jokusoramame in autosharded mode...")
     try: